@@ -35,10 +35,17 @@
 #         file dropped by rundir.py. When autocopy is restarted, RunDir state is 
 #         read from sentinal files.
 #      b. No LIMS info is stored by autocopy, to avoid getting out of sync. Query, 
-#         use, forget.
+#         use, forget. LIMS lookups are cached in memory for LIMS_CACHE_TTL_SECONDS
+#         (see lims_cache.py) to spare the LIMS a query per run per pass, but are
+#         refreshed before acting on them, e.g. before starting a copy.
 #      c. However, Autocopy does need to remember pid's for copy operations, and to 
 #         do this it keeps a list of RunDirs stored in Autocopy.rundirs_monitored. 
 #         Each RunDir may contain copy process info (pid, start and stop time).
+#      d. Copies in progress are also written to a copy journal in each run root
+#         (see copy_journal.py), so that a restarted autocopy can reattach to them
+#         instead of starting them over.
+#      e. Likewise, LIMS flag updates not yet written are kept in a queue file next
+#         to the first run root's copy journal (see lims_write_queue.py).
 #   2. Don't crash if you can avoid it, and err on the side of start_copy rather than
 #      waiting for operator intervention. When LIMS is unavailable, a warning should 
 #      be logged and emailed, but autocopy should continue as normal.
@@ -50,6 +57,7 @@
 #         scgpm_lims repository. For new tests that need specific LIMS data, check 
 #         LIMS test data into the scgpm_lims repo rather than depending on the state of 
 #         data in the production or staging LIMS.
+#      b. For load testing against a slow or failing LIMS, use lims_standin.py.
 #   5. There are three modes of external communication. Each may be disabled for testing 
 #      via --no_copy, --no_email, and --test_mode_lims
 #      a. Communication with the LIMS is managed by the scgpm_lims class.
@@ -92,6 +100,30 @@ import requests
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
 from bin.rundir import RunDir
 from bin import rundir_utils
+from bin.copy_queue import CopyQueue
+from bin.copy_journal import CopyJournal, AdoptedProcess
+from bin import transfer
+from bin import manifest
+from bin.checksum_cache import ChecksumCache
+from bin.finalizer import Finalizer
+from bin.lims_cache import LimsCache, NegativeCache
+from bin.lims_batch import LimsBatchClient, PrefetchedConnection
+from bin.circuit_breaker import CircuitBreaker, CircuitOpenError, GuardedCaller
+from bin import lims_write_queue
+from bin.lims_write_queue import LimsWriteQueue
+from bin.notifier import Notifier
+from bin import event_aggregator
+from bin.event_aggregator import EventAggregator
+from bin.event_log import EventLog
+from bin.metrics import MetricsRegistry, MetricsHTTPServer
+from bin import copy_history
+from bin.copy_history import CopyHistory
+from bin.capacity import CapacityModel
+from bin import disk_usage
+from bin import eviction
+from bin.eviction import Evictor
+from bin import profiling
+from bin.profiling import LoopProfiler, ControlFileWatcher
 from scgpm_lims import Connection
 from scgpm_lims import RunInfo, SolexaRun, SolexaFlowCell
 
@@ -104,13 +136,83 @@ class Autocopy:
 
     LOG_DIR_DEFAULT = '/var/log'
 
+    # JSON event log with timings for each phase of each main loop pass (see
+    # event_log.py). Defaults to LOG_DIR_DEFAULT/autocopy_events.jsonl when
+    # logging to LOG_DIR_DEFAULT; with --log_file, set EVENT_LOG_FILE to get one.
+    # Rotated at EVENT_LOG_MAX_BYTES or EVENT_LOG_ROTATE_SECONDS, whichever is
+    # first, keeping EVENT_LOG_BACKUPS old files.
+    EVENT_LOG_FILE = None
+    EVENT_LOG_MAX_BYTES = 100*1024**2
+    EVENT_LOG_ROTATE_SECONDS = 86400
+    EVENT_LOG_BACKUPS = 14
+
+    # Metrics (see metrics.py) are written after every main loop pass to
+    # METRICS_TEXTFILE, e.g. in the node_exporter textfile collector directory,
+    # and/or served at http://METRICS_HOST:METRICS_PORT/metrics. Both are off
+    # unless set.
+    METRICS_TEXTFILE = None
+    METRICS_HOST = 'localhost'
+    METRICS_PORT = None
+
+    # Every finished copy is added to an SQLite history (see copy_history.py),
+    # by default in the first run root's .autocopy directory.
+    COPY_HISTORY_DB = None
+
+    # On SIGUSR2, or the command 'stacks' or 'profile [passes]' in
+    # DEBUG_CONTROL_FILE, autocopy logs the stack of every thread and/or
+    # profiles the next PROFILE_PASSES main loop passes, writing the profile and
+    # a summary of the PROFILE_TOP_FUNCTIONS hottest functions to PROFILE_DIR.
+    # See profiling.py. PROFILE_DIR and DEBUG_CONTROL_FILE default to
+    # LOG_DIR_DEFAULT and LOG_DIR_DEFAULT/autocopy.debug.
+    PROFILE_DIR = None
+    PROFILE_PASSES = 3
+    PROFILE_TOP_FUNCTIONS = 25
+    DEBUG_CONTROL_FILE = None
+    DEBUG_CONTROL_POLL_SECONDS = 5
+
     SUBDIR_COMPLETED = "Runs_Completed" # Runs are moved here after copy
     SUBDIR_ABORTED = "Runs_Aborted" # Runs are moved here if flagged 'sequencing_failed'
 
     LIMS_API_VERSION = 'v1'
 
+    # LIMS lookups are reused for LIMS_CACHE_TTL_SECONDS. After that, cached data
+    # is still used while it is refreshed in the background, for up to
+    # LIMS_CACHE_MAX_STALE_SECONDS, so that a slow LIMS doesn't slow the main loop.
+    LIMS_CACHE_TTL_SECONDS = 900
+    LIMS_CACHE_MAX_STALE_SECONDS = 3600
+
+    # A directory the LIMS doesn't know (404) isn't looked up again for
+    # LIMS_NOT_FOUND_RETRY_SECONDS, doubling with each miss up to
+    # LIMS_NOT_FOUND_MAX_RETRY_SECONDS, unless its descriptor files change.
+    LIMS_NOT_FOUND_RETRY_SECONDS = 300
+    LIMS_NOT_FOUND_MAX_RETRY_SECONDS = 3600
+    RUNDIR_DESCRIPTOR_FILES = ['RunInfo.xml', 'runParameters.xml', 'RunParameters.xml',
+                               os.path.join('Data', 'Intensities', 'config.xml')]
+
+    # If set, runs are looked up LIMS_BATCH_SIZE at a time at the start of each
+    # pass from this batch endpoint (see lims_batch.py), rather than one by one.
+    LIMS_BATCH_URL = None
+    LIMS_BATCH_SIZE = 100
+
+    # LIMS lookups run on LIMS_WORKERS threads, and are given up on after
+    # LIMS_TIMEOUT_SECONDS. After LIMS_BREAKER_FAILURES failures in a row the
+    # LIMS is left alone for LIMS_BREAKER_COOLDOWN_SECONDS and cached data is
+    # used instead (see circuit_breaker.py), so a LIMS outage doesn't hold up copies.
+    LIMS_WORKERS = 4
+    LIMS_TIMEOUT_SECONDS = 30
+    LIMS_BREAKER_FAILURES = 5
+    LIMS_BREAKER_COOLDOWN_SECONDS = 300
+
+    # LIMS flag updates are queued on disk and written by a background thread
+    # (see lims_write_queue.py). A failed write is retried after
+    # LIMS_WRITE_RETRY_SECONDS, doubling up to LIMS_WRITE_MAX_RETRY_SECONDS.
+    LIMS_WRITE_RETRY_SECONDS = 60
+    LIMS_WRITE_MAX_RETRY_SECONDS = 3600
+
     MAX_COPY_PROCESSES = 2 # Cap the number of copy procs
                            # if --no_copy, this is set to 0.
+    COPY_QUEUE_POLICY = CopyQueue.POLICY_OLDEST_FINISHED # Which waiting run gets the next copy slot.
+                                                         # See copy_queue.py for the options.
     EMAIL_TO = None
     EMAIL_FROM = None
 
@@ -119,6 +221,25 @@ class Autocopy:
     AUTOCOPY_SMTP_USERNAME = None
     AUTOCOPY_SMTP_TOKEN = None
 
+    # Email is queued, on disk as well, and sent by a background thread (see
+    # notifier.py). Up to EMAIL_QUEUE_MAX messages are kept; a failed send is
+    # retried after EMAIL_RETRY_SECONDS, doubling up to EMAIL_MAX_RETRY_SECONDS.
+    EMAIL_QUEUE_MAX = 500
+    EMAIL_RETRY_SECONDS = 30
+    EMAIL_MAX_RETRY_SECONDS = 1800
+    EMAIL_FLUSH_SECONDS = 10 # How long to wait for queued email on shutdown
+
+    # Repeats of an event (e.g. the same exception on every pass) are not
+    # emailed again for EVENT_DEDUPE_SECONDS. At most EVENT_RATE_LIMIT
+    # routine emails of each kind are sent per EVENT_RATE_LIMIT_SECONDS; the
+    # rest, and low-importance events, are sent in a digest every
+    # EVENT_DIGEST_DELAY_SECONDS and with the run status summary.
+    # See event_aggregator.py.
+    EVENT_DEDUPE_SECONDS = 3600*6
+    EVENT_RATE_LIMIT = 10
+    EVENT_RATE_LIMIT_SECONDS = 3600
+    EVENT_DIGEST_DELAY_SECONDS = 3600*4
+
     UHTS_LIMS_URL = None
     UHTS_LIMS_TOKEN = None
 
@@ -139,11 +260,74 @@ class Autocopy:
 
     MAIN_LOOP_DELAY_SECONDS = 600
     RUNROOT_FREESPACE_CHECK_DELAY_SECONDS = 3600
+
+    # Every CAPACITY_SAMPLE_SECONDS, the runs being sequenced are measured to
+    # forecast when each run root will fill up (see capacity.py). A warning is
+    # sent, and the root's runs go first in the copy queue, if it will fill
+    # within CAPACITY_WARNING_HOURS or if the runs in progress need more than
+    # is free.
+    CAPACITY_SAMPLE_SECONDS = 1800
+    CAPACITY_WARNING_HOURS = 12
+
+    # With EVICTION_ENABLED, runs in SUBDIR_COMPLETED are deleted when a run
+    # root has less than EVICTION_START_FREE_SPACE free, until it has
+    # EVICTION_STOP_FREE_SPACE, in EVICTION_ORDER ('oldest_first' or
+    # 'largest_first'). Only runs whose copy is verified at the destination
+    # (see eviction.py) and that were moved to SUBDIR_COMPLETED at least
+    # EVICTION_MIN_AGE_SECONDS ago are deleted, at most
+    # EVICTION_FILES_PER_SECOND files a second so that instruments writing to
+    # the same volume aren't slowed. Free space is checked every
+    # EVICTION_CHECK_SECONDS.
+    EVICTION_ENABLED = False
+    EVICTION_START_FREE_SPACE = ONETERA * 3
+    EVICTION_STOP_FREE_SPACE = ONETERA * 5
+    EVICTION_ORDER = eviction.ORDER_OLDEST_FIRST
+    EVICTION_MIN_AGE_SECONDS = 3600*24
+    EVICTION_FILES_PER_SECOND = 200
+    EVICTION_CHECK_SECONDS = 600
     RUNDIRS_MONITORED_SUMMARY_DELAY_SECONDS = 3600*24
+    # Stalled copies are killed and restarted. A copy with progress telemetry
+    # is stalled if no new bytes arrive for COPY_STALL_SECONDS, or (if
+    # COPY_MIN_BYTES_PER_SECOND is set) if its rate over the last
+    # COPY_STALL_SECONDS falls below that floor, counting from its first
+    # progress line so that building the file list isn't a stall. Copies
+    # without telemetry, or still building the file list, fall back to a
+    # restart after SECONDS_BEFORE_COPY_RESTART.
+    COPY_STALL_SECONDS = 1800
+    COPY_MIN_BYTES_PER_SECOND = 0
     SECONDS_BEFORE_COPY_RESTART = 3600*24
 
     last_runroot_freespace_check = None
+    last_capacity_sample = None
     last_rundirs_monitored_summary = None
+    last_event_digest = None
+
+    # Transfer backend used for copies; see transfer.py for the options.
+    # COPY_BACKEND_FIRST_COPY, if set, is used for the first attempt at
+    # copying a run (e.g. 'tar_ssh' for trees of many small files); restarts
+    # always use a resumable backend. COPY_BACKEND_RULES picks a backend per
+    # run: a list of [run name regex, backend name], first match wins.
+    COPY_BACKEND = transfer.RsyncBackend.NAME
+    COPY_BACKEND_FIRST_COPY = None
+    COPY_BACKEND_RULES = []
+
+    # rsync options for machine-readable progress, parsed by copy_progress.py.
+    # --no-inc-recursive makes rsync count all files up front, so that the
+    # percent complete and file totals are meaningful from the start.
+    RSYNC_PROGRESS_ARGS = ['--info=progress2', '--stats', '--no-inc-recursive']
+
+    # Per-file checksum manifest, built while a run is copied and verified at the
+    # destination when the copy finishes (see manifest.py for the algorithms; the
+    # destination needs the matching tool, e.g. b2sum). With the manifest enabled,
+    # first copies skip rsync -c, which is only used to repair a failed verification.
+    MANIFEST_ENABLED = True
+    MANIFEST_HASH_ALGORITHM = 'auto'
+    MANIFEST_THREADS = 4
+    MANIFEST_VERIFY_PARALLELISM = 8
+
+    # Worker threads that finish copied runs (validate, disk usage, move to
+    # SUBDIR_COMPLETED, sentinel file, email) in the background.
+    FINALIZE_WORKERS = 2
 
     # Set the copy executable and add the directory of this script to its path.
     COPY_PROCESS_EXEC_FILENAME = "copy_rundir.py"
@@ -152,12 +336,30 @@ class Autocopy:
     def __init__(self, log_file=None, no_copy=False, no_lims=False, no_email=False, test_mode_lims=False, config=None, errors_to_terminal=False):
         self.initialize_config(config)
         self.initialize_log_file(log_file)
+        self.initialize_event_log(log_file)
+        self.initialize_metrics()
+        self.initialize_profiling()
         self.log_starting_autocopy_message()
         self.initialize_no_copy_option(no_copy)
         self.initialize_hostname()
         self.initialize_lims_connection(test_mode_lims, no_lims)
+        self.initialize_lims_caller()
+        self.initialize_lims_cache()
+        self.initialize_lims_batch_client()
         self.initialize_mail_server(no_email)
         self.initialize_run_roots()
+        self.initialize_copy_journals()
+        self.initialize_lims_write_queue()
+        self.initialize_copy_history()
+        self.initialize_notifier()
+        self.initialize_event_aggregator()
+        self.initialize_checksum_caches()
+        self.initialize_copy_queue()
+        self.initialize_capacity_model()
+        self.initialize_transfer_backends()
+        self.initialize_evictor()
+        self.initialize_manifest_algorithm()
+        self.initialize_finalizer()
         self.initialize_signals()
         self.redirect_stdout_stderr_to_log(errors_to_terminal)
 
@@ -166,29 +368,116 @@ class Autocopy:
             self.restore_stdout_stderr()
         except Exception as e:
             print e
+        self.event_log.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
 
     def run(self):
         self.send_email_autocopy_started()
         while True:
+            loop_start = time.time()
             try:
-                self._main()
+                self.loop_profiler.profile(self._main)
             except Exception, e:
                 print e
+                self.metric_loop_errors.inc()
                 self.send_email_autocopy_exception(e)
+            self.metric_loop_seconds.observe(time.time() - loop_start)
+            self.export_metrics()
             self.log_sleep()
             time.sleep(self.MAIN_LOOP_DELAY_SECONDS)
 
     def _main(self):
-        self.log_main_loop
-        self.update_rundirs_monitored()
-        for rundir in self.rundirs_monitored:
-            self.process_rundir(rundir)
-
-        if self.is_time_for_rundirs_monitored_summary():
-            self.send_email_rundirs_monitored_summary()
+        self.loop_id += 1
+        self.log_main_loop()
+        with self.timed('loop'):
+            with self.timed('collect_finalised'):
+                self.collect_finalised_rundirs()
+            with self.timed('scan'):
+                self.update_rundirs_monitored()
+            # Iterate over a copy, since processing may remove runs from rundirs_monitored.
+            for rundir in list(self.rundirs_monitored):
+                with self.timed('process_rundir', rundir):
+                    self.process_rundir(rundir)
+
+            with self.timed('start_copies'):
+                self.start_queued_copies()
+            with self.timed('save_journals'):
+                self.save_copy_journals()
+
+            with self.timed('email'):
+                if self.is_time_for_rundirs_monitored_summary():
+                    self.send_email_rundirs_monitored_summary()
+                elif self.is_time_for_event_digest():
+                    self.send_email_event_digest()
+
+            if self.is_time_for_runroot_freespace_check():
+                with self.timed('freespace_check'):
+                    self.check_runroot_freespace()
+
+            if self.is_time_for_capacity_sample():
+                with self.timed('capacity_forecast'):
+                    self.update_capacity_forecast()
+
+    def update_metrics(self):
+        # Gauges, set once per pass.
+        states = dict((state, 0) for state in ['not_ready', 'ready_for_copy', 'copying',
+                                               Finalizer.FINALISING, Finalizer.FINALISED, Finalizer.FAILED])
+        for rundir in getattr(self, 'rundirs_monitored', []):
+            state = self.get_rundir_status(rundir)
+            states[state] = states.get(state, 0) + 1
+        for (state, count) in states.items():
+            self.metric_rundirs.set(count, state=state)
+        self.metric_copy_processes.set(self.copy_processes_counter())
+        self.metric_copy_queue.set(len(self.copy_queue))
+        self.metric_lims_breaker_open.set(int(self.lims_caller.breaker.get_state() != CircuitBreaker.CLOSED))
+        self.metric_lims_write_queue.set(self.lims_write_queue.get_depth())
+        if self.notifier is not None:
+            self.metric_email_queue.set(self.notifier.get_depth())
+            self.metric_emails_sent.set(self.notifier.sent)
+            self.metric_emails_dropped.set(self.notifier.dropped)
+        for run_root in self.COPY_SOURCE_RUN_ROOTS:
+            if os.path.isdir(run_root):
+                self.metric_free_bytes.set(self.get_freespace(run_root), run_root=run_root)
+        self.metric_last_loop.set(time.time())
 
-        if self.is_time_for_runroot_freespace_check():
-            self.check_runroot_freespace()
+    def export_metrics(self):
+        try:
+            self.update_metrics()
+            if self.METRICS_TEXTFILE:
+                self.metrics.write_textfile(self.METRICS_TEXTFILE)
+        except Exception as e:
+            # Metrics are for watching autocopy; they mustn't stop it.
+            self.log("Failed to export metrics: %s" % e)
+
+    def record_lims_call(self, call, seconds, error):
+        # Runs on the caller's thread; see GuardedCaller.
+        self.metric_lims_seconds.observe(seconds, call=call)
+        if error is not None and self.is_lims_failure(error):
+            self.metric_lims_errors.inc(call=call, error=error.__class__.__name__)
+
+    def record_copy_metrics(self, rundir):
+        self.metric_copies.inc()
+        if rundir.copy_progress is None:
+            return
+        snapshot = rundir.copy_progress.get_snapshot()
+        self.metric_copied_bytes.inc(snapshot['bytes_transferred'])
+        self.metric_copied_files.inc(snapshot['files_transferred'])
+        if rundir.copy_start_time is not None and rundir.copy_end_time is not None:
+            seconds = (rundir.copy_end_time - rundir.copy_start_time).total_seconds()
+            if seconds > 0:
+                self.metric_copy_throughput.observe(snapshot['bytes_transferred'] / seconds)
+
+    def timed(self, phase, rundir=None):
+        """
+        Function : Context manager that writes the time spent in a phase of the current
+                   main loop pass to the event log.
+        """
+        run_name = None
+        if rundir is not None:
+            run_name = rundir.get_dir()
+        return self.event_log.timed(phase, loop=self.loop_id, run=run_name)
 
     def copy_processes_counter(self):
         count = 0
@@ -207,8 +496,13 @@ class Autocopy:
         Args     : rundir - a rundir.RunDir object
         """
  
+        if rundir.finalize_state is not None:
+            # Copied, and handed to the finalizer.
+            return
+
         self.log_processing_dir(rundir)
-        lims_runinfo = self.get_runinfo_from_lims(rundirObject=rundir) # A scgpm_lims.components.models.RunInfo object
+        with self.timed('lims_lookup', rundir):
+            lims_runinfo = self.get_runinfo_from_lims(rundirObject=rundir) # A scgpm_lims.components.models.RunInfo object
 
         if self.is_rundir_aborted(lims_runinfo):
             if rundir.is_copying():
@@ -220,14 +514,14 @@ class Autocopy:
                 self.process_aborted_rundir(rundirObject=rundir, lims_runinfo=lims_runinfo)
 
         if rundir.is_copying():
-            self.process_copying_rundir(rundir, lims_runinfo)
+            with self.timed('status_check', rundir):
+                self.process_copying_rundir(rundir, lims_runinfo)
 
-        # process_ready_for_copy_rundir goes after process_copying_rundir
-        # because when a copy process fails, process_copying_rundir resets
-        # it to a ready_for_copy state, and we can start the copy process
-        # in process_ready_for_copy_rundir right away.
-        if self.is_rundir_ready_for_copy(rundir):
-            self.process_ready_for_copy_rundir(rundir, lims_runinfo)
+        # Queueing goes after process_copying_rundir because when a copy
+        # process fails, process_copying_rundir resets it to a ready_for_copy
+        # state, and it can compete for a copy slot at the end of this pass.
+        if rundir in self.rundirs_monitored and self.is_rundir_ready_for_copy(rundir):
+            self.enqueue_ready_for_copy_rundir(rundir, lims_runinfo)
 
     def is_rundir_aborted(self, lims_runinfo):
         """
@@ -247,40 +541,157 @@ class Autocopy:
         return rundir.is_finished() and not rundir.is_copying()
 
     def get_rundir_status(self, rundir):
-        if rundir.is_copying():
+        if rundir.finalize_state is not None:
+            return rundir.finalize_state
+        elif rundir.is_copying():
             return "copying"
         elif self.is_rundir_ready_for_copy(rundir):
             return "ready_for_copy"
         else:
             return "not_ready"
 
+    def enqueue_ready_for_copy_rundir(self, rundir, lims_runinfo):
+        if rundir not in self.copy_queue:
+            self.log_enqueue_copy(rundir)
+        self.copy_queue.add(rundir, lims_runinfo)
+
+    def start_queued_copies(self):
+        # Hand free copy slots to queued runs, in the order set by COPY_QUEUE_POLICY.
+        while len(self.copy_queue) > 0:
+            if self.copy_processes_counter() >= self.MAX_COPY_PROCESSES:
+                for rundir in self.copy_queue.get_rundirs():
+                    self.log_reached_copy_processes_max(rundir)
+                return
+            copying_rundirs = [rundir for rundir in self.rundirs_monitored if rundir.is_copying()]
+            entry = self.copy_queue.pop_next(copying_rundirs)
+            entry.rundir.copy_queue_wait = entry.get_wait_seconds()
+            self.process_ready_for_copy_rundir(entry.rundir, entry.lims_runinfo)
+
     def process_ready_for_copy_rundir(self, rundir, lims_runinfo):
         if self.copy_processes_counter() >= self.MAX_COPY_PROCESSES:
             self.log_reached_copy_processes_max(rundir)
             return
 
+        # The run may have waited in the copy queue, so act on current LIMS data.
+        lims_runinfo = self.refresh_runinfo_from_lims(rundir, lims_runinfo)
+        if lims_runinfo and lims_runinfo.has_status_sequencing_failed():
+            self.process_aborted_rundir(rundirObject=rundir, lims_runinfo=lims_runinfo)
+            return
+
         if not lims_runinfo:
             self.send_email_run_not_found_in_lims(rundir.get_dir())
         self.log_start_copy(rundir)
-        self.start_copy(rundir)
+        # A run that failed to copy before picks up where it left off.
+        self.start_copy(rundir, resume=(rundir.copy_restarts > 0))
         if lims_runinfo:
-            lims_runinfo.set_flags_for_sequencing_finished_analysis_started()
+            self.lims_write_queue.put(rundir.get_dir(), lims_write_queue.SEQUENCING_FINISHED)
 
     def process_copying_rundir(self, rundir, lims_runinfo):
         # Check if the copy process finished successfully
         retcode = rundir.copy_proc.poll()
-        if retcode == 0:
-            self.process_completed_rundir(rundir, lims_runinfo)
+        if isinstance(rundir.copy_proc, AdoptedProcess) and retcode is not None:
+            self.process_adopted_copy_exited(rundir)
+        elif retcode == 0:
+            if self.is_copy_verified(rundir):
+                self.dispatch_completed_rundir(rundir, lims_runinfo)
         elif retcode == None:
-            if rundir.seconds_since_copy_started() > self.SECONDS_BEFORE_COPY_RESTART:
+            self.log_copy_progress(rundir)
+            self.get_copy_journal(rundir).record_progress(rundir)
+            stall_reason = self.get_copy_stall_reason(rundir)
+            if stall_reason:
+                self.log_restart_copy(rundir, stall_reason)
                 self.restart_copy(rundir)
-                self.send_email_copy_restarted(rundir.get_dir())
+                self.send_email_copy_restarted(rundir.get_dir(), stall_reason)
         else:
             self.process_failed_copy_rundir(rundir, retcode)
 
+    def get_copy_stall_reason(self, rundir):
+        """
+        Returns : A description of why the copy looks stalled, or None if it is progressing.
+        """
+        progress = rundir.copy_progress
+        seconds_idle = None
+        if progress is not None:
+            seconds_idle = progress.get_seconds_since_bytes()
+        if seconds_idle is None:
+            # No telemetry, or rsync is still building its file list.
+            seconds = rundir.seconds_since_copy_started()
+            if seconds > self.SECONDS_BEFORE_COPY_RESTART:
+                return "copy has been running for %s with no progress information" % self.format_seconds(seconds)
+            return None
+
+        if seconds_idle > self.COPY_STALL_SECONDS:
+            return "no data transferred for %s" % self.format_seconds(seconds_idle)
+
+        if self.COPY_MIN_BYTES_PER_SECOND > 0:
+            rate = progress.get_rate_over(self.COPY_STALL_SECONDS)
+            if rate is not None and rate < self.COPY_MIN_BYTES_PER_SECOND:
+                return "transfer rate %.1f kB/s over the last %s is below the minimum of %.1f kB/s" % (
+                    rate/self.ONEKILO, self.format_seconds(self.COPY_STALL_SECONDS), self.COPY_MIN_BYTES_PER_SECOND/self.ONEKILO)
+        return None
+
     def restart_copy(self, rundir):
+        copy_restarts = rundir.copy_restarts
         rundir.kill_copy_process()
-        self.start_copy(rundir)
+        rundir.copy_restarts = copy_restarts + 1
+        # Files already at the destination are skipped by size and mtime, not rehashed.
+        self.start_copy(rundir, resume=True)
+
+    def is_copy_verified(self, rundir):
+        """
+        Function : Called after the copy process has succeeded. Moves the run through
+                   manifest verification: waits for the manifest, starts verifying it at
+                   the destination, and checks the result. Files that are missing or
+                   different at the destination are repaired once with a checksumming copy.
+        Returns  : True when the run is ready to be completed.
+        """
+        builder = rundir.manifest
+        if builder is None:
+            return True
+        if not builder.is_done():
+            self.log_waiting_for_manifest(rundir)
+            return False
+        if not builder.is_ok():
+            rundir.manifest_status = "not verified, %d files could not be hashed" % len(builder.errors)
+            self.log_manifest_status(rundir)
+            return True
+
+        verifier = rundir.manifest_verifier
+        if verifier is None:
+            backend = self.get_transfer_backend(rundir, resume=True)
+            verifier = manifest.ManifestVerifier(builder, backend, backend.get_dest_path(rundir),
+                                                 parallelism=self.MANIFEST_VERIFY_PARALLELISM)
+            rundir.manifest_verifier = verifier
+            self.log_verifying_manifest(rundir)
+            verifier.start()
+            return False
+        if not verifier.is_done():
+            return False
+
+        if verifier.error is not None:
+            rundir.manifest_status = "not verified, %s" % verifier.error
+        elif verifier.is_ok():
+            rundir.manifest_status = "%d files verified (%s)" % (len(builder.digests), builder.algorithm)
+        else:
+            rundir.manifest_status = "%d files missing and %d files different at the destination" % (
+                len(verifier.missing), len(verifier.mismatched))
+        self.log_manifest_status(rundir)
+        if verifier.error is not None or verifier.is_ok() or rundir.manifest_repaired:
+            return True
+
+        rundir.manifest_repaired = True
+        self.repair_copy(rundir)
+        self.send_email_copy_restarted(rundir.get_dir(), rundir.manifest_status)
+        return False
+
+    def repair_copy(self, rundir):
+        # The copy process has already exited, so there is nothing to kill.
+        rundir.reset_to_copy_not_started()
+        rundir.copy_restarts += 1
+        rundir.manifest = None
+        rundir.manifest_verifier = None
+        self.log_restart_copy(rundir, rundir.manifest_status)
+        self.start_copy(rundir, resume=True, checksum=True)
 
     def process_failed_copy_rundir(self,rundir,retcode):
         """
@@ -290,32 +701,135 @@ class Autocopy:
         self.send_email_rundir_copy_failed(rundirPath=rundirPath,retcode=retcode)
         # Revert status so copy can restart.
         if rundir:
+            self.get_copy_journal(rundir).record_end(rundir)
             rundir.reset_to_copy_not_started()
+            rundir.copy_restarts += 1
+
+    def process_adopted_copy_exited(self, rundir):
+        # A copy started by a previous autocopy has exited. It isn't our child, so
+        # its exit status is unknown: copy again with resume, which only transfers
+        # whatever is missing or incomplete at the destination.
+        self.log_adopted_copy_exited(rundir)
+        self.get_copy_journal(rundir).record_end(rundir)
+        rundir.reset_to_copy_not_started()
+        rundir.copy_restarts += 1
+
+    def dispatch_completed_rundir(self, rundir, lims_runinfo):
+        """
+        Function : Frees the run's copy slot and hands the rest of process_completed_rundir
+                   to the finalizer pool, so the main loop doesn't wait for it.
+                   collect_finalised_rundirs() picks up the result on a later pass.
+        """
+        rundir.unset_copy_proc_and_set_stop_time()
+        self.record_copy_metrics(rundir)
+        self.get_copy_journal(rundir).record_end(rundir)
+        lims_runinfo = self.refresh_runinfo_from_lims(rundir, lims_runinfo)
+        rundir.finalize_state = Finalizer.FINALISING
+        self.finalising_rundirs[rundir.get_path()] = rundir
+        self.log_dispatch_finalize(rundir)
+        self.finalizer.submit(rundir.get_path(), self.finalize_rundir, rundir, lims_runinfo)
+
+    def collect_finalised_rundirs(self):
+        for (path, state, error) in self.finalizer.pop_finished():
+            rundir = self.finalising_rundirs.pop(path)
+            rundir.finalize_state = state
+            self.log_finalize_state(rundir)
+            if state == Finalizer.FINALISED:
+                if rundir in self.rundirs_monitored:
+                    self.rundirs_monitored.remove(rundir)
+            else:
+                # Left in place and skipped until autocopy is restarted, which recopies
+                # (only what is missing) and finalises it again.
+                self.send_email_finalize_failed(rundir, error)
 
     def process_completed_rundir(self, rundir, lims_runinfo):
-        are_files_missing = self.are_files_missing(rundir)
-        lims_problems = self.check_rundir_against_lims(rundir, lims_runinfo)
-        disk_usage = rundir.get_disk_usage()
+        # Synchronous counterpart of dispatch_completed_rundir.
         rundir.unset_copy_proc_and_set_stop_time()
-        self.send_email_rundir_copy_complete(rundir, are_files_missing, lims_problems, disk_usage)
-        dest = os.path.join(rundir.get_root(),self.SUBDIR_COMPLETED,rundir.get_dir())
-        try:
-            os.renames(rundir.get_path(),dest)
-        except OSError as e:
-            raise OSError("Cant move run %s to %s. %s" % (rundir.get_dir(),dest,e.message))
-        self.create_copy_complete_sentinel_file(rundir)
+        self.record_copy_metrics(rundir)
+        self.get_copy_journal(rundir).record_end(rundir)
+        lims_runinfo = self.refresh_runinfo_from_lims(rundir, lims_runinfo)
+        self.finalize_rundir(rundir, lims_runinfo)
         self.rundirs_monitored.remove(rundir)
 
+    def finalize_rundir(self, rundir, lims_runinfo):
+        """
+        Function : Validates a copied run, reports it by email, moves it to SUBDIR_COMPLETED
+                   and drops the copy complete sentinel file at the destination.
+                   Runs on a finalizer thread, so it must not change rundirs_monitored.
+        """
+        with self.timed('finalize', rundir):
+            with self.timed('validate', rundir):
+                are_files_missing = self.are_files_missing(rundir)
+                lims_problems = self.check_rundir_against_lims(rundir, lims_runinfo)
+            with self.timed('disk_usage', rundir):
+                # Files such as InterOp and logs grow in place, unseen by the cached walks.
+                disk_usage = rundir.get_disk_usage(refresh=True)
+            self.record_copy_history(rundir, disk_usage)
+            self.leave_verified_file(rundir)
+            self.send_email_rundir_copy_complete(rundir, are_files_missing, lims_problems, disk_usage)
+            dest = os.path.join(rundir.get_root(),self.SUBDIR_COMPLETED,rundir.get_dir())
+            try:
+                os.renames(rundir.get_path(),dest)
+            except OSError as e:
+                raise OSError("Cant move run %s to %s. %s" % (rundir.get_dir(),dest,e.message))
+            rundir.forget_disk_usage()
+            self.create_copy_complete_sentinel_file(rundir)
+
+    def record_copy_history(self, rundir, disk_usage):
+        """
+        Function : Adds the finished copy of a run to the copy history.
+        Args     : disk_usage - size of the run in gigabytes.
+        """
+        fields = {
+            'run': rundir.get_dir(),
+            'instrument': copy_history.get_instrument(rundir.get_dir()),
+            'run_root': rundir.get_root(),
+            'destination': '%s:%s' % (self.COPY_DEST_HOST, self.COPY_DEST_RUN_ROOT),
+            'backend': rundir.copy_backend,
+            'host': self.HOSTNAME,
+            'source': 'autocopy',
+            'bytes': int(disk_usage * self.ONEGIG),
+            'restarts': rundir.copy_restarts,
+            'queue_wait_seconds': rundir.copy_queue_wait,
+        }
+        if rundir.copy_start_time is not None and rundir.copy_end_time is not None:
+            fields['start_time'] = time.mktime(rundir.copy_start_time.timetuple())
+            fields['end_time'] = time.mktime(rundir.copy_end_time.timetuple())
+            fields['seconds'] = (rundir.copy_end_time - rundir.copy_start_time).total_seconds()
+        if rundir.copy_progress is not None:
+            snapshot = rundir.copy_progress.get_snapshot()
+            fields['bytes_transferred'] = snapshot['bytes_transferred']
+            fields['files'] = snapshot['files_total'] or snapshot['files_transferred']
+        try:
+            self.copy_history.record(**fields)
+        except Exception as e:
+            # The history is for reporting; it mustn't stop a run being finalised.
+            self.log("Failed to add run %s to the copy history: %s" % (rundir.get_dir(), e))
+
+    def leave_verified_file(self, rundir):
+        # Tells the evictor that the run's checksum manifest was verified at the destination.
+        verifier = rundir.manifest_verifier
+        if verifier is None or not verifier.is_ok():
+            return
+        builder = rundir.manifest
+        try:
+            eviction.write_verified_file(rundir.get_path(), manifest.get_manifest_filename(builder.algorithm), len(builder.digests))
+        except (IOError, OSError) as e:
+            # The run can still be evicted after a size comparison.
+            self.log("Failed to record verified copy of run %s: %s" % (rundir.get_dir(), e))
+
+    def verify_copy_for_eviction(self, run_path):
+        return eviction.verify_copy(self.transfer_backends[self.COPY_BACKEND], run_path)
+
+    def record_eviction(self, candidate, reason):
+        self.metric_evicted_runs.inc(run_root=candidate.run_root)
+        self.send_email_run_evicted(candidate, reason)
+
     def create_copy_complete_sentinel_file(self, rundir):
         COPY_COMPLETED_SENTINEL_FILE = 'Autocopy_complete.txt'
         self.log_creating_copy_complete_sentinel_file(rundir, COPY_COMPLETED_SENTINEL_FILE)
-        touch_cmd_list = ['ssh', 
-                          '-l', self.COPY_DEST_USER,
-                          self.COPY_DEST_HOST,
-                          'touch', os.path.join(self.COPY_DEST_RUN_ROOT, rundir.get_dir(), COPY_COMPLETED_SENTINEL_FILE)
-        ]
-        subprocess.call(touch_cmd_list,
-                        stdout=self.LOG_FILE, stderr=self.LOG_FILE)
+        backend = self.get_transfer_backend(rundir, resume=True)
+        backend.touch(os.path.join(backend.get_dest_path(rundir), COPY_COMPLETED_SENTINEL_FILE))
 
     def process_aborted_rundir(self,lims_runinfo,rundirObject=None,rundirPath=None):
         if rundirObject:
@@ -330,7 +844,7 @@ class Autocopy:
             raise OSError("Cant move run %s to %s. %s" % (rundirName,dest,e.message))
         if rundirObject:
             self.rundirs_monitored.remove(rundirObject)
-            lims_runinfo.set_flags_for_sequencing_failed() #may not be a flow cell, which is where scgpm_lims makes the status flag updates.
+            self.lims_write_queue.put(rundirName, lims_write_queue.SEQUENCING_FAILED) #may not be a flow cell, which is where scgpm_lims makes the status flag updates.
         self.send_email_rundir_aborted(rundirPath=rundirPath,dest_path=dest)
         
     def get_freespace(self, directory):
@@ -347,6 +861,13 @@ class Autocopy:
         else:
             return False
 
+    def is_time_for_event_digest(self):
+        if self.event_aggregator.get_digest_size() == 0:
+            return False
+        if self.last_event_digest == None:
+            return True
+        return time.time() - self.last_event_digest > self.EVENT_DIGEST_DELAY_SECONDS
+
     def is_time_for_runroot_freespace_check(self):
         if self.last_runroot_freespace_check == None:
             return True
@@ -356,6 +877,74 @@ class Autocopy:
         else:
             return False
 
+    def is_time_for_capacity_sample(self):
+        if self.last_capacity_sample == None:
+            return True
+        return time.time() - self.last_capacity_sample > self.CAPACITY_SAMPLE_SECONDS
+
+    def update_capacity_forecast(self):
+        """
+        Function : Samples the size and cycle of each run still being sequenced and the free
+                   and reclaimable space of each run root, then warns about, and copies first
+                   from, run roots forecast to fill up.
+        """
+        now = time.time()
+        sequencing = []
+        for rundir in self.rundirs_monitored:
+            try:
+                if rundir.is_finished():
+                    continue
+                # Growth shows up as new files, so the cached usage of unchanged directories is good.
+                bytes_used = rundir.get_disk_usage_bytes()
+                cycle = rundir.get_scored_cycle()
+                total_cycles = rundir.get_total_cycles()
+            except Exception as e:
+                self.log("Can't measure growth of run %s: %s" % (rundir.get_dir(), e))
+                continue
+            self.capacity_model.sample_run(rundir.get_root(), rundir.get_dir(), bytes_used, cycle, total_cycles, now=now)
+            sequencing.append((rundir.get_root(), rundir.get_dir()))
+        self.capacity_model.retain(sequencing)
+
+        for run_root in self.COPY_SOURCE_RUN_ROOTS:
+            completed_dir = os.path.join(run_root, self.SUBDIR_COMPLETED)
+            reclaimable_bytes = 0
+            if os.path.isdir(completed_dir):
+                reclaimable_bytes = disk_usage.get_engine().get_usage(completed_dir)
+            self.capacity_model.sample_root(run_root, self.get_freespace(run_root), reclaimable_bytes, now=now)
+
+        horizon_seconds = self.CAPACITY_WARNING_HOURS * 3600
+        pressured_roots = []
+        for forecast in self.capacity_model.get_forecasts():
+            seconds_to_full = forecast.get_seconds_to_full()
+            self.metric_seconds_to_full.set(seconds_to_full if seconds_to_full is not None else -1, run_root=forecast.run_root)
+            if forecast.is_at_risk(horizon_seconds):
+                pressured_roots.append(forecast.run_root)
+                self.send_email_capacity_forecast(forecast)
+        self.copy_queue.set_pressured_roots(pressured_roots)
+        self.last_capacity_sample = now
+
+    def get_capacity_summary(self):
+        summary = ''
+        for forecast in self.capacity_model.get_forecasts():
+            summary += self.format_capacity_forecast(forecast)
+        if summary:
+            summary = '\nSpace forecast:\n' + summary
+        return summary
+
+    def format_capacity_forecast(self, forecast):
+        text = "%s: %.1f GB free, %.1f GB in %s to reclaim" % (os.path.abspath(forecast.run_root), forecast.free_bytes/self.ONEGIG,
+                                                              forecast.reclaimable_bytes/self.ONEGIG, self.SUBDIR_COMPLETED)
+        seconds_to_full = forecast.get_seconds_to_full()
+        if seconds_to_full is not None:
+            text += ", full in %s at %.1f MB/s" % (self.format_seconds(seconds_to_full), forecast.write_rate/self.ONEMEG)
+        text += ".\n"
+        if forecast.runs:
+            text += "  %d runs in progress will write %.1f GB more" % (forecast.runs, forecast.remaining_bytes/self.ONEGIG)
+            if forecast.runs_unknown:
+                text += " (not counting %d runs whose growth isn't known yet)" % forecast.runs_unknown
+            text += ".\n"
+        return text
+
     def check_runroot_freespace(self):
         for run_root in self.COPY_SOURCE_RUN_ROOTS:
             freespace_bytes = self.get_freespace(run_root)
@@ -373,6 +962,29 @@ class Autocopy:
         else:
             self.LIMS = Connection(apiversion=self.LIMS_API_VERSION, local_only=is_test_mode, lims_url=self.UHTS_LIMS_URL, lims_token=self.UHTS_LIMS_TOKEN)
 
+    def initialize_lims_caller(self):
+        breaker = CircuitBreaker(failure_threshold=self.LIMS_BREAKER_FAILURES,
+                                 cooldown_seconds=self.LIMS_BREAKER_COOLDOWN_SECONDS,
+                                 on_state_change=self.on_lims_breaker_state_change)
+        self.lims_caller = GuardedCaller(workers=self.LIMS_WORKERS, timeout_seconds=self.LIMS_TIMEOUT_SECONDS,
+                                         breaker=breaker, is_failure=self.is_lims_failure,
+                                         on_result=self.record_lims_call)
+
+    def initialize_lims_cache(self):
+        self.lims_cache = LimsCache(lambda run_name: self.lims_caller.call(self.fetch_runinfo, run_name),
+                                    ttl_seconds=self.LIMS_CACHE_TTL_SECONDS,
+                                    max_stale_seconds=self.LIMS_CACHE_MAX_STALE_SECONDS,
+                                    log_function=self.log)
+        self.lims_negative_cache = NegativeCache(retry_seconds=self.LIMS_NOT_FOUND_RETRY_SECONDS,
+                                                 max_retry_seconds=self.LIMS_NOT_FOUND_MAX_RETRY_SECONDS)
+
+    def initialize_lims_batch_client(self):
+        if self.LIMS is None or not self.LIMS_BATCH_URL:
+            self.lims_batch_client = None
+            return
+        token = self.UHTS_LIMS_TOKEN or os.getenv('UHTS_LIMS_TOKEN')
+        self.lims_batch_client = LimsBatchClient(self.LIMS_BATCH_URL, token=token, batch_size=self.LIMS_BATCH_SIZE)
+
     def initialize_mail_server(self, no_email=None):
         if no_email is not None:
             self.NO_EMAIL = no_email
@@ -388,15 +1000,38 @@ class Autocopy:
         if not all((self.AUTOCOPY_SMTP_SERVER, self.AUTOCOPY_SMTP_PORT)):
             raise Exception("AUTOCOPY_SMTP_SERVER and AUTOCOPY_SMTP_PORT must be defined to send mail. Don't want mail? Try --no_mail.")
 
-        self.log_connecting_to_mail_server()
+        # Mail is sent from the notifier thread, which connects when it first has something
+        # to send. Fail now, though, if the server name doesn't resolve.
         try:
-            self.smtp = smtplib.SMTP(self.AUTOCOPY_SMTP_SERVER, self.AUTOCOPY_SMTP_PORT, timeout=5)
-            self.smtp.starttls()
-            if self.AUTOCOPY_SMTP_USERNAME and self.AUTOCOPY_SMTP_TOKEN:
-                self.smtp.login(self.AUTOCOPY_SMTP_USERNAME, self.AUTOCOPY_SMTP_TOKEN)
+            socket.getaddrinfo(self.AUTOCOPY_SMTP_SERVER, self.AUTOCOPY_SMTP_PORT)
         except socket.gaierror:
             raise Exception("Could not connect to SMTP server. Are you offline? Try running with --no_email.")
 
+    def connect_mail_server(self):
+        # Runs on the notifier thread; see initialize_notifier.
+        self.log_connecting_to_mail_server()
+        smtp = smtplib.SMTP(self.AUTOCOPY_SMTP_SERVER, self.AUTOCOPY_SMTP_PORT, timeout=5)
+        smtp.starttls()
+        if self.AUTOCOPY_SMTP_USERNAME and self.AUTOCOPY_SMTP_TOKEN:
+            smtp.login(self.AUTOCOPY_SMTP_USERNAME, self.AUTOCOPY_SMTP_TOKEN)
+        return smtp
+
+    def initialize_event_aggregator(self):
+        self.event_aggregator = EventAggregator(dedupe_seconds=self.EVENT_DEDUPE_SECONDS,
+                                                rate_limit=self.EVENT_RATE_LIMIT,
+                                                rate_limit_seconds=self.EVENT_RATE_LIMIT_SECONDS)
+
+    def initialize_notifier(self):
+        if self.NO_EMAIL:
+            self.notifier = None
+            return
+        # Kept beside the LIMS write queue.
+        journal = self.copy_journals[self.COPY_SOURCE_RUN_ROOTS[0]]
+        self.notifier = Notifier(self.connect_mail_server, path=os.path.join(journal.dir, Notifier.FILENAME),
+                                 max_queued=self.EMAIL_QUEUE_MAX, retry_seconds=self.EMAIL_RETRY_SECONDS,
+                                 max_retry_seconds=self.EMAIL_MAX_RETRY_SECONDS, log_function=self.log)
+        self.notifier.start()
+
     def get_mail_server_settings_from_env(self):
         self.AUTOCOPY_SMTP_SERVER = os.getenv('AUTOCOPY_SMTP_SERVER')
         self.AUTOCOPY_SMTP_PORT = os.getenv('AUTOCOPY_SMTP_PORT')
@@ -412,6 +1047,7 @@ class Autocopy:
         self.AUTOCOPY_SMTP_TOKEN = raw_input("SMTP token: ")
 
     def initialize_log_file(self, log_file):
+        self.log_lock = threading.RLock()
         if log_file == "-":
             self.LOG_FILE = sys.stdout
         elif log_file:
@@ -420,6 +1056,176 @@ class Autocopy:
             self.LOG_FILE = open(os.path.join(self.LOG_DIR_DEFAULT,
                                               "autocopy_%s.log" % datetime.datetime.today().strftime("%y%m%d")),'a')
 
+    def initialize_event_log(self, log_file):
+        path = self.EVENT_LOG_FILE
+        if path is None and log_file is None:
+            path = os.path.join(self.LOG_DIR_DEFAULT, EventLog.FILENAME)
+        self.event_log = EventLog(path, max_bytes=self.EVENT_LOG_MAX_BYTES, rotate_seconds=self.EVENT_LOG_ROTATE_SECONDS,
+                                  backups=self.EVENT_LOG_BACKUPS, log_function=self.log)
+        self.event_log.start()
+        self.loop_id = 0
+
+    def initialize_metrics(self):
+        self.metrics = MetricsRegistry()
+        self.metric_rundirs = self.metrics.gauge('autocopy_rundirs', 'Run directories monitored, by state', ['state'])
+        self.metric_copy_processes = self.metrics.gauge('autocopy_copy_processes', 'Copy processes running')
+        self.metric_copy_queue = self.metrics.gauge('autocopy_copy_queue_length', 'Runs waiting for a copy slot')
+        self.metric_copied_bytes = self.metrics.counter('autocopy_copied_bytes_total', 'Bytes transferred by finished copies')
+        self.metric_copied_files = self.metrics.counter('autocopy_copied_files_total', 'Files transferred by finished copies')
+        self.metric_copies = self.metrics.counter('autocopy_copies_total', 'Copies finished')
+        self.metric_copy_throughput = self.metrics.histogram(
+            'autocopy_copy_throughput_bytes_per_second', 'Average transfer rate of each finished copy',
+            [b * self.ONEMEG for b in [1, 5, 10, 25, 50, 100, 200, 400, 800]])
+        self.metric_loop_seconds = self.metrics.histogram(
+            'autocopy_loop_duration_seconds', 'Duration of main loop passes', [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600])
+        self.metric_loop_errors = self.metrics.counter('autocopy_loop_errors_total', 'Main loop passes that raised an exception')
+        self.metric_lims_seconds = self.metrics.histogram(
+            'autocopy_lims_request_duration_seconds', 'Time waited for LIMS calls, by call', [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+            ['call'])
+        self.metric_lims_errors = self.metrics.counter('autocopy_lims_errors_total', 'Failed LIMS calls, by call and error',
+                                                       ['call', 'error'])
+        self.metric_lims_breaker_open = self.metrics.gauge('autocopy_lims_circuit_open', '1 if LIMS calls are suspended')
+        self.metric_lims_write_queue = self.metrics.gauge('autocopy_lims_write_queue_depth', 'LIMS updates waiting to be written')
+        self.metric_email_queue = self.metrics.gauge('autocopy_email_queue_depth', 'Emails waiting to be sent')
+        self.metric_emails_sent = self.metrics.counter('autocopy_emails_sent_total', 'Emails sent')
+        self.metric_emails_dropped = self.metrics.counter('autocopy_emails_dropped_total', 'Emails given up on')
+        self.metric_free_bytes = self.metrics.gauge('autocopy_run_root_free_bytes', 'Free space in each run root', ['run_root'])
+        self.metric_seconds_to_full = self.metrics.gauge('autocopy_run_root_seconds_to_full',
+                                                         'Forecast seconds until each run root is full, -1 if not filling',
+                                                         ['run_root'])
+        self.metric_evicted_runs = self.metrics.counter('autocopy_evicted_runs_total',
+                                                        'Runs deleted from %s to free space' % self.SUBDIR_COMPLETED, ['run_root'])
+        self.metric_last_loop = self.metrics.gauge('autocopy_last_loop_timestamp_seconds', 'When the last main loop pass finished')
+        self.metrics_server = None
+        if self.METRICS_PORT is not None:
+            self.metrics_server = MetricsHTTPServer(self.metrics, host=self.METRICS_HOST, port=self.METRICS_PORT)
+            self.metrics_server.start()
+
+    def initialize_profiling(self):
+        profile_dir = self.PROFILE_DIR or self.LOG_DIR_DEFAULT
+        self.loop_profiler = LoopProfiler(profile_dir, top=self.PROFILE_TOP_FUNCTIONS, log_function=self.log)
+        control_file = self.DEBUG_CONTROL_FILE or os.path.join(self.LOG_DIR_DEFAULT, 'autocopy.debug')
+        self.debug_control = ControlFileWatcher(control_file, self.handle_debug_command,
+                                                poll_seconds=self.DEBUG_CONTROL_POLL_SECONDS, log_function=self.log)
+        self.debug_control.start()
+
+    def initialize_capacity_model(self):
+        self.capacity_model = CapacityModel()
+
+    def initialize_finalizer(self):
+        self.finalizer = Finalizer(workers=self.FINALIZE_WORKERS, log_function=self.log)
+        self.finalising_rundirs = {}
+
+    def initialize_manifest_algorithm(self):
+        # Resolve 'auto' once, so every manifest of this daemon uses the same algorithm.
+        self.manifest_algorithm = manifest.resolve_algorithm(self.MANIFEST_HASH_ALGORITHM)
+
+    def start_manifest(self, rundir):
+        # Run files don't change once sequencing has finished, so one manifest serves every copy attempt.
+        if not self.MANIFEST_ENABLED or rundir.manifest is not None:
+            return
+        rundir.manifest = manifest.ManifestBuilder(rundir.get_path(), self.manifest_algorithm,
+                                                   threads=self.MANIFEST_THREADS,
+                                                   excludes=transfer.TransferBackend.EXCLUDES,
+                                                   checksum_cache=self.get_checksum_cache(rundir))
+        rundir.manifest.start()
+
+    def initialize_checksum_caches(self):
+        self.checksum_caches = {}
+        for run_root in self.COPY_SOURCE_RUN_ROOTS:
+            self.checksum_caches[run_root] = ChecksumCache.for_run_root(run_root)
+            self.checksum_caches[run_root].prune()
+
+    def get_checksum_cache(self, rundir):
+        run_root = rundir.get_root()
+        if run_root not in self.checksum_caches:
+            self.checksum_caches[run_root] = ChecksumCache.for_run_root(run_root)
+        return self.checksum_caches[run_root]
+
+    def initialize_copy_journals(self):
+        self.copy_journals = {}
+        for run_root in self.COPY_SOURCE_RUN_ROOTS:
+            self.copy_journals[run_root] = CopyJournal(run_root)
+
+    def initialize_lims_write_queue(self):
+        # One queue for the daemon, kept beside the copy journal of the first run root.
+        journal = self.copy_journals[self.COPY_SOURCE_RUN_ROOTS[0]]
+        path = os.path.join(journal.dir, LimsWriteQueue.FILENAME)
+        self.lims_write_queue = LimsWriteQueue(path, self.apply_lims_write,
+                                               retry_seconds=self.LIMS_WRITE_RETRY_SECONDS,
+                                               max_retry_seconds=self.LIMS_WRITE_MAX_RETRY_SECONDS,
+                                               log_function=self.log)
+        if self.LIMS is not None:
+            self.lims_write_queue.start()
+
+    def initialize_copy_history(self):
+        path = self.COPY_HISTORY_DB
+        if path is None:
+            journal = self.copy_journals[self.COPY_SOURCE_RUN_ROOTS[0]]
+            path = os.path.join(journal.dir, CopyHistory.FILENAME)
+        self.copy_history = CopyHistory(path)
+
+    def get_copy_journal(self, rundir):
+        run_root = rundir.get_root()
+        if run_root not in self.copy_journals:
+            self.copy_journals[run_root] = CopyJournal(run_root)
+        return self.copy_journals[run_root]
+
+    def save_copy_journals(self):
+        # Progress is recorded in memory during a pass and written once at the end of it.
+        for journal in self.copy_journals.values():
+            journal.save()
+
+    def restore_copy_from_journal(self, rundir):
+        """
+        Function : Called when autocopy first sees a run. If the copy journal shows a copy
+                   of it was in progress under a previous autocopy, reattaches to that copy
+                   if it is still running, or sets the run up to resume it.
+        """
+        journal = self.get_copy_journal(rundir)
+        entry = journal.get_entry(rundir)
+        if entry is None:
+            return
+        rundir.copy_restarts = entry['copy_restarts']
+        if journal.is_entry_running(entry):
+            copy_proc = AdoptedProcess(entry['pids'])
+            rundir.set_copy_proc_and_start_time(copy_proc)
+            rundir.copy_start_time = datetime.datetime.fromtimestamp(entry['start_time'])
+            rundir.copy_backend = entry['backend']
+            backend = self.transfer_backends.get(entry['backend'])
+            output_path = journal.get_output_path(rundir)
+            if backend is not None and os.path.exists(output_path):
+                rundir.copy_progress = backend.follow_output(rundir, copy_proc, output_path,
+                                                             log_function=self.get_copy_log_function(rundir))
+            self.start_manifest(rundir)
+            self.log_adopt_copy(rundir, entry['pids'])
+        else:
+            self.log_resume_interrupted_copy(rundir)
+            journal.record_end(rundir)
+            rundir.copy_restarts += 1
+
+    def initialize_copy_queue(self):
+        self.copy_queue = CopyQueue(self.COPY_QUEUE_POLICY)
+
+    def initialize_transfer_backends(self):
+        self.transfer_backends = {}
+        for (name, backend_class) in transfer.BACKENDS.items():
+            self.transfer_backends[name] = backend_class(self.COPY_DEST_HOST, self.COPY_DEST_USER, self.COPY_DEST_RUN_ROOT,
+                                                         log_file=self.LOG_FILE, rsync_progress_args=self.RSYNC_PROGRESS_ARGS)
+
+    def initialize_evictor(self):
+        self.evictor = None
+        if not self.EVICTION_ENABLED:
+            return
+        completed_dirs = dict((run_root, os.path.join(run_root, self.SUBDIR_COMPLETED)) for run_root in self.COPY_SOURCE_RUN_ROOTS)
+        self.evictor = Evictor(completed_dirs, self.get_freespace, self.verify_copy_for_eviction,
+                               get_bytes=disk_usage.get_engine().get_usage, order=self.EVICTION_ORDER,
+                               start_free_bytes=self.EVICTION_START_FREE_SPACE, stop_free_bytes=self.EVICTION_STOP_FREE_SPACE,
+                               min_age_seconds=self.EVICTION_MIN_AGE_SECONDS, files_per_second=self.EVICTION_FILES_PER_SECOND,
+                               check_seconds=self.EVICTION_CHECK_SECONDS, on_evicted=self.record_eviction,
+                               on_failed=self.send_email_eviction_refused, log_function=self.log)
+        self.evictor.start()
+
     def initialize_run_roots(self):
         for run_root in self.COPY_SOURCE_RUN_ROOTS:
             self.create_run_root_on_disk(run_root)
@@ -448,6 +1254,10 @@ class Autocopy:
             # Initialize this instance var once after startup
             self.rundirs_monitored = []
 
+        rundir_paths = self.list_rundir_paths()
+        with self.timed('lims_prefetch'):
+            self.prefetch_runinfo_from_lims(rundir_paths)
+
         new_rundirs_monitored = []
         for run_root in self.COPY_SOURCE_RUN_ROOTS:
             new_rundirs_monitored.extend(self.scan_for_rundirs(run_root))
@@ -458,20 +1268,136 @@ class Autocopy:
 #        for missing_rundir in self.rundirs_monitored:
 #            self.send_email_missing_rundir(missing_rundir)
         self.rundirs_monitored = new_rundirs_monitored
+        self.copy_queue.retain(self.rundirs_monitored)
+        self.lims_cache.retain([rundir.get_dir() for rundir in self.rundirs_monitored])
+        self.lims_negative_cache.retain([dirname for (run_root, dirname) in rundir_paths])
 
     def scan_for_rundirs(self, run_root):
         """
         Returns : A list of rundir.RunDir objects.
         """
         rundirs_found_on_disk = []
-        for dirname in os.listdir(run_root):
-            # Get directories, not files
-            if (os.path.isdir(os.path.join(run_root, dirname))) and self.RUNDIR_REG.match(dirname):
-                rundir = self.get_or_create_rundir(run_root, dirname, remove=True)
-                if rundir:
-                    rundirs_found_on_disk.append(rundir)
+        for dirname in self.list_rundir_names(run_root):
+            rundir = self.get_or_create_rundir(run_root, dirname, remove=True)
+            if rundir:
+                rundirs_found_on_disk.append(rundir)
         return rundirs_found_on_disk
 
+    def list_rundir_names(self, run_root):
+        # Get directories, not files
+        return [dirname for dirname in os.listdir(run_root)
+                if os.path.isdir(os.path.join(run_root, dirname)) and self.RUNDIR_REG.match(dirname)]
+
+    def list_rundir_paths(self):
+        """
+        Returns : A list of (run_root, dirname) for the run directories in all run roots.
+        """
+        rundir_paths = []
+        for run_root in self.COPY_SOURCE_RUN_ROOTS:
+            rundir_paths.extend([(run_root, dirname) for dirname in self.list_rundir_names(run_root)])
+        return rundir_paths
+
+    def prefetch_runinfo_from_lims(self, rundir_paths):
+        """
+        Function : Looks up every run directory in rundir_paths whose LIMS data isn't cached,
+                   or is out of date, and caches the results for this pass. With a batch
+                   endpoint, that is one batch request per LIMS_BATCH_SIZE runs; otherwise
+                   the runs are looked up concurrently on the LIMS worker threads. Runs left
+                   out, or all runs if the LIMS fails, are looked up one by one as before.
+                   Runs recently not found in the LIMS are skipped.
+        """
+        if self.LIMS is None:
+            return
+        run_roots = dict((dirname, run_root) for (run_root, dirname) in rundir_paths
+                         if not self.is_missing_from_lims(run_root, dirname))
+        run_names = self.lims_cache.get_expired(run_roots.keys())
+        if not run_names:
+            return
+        if self.lims_batch_client is None:
+            self.prefetch_runinfo_concurrently(run_names, run_roots)
+            return
+        try:
+            records = self.lims_caller.call(self.lims_batch_client.get_runinfo_records, run_names)
+        except CircuitOpenError:
+            return
+        except Exception as e:
+            self.log_lims_error(e)
+            return
+        conn = PrefetchedConnection(self.LIMS, records)
+        for run_name in run_names:
+            if run_name not in records:
+                # The batch endpoint leaves out the runs it doesn't know.
+                self.record_missing_from_lims(run_roots[run_name], run_name)
+                continue
+            try:
+                self.lims_cache.put(run_name, RunInfo(conn=conn, run=run_name))
+            except Exception as e:
+                self.log_lims_error(e)
+        self.log_lims_batch(len(run_names), len(records))
+
+    def prefetch_runinfo_concurrently(self, run_names, run_roots):
+        outcomes = self.lims_caller.call_many(self.fetch_runinfo, run_names)
+        errors = []
+        for (run_name, (runinfo, error)) in outcomes.items():
+            if error is None:
+                self.lims_cache.put(run_name, runinfo)
+            elif self.is_not_found_error(error):
+                self.record_missing_from_lims(run_roots[run_name], run_name)
+            elif self.is_lims_failure(error) and not isinstance(error, CircuitOpenError):
+                errors.append(error)
+        # One line per pass, not one per run, if the LIMS is down.
+        if errors:
+            self.log_lims_error(errors[0])
+
+    def fetch_runinfo(self, run_name):
+        # Runs on a LIMS worker thread; see initialize_lims_caller.
+        return RunInfo(conn=self.LIMS, run=run_name)
+
+    def apply_lims_write(self, run_name, operation):
+        # Runs on the LIMS write queue's thread. operation is a RunInfo method from lims_write_queue.OPERATIONS.
+        runinfo = self.lims_cache.peek(run_name)
+        if runinfo is None:
+            runinfo = self.lims_caller.call(self.fetch_runinfo, run_name)
+        self.lims_caller.call(getattr(runinfo, operation))
+
+    def is_not_found_error(self, error):
+        return (isinstance(error, requests.exceptions.HTTPError) and error.response is not None
+                and error.response.status_code == 404)
+
+    def get_rundir_signature(self, run_root, dirname):
+        # Changes when the run directory's descriptor files do, e.g. once the run is set up.
+        path = os.path.join(run_root, dirname)
+        signature = []
+        for filename in [''] + self.RUNDIR_DESCRIPTOR_FILES:
+            try:
+                signature.append(os.stat(os.path.join(path, filename)).st_mtime)
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def is_missing_from_lims(self, run_root, dirname):
+        """
+        Returns : True if the LIMS recently didn't know this run, so it shouldn't be looked up yet.
+        """
+        return self.lims_negative_cache.should_skip(dirname, self.get_rundir_signature(run_root, dirname))
+
+    def record_missing_from_lims(self, run_root, dirname):
+        retry_seconds = self.lims_negative_cache.record_miss(dirname, self.get_rundir_signature(run_root, dirname))
+        print("Run " + dirname + " not found in UHTS; perhaps it just wasn't entered in yet. "
+              "Skipping for %s." % self.format_seconds(retry_seconds))
+
+    def is_lims_failure(self, error):
+        # An HTTP error below 500 is an answer from a working LIMS, e.g. 404 for a run not entered yet.
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code >= 500
+        return True
+
+    def on_lims_breaker_state_change(self, old_state, new_state):
+        self.log_lims_breaker_state(old_state, new_state)
+        if old_state == CircuitBreaker.CLOSED and new_state == CircuitBreaker.OPEN:
+            # Only when the LIMS first goes down, not after each failed trial call.
+            self.send_email_lims_unavailable()
+
     def get_or_create_rundir(self, run_root, dirname, remove=False):
         rundirPath = os.path.join(run_root,dirname)
         matching_rundir = self.get_rundir(run_root=run_root, dirname=dirname)
@@ -487,6 +1413,8 @@ class Autocopy:
 
             #Before creating the RunDir object, need to check UHTS to make sure it's not aborted or failed.
             #Note that the possible sequncing run statuses in UHTS are given in app/helpers/sequencing_run_status.rb in the RAILS app.
+            if self.LIMS is not None and self.is_missing_from_lims(run_root, dirname):
+                return None
             try:
                 limsRunInfo = self.get_runinfo_from_lims(rundirName=dirname)
             except requests.exceptions.HTTPError as e:
@@ -494,15 +1422,17 @@ class Autocopy:
                 response = e.response
                 status_code = response.status_code
                 if status_code == 404:
-                    print("Run " + dirname + " not found in UHTS; perhaps it just wasn't entered in yet. Skipping.")
+                    self.record_missing_from_lims(run_root, dirname)
                     return None
                 else:
                     raise(e)
-            if limsRunInfo.has_status_sequencing_failed():
+            self.lims_negative_cache.forget(dirname)
+            if limsRunInfo is not None and limsRunInfo.has_status_sequencing_failed():
                 self.process_aborted_rundir(lims_runinfo=limsRunInfo,rundirPath=rundirPath)
                 return None
             else:
                 rundir = RunDir(run_root, dirname)
+                self.restore_copy_from_journal(rundir)
                 return rundir
 
     def are_files_missing(self, rundir):
@@ -510,22 +1440,43 @@ class Autocopy:
         files_missing = not rundir_utils.validate(rundir)
         return files_missing
 
-    def get_runinfo_from_lims(self, rundirObject=None,rundirName=None):
+    def get_runinfo_from_lims(self, rundirObject=None,rundirName=None,refresh=False):
         """
-        Returns : A scgpm_lims.components.models.RunInfo object
+        Returns : A scgpm_lims.components.models.RunInfo object, from the LIMS cache unless it
+                  is out of date or refresh is set. If the LIMS can't be reached, the cached
+                  object however old, or None.
         """
         if self.LIMS == None:
             return None
         if not rundirName:
             rundirName = rundirObject.get_dir()
         try:
-            runinfo = RunInfo(conn=self.LIMS, run=rundirName)
+            runinfo = self.lims_cache.get(rundirName, refresh=refresh)
+        except CircuitOpenError:
+            # The LIMS is known to be down; don't log it for every run.
+            runinfo = self.lims_cache.peek(rundirName)
         except Exception as e:
             if e.__class__ == requests.exceptions.HTTPError:
                 raise e
             print(str(e.__class__))
             self.log_lims_error(e)
-            runinfo = None
+            runinfo = self.lims_cache.peek(rundirName)
+        return runinfo
+
+    def refresh_runinfo_from_lims(self, rundir, lims_runinfo):
+        """
+        Function : Re-reads a run's LIMS data before a state transition.
+        Returns  : The new RunInfo object, or lims_runinfo if the LIMS couldn't be read.
+        """
+        if self.LIMS == None:
+            return lims_runinfo
+        try:
+            runinfo = self.get_runinfo_from_lims(rundirObject=rundir, refresh=True)
+        except requests.exceptions.HTTPError as e:
+            self.log_lims_error(e)
+            return lims_runinfo
+        if runinfo is None:
+            return lims_runinfo
         return runinfo
 
     def check_rundir_against_lims(self, rundir, runinfo, test_only_dummy_problem=None):
@@ -554,25 +1505,57 @@ class Autocopy:
                 problems_found.append('Mismatched value "%s". Value in run directory: "%s". Value in LIMS: "%s"' % (field, rundirval, limsval))
         return problems_found
 
-    def start_copy(self, rundir, rsync=True):
-        source = rundir.get_path().rstrip('/')
-        dest = self.COPY_DEST_RUN_ROOT.rstrip('/')
-        copy_cmd_list = ['rsync', '-rlptc', 
-                         '-e', 'ssh -l %s' % self.COPY_DEST_USER,
-                         '--exclude=Thumbnail_Images/', 
-                         '--chmod=Dug=rwX,Do=rX,Fug=rw,Fo=r',
-                         source,
-                         '%s:%s' % (self.COPY_DEST_HOST, dest),
-                     ]
-        copy_proc = subprocess.Popen(copy_cmd_list,
-                                     stdout=self.LOG_FILE, stderr=self.LOG_FILE)
+    def start_copy(self, rundir, resume=False, checksum=None):
+        """
+        Args : resume - True when restarting an interrupted copy. A resumable backend
+               is used, which compares files by size and mtime instead of checksumming
+               everything again, and keeps partially transferred files.
+               checksum - compare files already at the destination by content. By default
+               only first copies do, and only when there is no manifest to verify them.
+        """
+        if checksum is None:
+            checksum = not resume and not self.MANIFEST_ENABLED
+        backend = self.get_transfer_backend(rundir, resume=resume)
+        journal = self.get_copy_journal(rundir)
+        # Copy output goes to a file, so the copy outlives this daemon if it is restarted.
+        (copy_proc, copy_progress) = backend.start(rundir, resume=resume, log_function=self.get_copy_log_function(rundir),
+                                                   output_path=journal.get_output_path(rundir), checksum=checksum)
         rundir.set_copy_proc_and_start_time(copy_proc)
+        rundir.copy_progress = copy_progress
+        rundir.copy_backend = backend.NAME
+        journal.record_start(rundir, copy_proc, backend.NAME, resume)
+        self.start_manifest(rundir)
+
+    def get_copy_log_function(self, rundir):
+        # Copy output is parsed on a separate thread so the main loop never blocks on it.
+        rundir_name = rundir.get_dir()
+        return lambda line: self.log("[copy %s] %s" % (rundir_name, line))
+
+    def get_transfer_backend(self, rundir, resume=False):
+        backend_name = None
+        for (pattern, rule_backend_name) in self.COPY_BACKEND_RULES:
+            if re.search(pattern, rundir.get_dir()):
+                backend_name = rule_backend_name
+                break
+        if backend_name is None:
+            if not resume and self.COPY_BACKEND_FIRST_COPY:
+                backend_name = self.COPY_BACKEND_FIRST_COPY
+            else:
+                backend_name = self.COPY_BACKEND
+
+        backend = self.transfer_backends[backend_name]
+        if resume and not backend.RESUMABLE:
+            if self.transfer_backends[self.COPY_BACKEND].RESUMABLE:
+                backend = self.transfer_backends[self.COPY_BACKEND]
+            else:
+                backend = self.transfer_backends[transfer.RsyncBackend.NAME]
+        return backend
 
     def send_email_autocopy_exception(self, exception):
         tb = traceback.format_exc(exception)
         email_subj = "Autocopy unknown exception"
         email_body = "The autocopy daemon failed with Exception\n" + tb
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('autocopy_exception', event_aggregator.URGENT, tb, email_subj, email_body)
 
     def send_email_autocopy_started(self):
         email_subj = "Daemon Started"
@@ -594,7 +1577,7 @@ class Autocopy:
         email_body += "\t%s\n\n" % dest_path
         email_body += "If this was an error, please correct the sequencing status in the LIMS and manually move the run out of the %s folder.\n\n" % self.SUBDIR_ABORTED
         email_body += "Otherwise, this run may be safely deleted to free up disk space."
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('rundir_aborted', event_aggregator.NORMAL, rundirName, email_subj, email_body)
 
     def send_email_rundir_copy_failed(self, rundirPath, retcode):
         rundirName = os.path.basename(rundirPath)
@@ -605,7 +1588,7 @@ class Autocopy:
         email_body += "\n"
         email_body += "FAILED TO COPY to:\t%s:%s/%s\n" % (self.COPY_DEST_HOST, self.COPY_DEST_RUN_ROOT, rundirName)
         email_body += "Return code:\t%d\n" % retcode
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('rundir_copy_failed', event_aggregator.URGENT, (rundirName, retcode), email_subj, email_body)
 
     def send_email_rundir_copy_complete(self, rundir, are_files_missing, lims_problems, disk_usage):
         rundirName = rundir.get_dir()
@@ -640,8 +1623,14 @@ class Autocopy:
         email_body += "Cycles:\t\t\t%s\n" % " ".join(map(lambda d: str(d), rundir.get_cycle_list()))
         email_body += "\n"
         email_body += "Copy time:\t\t%s\n" % str(rundir.copy_end_time - rundir.copy_start_time)
+        if rundir.copy_progress is not None:
+            email_body += "Copy progress:\t\t%s\n" % rundir.copy_progress.get_summary()
+        if rundir.copy_queue_wait is not None:
+            email_body += "Queue wait:\t\t%s\n" % self.format_seconds(rundir.copy_queue_wait)
+        if rundir.manifest_status is not None:
+            email_body += "Manifest:\t\t%s\n" % rundir.manifest_status
         email_body += "Disk usage:\t\t%.1f %s\n" % (disk_usage, disk_usage_units)
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('rundir_copy_complete', event_aggregator.NORMAL, None, email_subj, email_body)
 
     def send_email_missing_rundir(self, rundir):
         rundirName = rundir.get_dir()
@@ -649,14 +1638,37 @@ class Autocopy:
         email_body = "MISSING RUN:\t%s\n" % rundirName
         email_body += "Location:\t%s:%s/%s\n\n" % (self.HOSTNAME, rundirName, rundirName)
         email_body += "Autocopy was tracking this run, but can no longer find it on disk."
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('missing_rundir', event_aggregator.NORMAL, rundirName, email_subj, email_body)
 
     def send_email_low_freespace(self, run_root, freebytes):
         email_subj = "Insufficient free space in %s" % os.path.abspath(run_root)
         email_body = "The following run root directory:\n\n %s\n\n" % os.path.abspath(run_root)
         email_body += "has %0.1f GB remaining.\n\n" % (freebytes/self.ONEGIG)
         email_body += "A warning is sent when free space is less than %0.1f GB" % (self.MIN_FREE_SPACE/self.ONEGIG)
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('low_freespace', event_aggregator.URGENT, os.path.abspath(run_root), email_subj, email_body)
+
+    def send_email_capacity_forecast(self, forecast):
+        email_subj = "Run root %s is forecast to fill up" % os.path.abspath(forecast.run_root)
+        email_body = self.format_capacity_forecast(forecast) + "\n"
+        if forecast.get_shortfall() > 0:
+            email_body += "The runs in progress need %.1f GB more than is free.\n" % (forecast.get_shortfall()/self.ONEGIG)
+        email_body += "A warning is sent when a run root will fill within %s hours.\n" % self.CAPACITY_WARNING_HOURS
+        email_body += "Runs from this run root are copied first. Delete runs from %s to make room, " % self.SUBDIR_COMPLETED
+        email_body += "or an instrument may fail to write its run."
+        self.send_event_email('capacity_forecast', event_aggregator.URGENT, os.path.abspath(forecast.run_root), email_subj, email_body)
+
+    def send_email_run_evicted(self, candidate, reason):
+        email_subj = "Run %s evicted from %s" % (candidate.name, os.path.abspath(candidate.run_root))
+        email_body = "Run %s was deleted from %s to free space.\n\n" % (candidate.name, os.path.dirname(os.path.abspath(candidate.path)))
+        email_body += "Its copy at %s:%s was checked first: %s.\n" % (self.COPY_DEST_HOST, self.COPY_DEST_RUN_ROOT, reason)
+        email_body += "Runs are evicted when free space is less than %0.1f GB" % (self.EVICTION_START_FREE_SPACE/self.ONEGIG)
+        self.send_event_email('run_evicted', event_aggregator.LOW, candidate.name, email_subj, email_body)
+
+    def send_email_eviction_refused(self, candidate, reason):
+        email_subj = "Run %s not evicted, its copy is not verified" % candidate.name
+        email_body = "Run %s in %s was not deleted to free space:\n\n %s\n\n" % (candidate.name, os.path.dirname(os.path.abspath(candidate.path)), reason)
+        email_body += "Check its copy at %s:%s. It is skipped until it is moved again or autocopy is restarted." % (self.COPY_DEST_HOST, self.COPY_DEST_RUN_ROOT)
+        self.send_event_email('eviction_refused', event_aggregator.NORMAL, candidate.name, email_subj, email_body)
 
     def send_email_rundirs_monitored_summary(self):
         email_subj = 'Run status summary'
@@ -665,25 +1677,98 @@ class Autocopy:
             email_body += '%s\n\n' % os.path.abspath(run_root)
             for run_dir in self.get_rundirs(run_root=run_root):
                 status = self.get_rundir_status(run_dir)
+                if run_dir.is_copying() and run_dir.copy_progress is not None:
+                    status += " (%s)" % run_dir.copy_progress.get_summary()
+                if run_dir in self.copy_queue:
+                    status += " (queued %s)" % self.format_seconds(self.copy_queue.get_wait_seconds(run_dir))
                 email_body += "%s\t%s\n" % (run_dir.get_dir(), status)
             email_body += "\n"
             email_body += '\t%0.1f GB free\n\n' % (self.get_freespace(run_root)/self.ONEGIG)
+        email_body += self.get_capacity_summary()
+        email_body += self.get_lims_write_queue_summary()
+        email_body += self.get_email_queue_summary()
+        email_body += self.get_event_digest()
         self.send_email(self.EMAIL_TO, email_subj, email_body)
         self.last_rundirs_monitored_summary = time.time()
 
+    def send_email_event_digest(self):
+        email_subj = 'Digest of recent events'
+        email_body = self.get_event_digest()
+        if email_body:
+            self.send_email(self.EMAIL_TO, email_subj, email_body)
+
+    def get_event_digest(self):
+        """
+        Returns : The events held back since the last digest, as email text, and starts a
+                  new digest. Empty if there were none.
+        """
+        self.last_event_digest = time.time()
+        (held, repeats) = self.event_aggregator.pop_digest()
+        text = ''
+        if held:
+            text += '\nEvents not emailed separately:\n\n'
+            for entry in held:
+                text += entry.get_summary() + '\n'
+                text += ''.join('\t%s\n' % line for line in entry.body.splitlines())
+                text += '\n'
+        if repeats:
+            text += '\nRepeated events, not emailed again:\n\n'
+            for entry in repeats:
+                text += entry.get_summary() + '\n'
+        return text
+
+    def get_lims_write_queue_summary(self):
+        depth = self.lims_write_queue.get_depth()
+        if depth == 0:
+            return 'LIMS updates: none pending\n'
+        return 'LIMS updates: %s pending, oldest queued %s ago\n' % (depth, self.format_seconds(self.lims_write_queue.get_oldest_age()))
+
+    def get_email_queue_summary(self):
+        if self.notifier is None or self.notifier.get_depth() == 0:
+            return ''
+        return 'Emails: %s waiting to be sent, oldest queued %s ago\n' % (self.notifier.get_depth(), self.format_seconds(self.notifier.get_oldest_age()))
+
+    def send_email_finalize_failed(self, rundir, error):
+        email_subj = 'Failed to finish copied run %s' % rundir.get_dir()
+        email_body = 'Run %s was copied, but finishing it failed:\n\n%s\n' % (rundir.get_dir(), error)
+        email_body += 'Autocopy will leave the run where it is. Fix the problem and restart autocopy to finish it.'
+        self.send_event_email('finalize_failed', event_aggregator.URGENT, rundir.get_dir(), email_subj, email_body)
+
     def send_email_run_not_found_in_lims(self, run_name):
         email_subj = 'Run not found in LIMS %s' % run_name
         email_body = 'Autocopy could not find run %s in the LIMS.\n' % run_name
         email_body += 'Autocopy will proceed with the copy anyway.'
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('run_not_found_in_lims', event_aggregator.LOW, run_name, email_subj, email_body)
+
+    def send_email_lims_unavailable(self):
+        email_subj = 'LIMS unavailable'
+        email_body = 'Autocopy failed to reach the LIMS %s times in a row.\n' % self.LIMS_BREAKER_FAILURES
+        email_body += 'It will use cached LIMS data, and try the LIMS again every %s.\n' % self.format_seconds(self.LIMS_BREAKER_COOLDOWN_SECONDS)
+        email_body += 'Copies go on meanwhile. Runs not seen before are copied without LIMS checks.'
+        self.send_event_email('lims_unavailable', event_aggregator.URGENT, 'lims', email_subj, email_body)
 
-    def send_email_copy_restarted(self, run_name):
+    def send_email_copy_restarted(self, run_name, reason):
         email_subj = 'Stalled copy suspected. Restarted run %s' % run_name
-        email_body = 'The copy process for run %s was in progress for longer than %s hours.\n' % (run_name, self.SECONDS_BEFORE_COPY_RESTART/3600)
-        email_body += 'Just in case this was a stalled process, autocopy killed and restarted the rsync.\n'
+        email_body = 'The copy process for run %s looks stalled: %s.\n' % (run_name, reason)
+        email_body += 'Autocopy killed and restarted the rsync.\n'
         email_body += 'The copy should resume where it left off.\n'
         email_body += 'If you see this email again, you may need to troubleshoot.\n'
-        self.send_email(self.EMAIL_TO, email_subj, email_body)
+        self.send_event_email('copy_restarted', event_aggregator.NORMAL, None, email_subj, email_body)
+
+    def send_event_email(self, event_type, severity, key, subj, body):
+        """
+        Function : Emails an event now, or holds it for the digest, or drops it as a
+                   repeat, as the event aggregator decides.
+        Args     : key - events of the same type and key are repeats; None if never.
+        """
+        action = self.event_aggregator.submit(event_type, severity, key, subj, body)
+        if action == event_aggregator.SEND:
+            self.send_email(self.EMAIL_TO, subj, body)
+        else:
+            self.log_event_held(subj, action)
+
+    def format_seconds(self, seconds):
+        return str(datetime.timedelta(seconds=int(seconds)))
 
     def send_email(self, to, subj, body, write_email_to_log=True):
         body += "\nSent at %s\n" % time.strftime('%X %x %Z') 
@@ -698,12 +1783,8 @@ class Autocopy:
         if self.NO_EMAIL:
             self.log("email suppressed because --no_email is set")
         else:
-            try:
-                self.smtp.sendmail(msg['From'], to, msg.as_string())
-            except smtplib.SMTPServerDisconnected:
-                self.log_lost_smtp_connection()
-                self.initialize_mail_server()
-                self.smtp.sendmail(msg['From'], to, msg.as_string())
+            # Returns at once; the notifier thread sends it.
+            self.notifier.put(msg['From'], to, msg.as_string())
         if write_email_to_log:
             self.log("v----------- begin email -----------v")
             self.log(msg.as_string())
@@ -724,11 +1805,26 @@ class Autocopy:
         self.log("processing %s" % rundir.get_dir())
 
     def log_start_copy(self, rundir):
-        self.log("Starting copy of run %s\n" % rundir.get_dir())
+        if rundir.copy_queue_wait is not None:
+            self.log("Starting copy of run %s after waiting %s in the copy queue\n" % (rundir.get_dir(), self.format_seconds(rundir.copy_queue_wait)))
+        else:
+            self.log("Starting copy of run %s\n" % rundir.get_dir())
 
     def log_lims_error(self, error):
         self.log("Encountered an error accessing the LIMS: %s" % error.message)
 
+    def log_lims_batch(self, requested, found):
+        self.log("Looked up %s runs in the LIMS in a batch, %s found" % (requested, found))
+
+    def log_lims_breaker_state(self, old_state, new_state):
+        self.log("LIMS circuit breaker %s -> %s" % (old_state, new_state))
+
+    def log_event_held(self, subj, action):
+        if action == event_aggregator.DIGEST:
+            self.log("Email '%s' held for the next digest" % subj)
+        else:
+            self.log("Email '%s' not sent, it repeats a recent one" % subj)
+
     def log_connecting_to_mail_server(self):
         self.log("Connecting to mail server...")
 
@@ -737,6 +1833,42 @@ class Autocopy:
 
     def log_reached_copy_processes_max(self, rundir):
         self.log("Postponing copy of run %s because MAX_COPY_PROCESSES=%s has been reached\n" % (rundir.get_dir(), self.MAX_COPY_PROCESSES))
+
+    def log_copy_progress(self, rundir):
+        if rundir.copy_progress is None:
+            self.log("Copy of run %s in progress\n" % rundir.get_dir())
+        else:
+            self.log("Copy of run %s in progress: %s\n" % (rundir.get_dir(), rundir.copy_progress.get_summary()))
+
+    def log_restart_copy(self, rundir, reason):
+        self.log("Restarting copy of run %s: %s\n" % (rundir.get_dir(), reason))
+
+    def log_enqueue_copy(self, rundir):
+        self.log("Queueing run %s for copy (policy %s)\n" % (rundir.get_dir(), self.COPY_QUEUE_POLICY))
+
+    def log_dispatch_finalize(self, rundir):
+        self.log("Copy of run %s complete. Finalising it in the background\n" % rundir.get_dir())
+
+    def log_finalize_state(self, rundir):
+        self.log("Run %s %s\n" % (rundir.get_dir(), rundir.finalize_state))
+
+    def log_waiting_for_manifest(self, rundir):
+        self.log("Copy of run %s finished. Waiting for its checksum manifest\n" % rundir.get_dir())
+
+    def log_verifying_manifest(self, rundir):
+        self.log("Verifying copy of run %s against its checksum manifest\n" % rundir.get_dir())
+
+    def log_manifest_status(self, rundir):
+        self.log("Checksum manifest of run %s: %s\n" % (rundir.get_dir(), rundir.manifest_status))
+
+    def log_adopt_copy(self, rundir, pids):
+        self.log("Reattached to copy of run %s started before restart (pids %s)\n" % (rundir.get_dir(), ', '.join([str(pid) for pid in pids])))
+
+    def log_resume_interrupted_copy(self, rundir):
+        self.log("Copy of run %s was interrupted by a restart and will be resumed\n" % rundir.get_dir())
+
+    def log_adopted_copy_exited(self, rundir):
+        self.log("Reattached copy of run %s has exited. Resuming it to verify it is complete\n" % rundir.get_dir())
     
     def log_creating_copy_complete_sentinel_file(self, rundir, filename):
         self.log("Creating copy complete file '%s' in destination folder of run %s" % (filename, rundir.get_dir()))
@@ -747,9 +1879,12 @@ class Autocopy:
         else:
             log_text = ''
         log_lines = log_text.split("\n")
-        for line in log_lines:
-            print >> self.LOG_FILE, "[%s] %s" % (datetime.datetime.now().strftime("%Y %b %d %H:%M:%S"), line)
-        self.LOG_FILE.flush()
+        timestamp = datetime.datetime.now().strftime("%Y %b %d %H:%M:%S")
+        # Copy progress readers log from their own threads.
+        with self.log_lock:
+            for line in log_lines:
+                print >> self.LOG_FILE, "[%s] %s" % (timestamp, line)
+            self.LOG_FILE.flush()
 
     def initialize_config(self, config):
         if config is None:
@@ -774,12 +1909,26 @@ class Autocopy:
             pattern = '^[0-9a-zA-Z./_-]*$'
             if not re.match(pattern, value):
                 raise ValidationError("Invalid value %s for config key %s. Must be a string matched by %s" %(value, key, pattern))
+        def validate_bool(key, value):
+            if not isinstance(value, bool):
+                raise ValidationError("Invalid value %s for config key %s. true or false is required." %(value, key))
         def validate_int(key, value):
             if not isinstance(value, int):
                 raise ValidationError("Invalid value %s for config key %s. An integer is required." %(value, key))
         def validate_list(key, value):
             if not isinstance(value, list):
                 raise ValidationError("Invalid value %s for config key %s. A list is required." %(value, key))
+        def validate_choice(choices):
+            def validate_choice_in(key, value):
+                if value not in choices:
+                    raise ValidationError("Invalid value %s for config key %s. Must be one of %s" %(value, key, choices))
+            return validate_choice_in
+        def validate_backend_rules(key, value):
+            validate_list(key, value)
+            for rule in value:
+                if not (isinstance(rule, list) and len(rule) == 2):
+                    raise ValidationError("Invalid rule %s for config key %s. Each rule must be [run name regex, backend name]." %(rule, key))
+                validate_choice(transfer.BACKENDS.keys())(key, rule[1])
 
         def validate(key, value, config_fields):
             if key not in config_fields.keys():
@@ -790,10 +1939,46 @@ class Autocopy:
  
         config_fields = {
             'LOG_DIR_DEFAULT': validate_str,
+            'EVENT_LOG_FILE': validate_str,
+            'EVENT_LOG_MAX_BYTES': validate_int,
+            'EVENT_LOG_ROTATE_SECONDS': validate_int,
+            'EVENT_LOG_BACKUPS': validate_int,
+            'METRICS_TEXTFILE': validate_str,
+            'METRICS_HOST': validate_str,
+            'METRICS_PORT': validate_int,
+            'COPY_HISTORY_DB': validate_str,
+            'PROFILE_DIR': validate_str,
+            'PROFILE_PASSES': validate_int,
+            'PROFILE_TOP_FUNCTIONS': validate_int,
+            'DEBUG_CONTROL_FILE': validate_str,
+            'DEBUG_CONTROL_POLL_SECONDS': validate_int,
             'SUBDIR_COMPLETED': validate_str,
             'SUBDIR_ABORTED': validate_str,
             'LIMS_API_VERSION': validate_str,
+            'LIMS_CACHE_TTL_SECONDS': validate_int,
+            'LIMS_CACHE_MAX_STALE_SECONDS': validate_int,
+            'LIMS_NOT_FOUND_RETRY_SECONDS': validate_int,
+            'LIMS_NOT_FOUND_MAX_RETRY_SECONDS': validate_int,
+            'RUNDIR_DESCRIPTOR_FILES': validate_list,
+            'LIMS_BATCH_URL': validate_str,
+            'LIMS_BATCH_SIZE': validate_int,
+            'LIMS_WORKERS': validate_int,
+            'LIMS_TIMEOUT_SECONDS': validate_int,
+            'LIMS_BREAKER_FAILURES': validate_int,
+            'LIMS_BREAKER_COOLDOWN_SECONDS': validate_int,
+            'LIMS_WRITE_RETRY_SECONDS': validate_int,
+            'LIMS_WRITE_MAX_RETRY_SECONDS': validate_int,
             'MAX_COPY_PROCESSES': validate_int,
+            'COPY_QUEUE_POLICY': validate_choice(CopyQueue.POLICIES),
+            'RSYNC_PROGRESS_ARGS': validate_list,
+            'MANIFEST_ENABLED': validate_bool,
+            'MANIFEST_HASH_ALGORITHM': validate_choice(manifest.ALGORITHMS),
+            'MANIFEST_THREADS': validate_int,
+            'MANIFEST_VERIFY_PARALLELISM': validate_int,
+            'FINALIZE_WORKERS': validate_int,
+            'COPY_BACKEND': validate_choice(transfer.BACKENDS.keys()),
+            'COPY_BACKEND_FIRST_COPY': validate_choice(transfer.BACKENDS.keys()),
+            'COPY_BACKEND_RULES': validate_backend_rules,
             'EMAIL_TO': validate_str,
             'EMAIL_FROM': validate_str,
             'COPY_DEST_HOST': validate_cmdline_safe_str,
@@ -804,13 +1989,33 @@ class Autocopy:
             'MIN_FREE_SPACE': validate_int,
             'MAIN_LOOP_DELAY_SECONDS': validate_int,
             'RUNROOT_FREESPACE_CHECK_DELAY_SECONDS': validate_int,
+            'CAPACITY_SAMPLE_SECONDS': validate_int,
+            'CAPACITY_WARNING_HOURS': validate_int,
+            'EVICTION_ENABLED': validate_bool,
+            'EVICTION_START_FREE_SPACE': validate_int,
+            'EVICTION_STOP_FREE_SPACE': validate_int,
+            'EVICTION_ORDER': validate_choice(eviction.ORDERS),
+            'EVICTION_MIN_AGE_SECONDS': validate_int,
+            'EVICTION_FILES_PER_SECOND': validate_int,
+            'EVICTION_CHECK_SECONDS': validate_int,
             'RUNDIRS_MONITORED_SUMMARY_DELAY_SECONDS': validate_int,
+            'COPY_STALL_SECONDS': validate_int,
+            'COPY_MIN_BYTES_PER_SECOND': validate_int,
+            'SECONDS_BEFORE_COPY_RESTART': validate_int,
             'UHTS_LIMS_URL': validate_str,
             'UHTS_LIMS_TOKEN': validate_str,
             'AUTOCOPY_SMTP_USERNAME': validate_str,
             'AUTOCOPY_SMTP_TOKEN': validate_str,
             'AUTOCOPY_SMTP_PORT': validate_int,
             'AUTOCOPY_SMTP_SERVER': validate_str,
+            'EMAIL_QUEUE_MAX': validate_int,
+            'EMAIL_RETRY_SECONDS': validate_int,
+            'EMAIL_MAX_RETRY_SECONDS': validate_int,
+            'EMAIL_FLUSH_SECONDS': validate_int,
+            'EVENT_DEDUPE_SECONDS': validate_int,
+            'EVENT_RATE_LIMIT': validate_int,
+            'EVENT_RATE_LIMIT_SECONDS': validate_int,
+            'EVENT_DIGEST_DELAY_SECONDS': validate_int,
         }
 
         for key in config.keys():
@@ -841,9 +2046,12 @@ class Autocopy:
         signal.signal(signal.SIGINT,  self.receive_sig_die)
         signal.signal(signal.SIGTERM, self.receive_sig_die)
         signal.signal(signal.SIGUSR1, self.receive_sig_USR1)
+        signal.signal(signal.SIGUSR2, self.receive_sig_USR2)
 
     def receive_sig_die(self, signum, frame):
         self.send_email_autocopy_stopped()
+        if self.notifier is not None and not self.notifier.flush(self.EMAIL_FLUSH_SECONDS):
+            self.log("%s emails not sent yet; they will be sent when autocopy restarts" % self.notifier.get_depth())
         self.cleanup()
         sys.exit(0)
 
@@ -852,6 +2060,31 @@ class Autocopy:
         self.log("Sending rundirs monitored summary\n")
         self.send_email_rundirs_monitored_summary()
 
+    def receive_sig_USR2(self, signum, frame):
+        self.log("Received USR2 signal.")
+        self.handle_debug_command(['stacks'])
+        self.handle_debug_command(['profile'])
+
+    def handle_debug_command(self, words):
+        """
+        Function : Runs a debugging command, from SIGUSR2 or the control file watcher's thread.
+        Args     : words - ['stacks'], or ['profile'] optionally followed by a number of passes.
+        """
+        if words[0] == 'stacks':
+            self.log(profiling.format_thread_stacks())
+        elif words[0] == 'profile':
+            passes = self.PROFILE_PASSES
+            if len(words) > 1:
+                try:
+                    passes = int(words[1])
+                except ValueError:
+                    self.log("Ignoring debug command %s: %s is not a number of passes" % (' '.join(words), words[1]))
+                    return
+            self.loop_profiler.request(passes)
+            self.log("Profiling the next %s main loop passes" % passes)
+        else:
+            self.log("Ignoring unknown debug command %s. Use 'stacks' or 'profile [passes]'" % ' '.join(words))
+
     def get_rundir(self, run_root=None, dirname=None):
         """
         Function : Does the same as self.get_rundirs, but raises an Exception if more than one rundir.RunDir object is retrieved.
@@ -9,31 +9,41 @@ import os
 import datetime
 import sys
 
+from copy_history import CopyHistory, get_instrument
+import disk_usage
+
 
 description = "Calculcates the time it took for autocopy to copy one or more runs to the cluster, by looking at the timestamps of the Autocopy_started.txt and Autocopy_complete.txt files in a run directory. Any number of run directories can be specified as arguments. The output fomat is one line per run in the form 'run name: hours', where hours is represented as a float. Runs that don't have both autocopy sentinal files will be skipped."
 usage = "usage: %prog [options] dir1 dir2 dir3 ..."
 parser = OptionParser(description=description,usage=usage)
 parser.add_option('--include-skipped',action="store_true",help="(Optional) Presence of this option indicates that skipped runs (which don't have both autocopy sentinal files) will be included in the output file.")
-parser.add_option('--outfile','-o',help="(Required) Output file name.")
+parser.add_option('--outfile','-o',help="(Required unless --db is given) Output file name.")
+parser.add_option('--db',help="(Optional) Also add the runs to this autocopy copy history database (see copy_history.py), with their disk usage. Runs already in it are left out. Autocopy records the runs it copies itself, so this is for runs copied before it kept a history.")
 opts,args = parser.parse_args()
 
 dirs = args
-if not opts.outfile:
+if not opts.outfile and not opts.db:
   parser.error("You must supply the --outfile argument!")
 
 outfile = opts.outfile
 include_skipped = opts.include_skipped
+history = None
+if opts.db:
+  history = CopyHistory(opts.db)
 
 header = "RunName\tStartDate\tFinishDate\tCopyTime(hours)\n"
-mode = "w"
-newOutfile = True
-if os.path.exists(outfile):
-  mode = "a"
-  newOutfile = False
+if outfile:
+  mode = "w"
+  newOutfile = True
+  if os.path.exists(outfile):
+    mode = "a"
+    newOutfile = False
 
-fout = open(outfile,mode)
-if newOutfile:
-  fout.write(header)
+  fout = open(outfile,mode)
+  if newOutfile:
+    fout.write(header)
+else:
+  fout = open(os.devnull,"w")
 
 for d in dirs:
   d = d.rstrip("/")
@@ -55,4 +65,8 @@ for d in dirs:
   fout.write(str(datetime.datetime.fromtimestamp(mtime_acs)) + "\t")
   fout.write(str(datetime.datetime.fromtimestamp(mtime_acc)) + "\t") 
   fout.write(str(hours) + "\n")
+  if history and not history.has_run(runname):
+    history.record(run=runname, instrument=get_instrument(runname), run_root=os.path.dirname(os.path.abspath(d)),
+                   source='sentinel', start_time=mtime_acs, end_time=mtime_acc,
+                   bytes=disk_usage.get_engine().get_usage(d))
 fout.close()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# benchmark_copy.py - Measure the throughput of each way Autocopy copies a run.
+#
+# Copies a run directory with each copy mode, and reports the wall clock
+# time, MB/s, files/s and CPU seconds of each. The run is either given, or
+# generated with make_synthetic_rundir.py. The destination is a local run
+# root: the local backend copies to it directly, the rsync and tar_ssh
+# backends go over ssh to --sshHost (e.g. localhost, with key auth set up).
+#
+# Modes:
+#   local, local_checksum  - rsync to the destination, without and with -c.
+#   local_resume           - rsync --partial over a complete copy, i.e. the
+#                            cost of a restart that has nothing left to copy.
+#   rsync, rsync_checksum, rsync_resume - the same over ssh.
+#   tar_ssh                - tar stream over ssh.
+#   manifest               - hashing the run for the copy manifest, no copy.
+#
+# MB/s and files/s count the files a copy sends (Thumbnail_Images are
+# excluded), by apparent size. CPU is the user+system time of child
+# processes (rsync, tar, ssh) plus this process (manifest threads); the
+# remote side of an ssh copy is not counted. The page cache is not dropped
+# between repeats, so put the source on a tmpfs (e.g. --runRoot /dev/shm/x)
+# to compare like with like, and use --fill random if anything compresses.
+#
+# ARGS:
+#   1: (Optional) Run directory to copy, instead of a synthetic one.
+#
+# SWITCHES: See --help.
+#
+###############################################################################
+
+import getpass
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from rundir import RunDir
+import make_synthetic_rundir
+import manifest
+import transfer
+
+# Mode name -> (backend name, resume, checksum, copy into an empty destination)
+COPY_MODES = {
+    'local': ('local', False, False, True),
+    'local_checksum': ('local', False, True, True),
+    'local_resume': ('local', True, False, False),
+    'rsync': ('rsync', False, False, True),
+    'rsync_checksum': ('rsync', False, True, True),
+    'rsync_resume': ('rsync', True, False, False),
+    'tar_ssh': ('tar_ssh', False, None, True),
+}
+MANIFEST_MODE = 'manifest'
+MODES = sorted(COPY_MODES.keys()) + [MANIFEST_MODE]
+
+DEFAULT_LOCAL_MODES = ['local', 'local_checksum', 'local_resume', MANIFEST_MODE]
+DEFAULT_SSH_MODES = ['rsync', 'rsync_checksum', 'rsync_resume', 'tar_ssh']
+
+def get_cpu_seconds():
+    """
+    Returns : (CPU seconds of this process, CPU seconds of its waited-for children)
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_utime + self_usage.ru_stime, children_usage.ru_utime + children_usage.ru_stime)
+
+def get_copied_files(rundir):
+    """
+    Returns : (number of files, bytes) that a copy of rundir sends.
+    """
+    relpaths = manifest.list_files(rundir.get_path(), transfer.TransferBackend.EXCLUDES)
+    return (len(relpaths), sum([os.path.getsize(os.path.join(rundir.get_path(), relpath))
+                                for relpath in relpaths]))
+
+class BenchmarkResult:
+
+    def __init__(self, mode, seconds, cpu_seconds, files, bytes):
+        self.mode = mode
+        self.seconds = seconds
+        self.cpu_seconds = cpu_seconds
+        self.files = files
+        self.bytes = bytes
+
+    def get_mb_per_second(self):
+        return self.bytes / (1024.0 * 1024.0) / max(self.seconds, 0.001)
+
+    def get_files_per_second(self):
+        return self.files / max(self.seconds, 0.001)
+
+    def format(self):
+        return "%-16s %10.2f %10.1f %10.0f %10.2f" % (self.mode, self.seconds, self.get_mb_per_second(),
+                                                    self.get_files_per_second(), self.cpu_seconds)
+
+    @staticmethod
+    def format_header():
+        return "%-16s %10s %10s %10s %10s" % ('Mode', 'Seconds', 'MB/s', 'Files/s', 'CPU(s)')
+
+class CopyBenchmark:
+
+    def __init__(self, rundir, dest_run_root, ssh_host=None, ssh_user=None,
+                 algorithm='auto', manifest_threads=4, log_file=None):
+        self.rundir = rundir
+        self.dest_run_root = dest_run_root
+        self.ssh_host = ssh_host
+        self.ssh_user = ssh_user or getpass.getuser()
+        self.algorithm = algorithm
+        self.manifest_threads = manifest_threads
+        self.log_file = log_file
+        (self.files, self.bytes) = get_copied_files(rundir)
+
+    def get_backend(self, backend_name):
+        if backend_name != 'local' and self.ssh_host is None:
+            raise ValueError("Copy mode %s needs an ssh host" % backend_name)
+        return transfer.get_backend_class(backend_name)(self.ssh_host, self.ssh_user, self.dest_run_root,
+                                                        log_file=self.log_file)
+
+    def clear_dest(self, backend):
+        backend.call_dest_command(['rm', '-rf', backend.get_dest_path(self.rundir)])
+
+    def copy(self, backend, resume=False, checksum=None):
+        (copy_proc, copy_progress) = backend.start(self.rundir, resume=resume, checksum=checksum)
+        retcode = copy_proc.wait()
+        if retcode != 0:
+            raise RuntimeError("%s copy of %s failed with exit code %s" % (backend.NAME, self.rundir.get_dir(), retcode))
+
+    def hash_run(self):
+        builder = manifest.ManifestBuilder(self.rundir.get_path(), manifest.resolve_algorithm(self.algorithm),
+                                           threads=self.manifest_threads,
+                                           excludes=transfer.TransferBackend.EXCLUDES)
+        builder.start()
+        builder.join()
+        if not builder.is_ok():
+            raise RuntimeError("Hashing %s failed: %s" % (self.rundir.get_dir(), '; '.join(builder.errors)))
+
+    def run_mode(self, mode, repeat=1):
+        """
+        Function : Runs one mode repeat times.
+        Returns  : The BenchmarkResult of the fastest run.
+        """
+        if mode == MANIFEST_MODE:
+            setup = None
+            function = self.hash_run
+        elif mode in COPY_MODES:
+            (backend_name, resume, checksum, fresh) = COPY_MODES[mode]
+            backend = self.get_backend(backend_name)
+            if fresh:
+                setup = lambda: self.clear_dest(backend)
+            else:
+                # Start from a complete copy.
+                setup = None
+                self.clear_dest(backend)
+                self.copy(backend)
+            function = lambda: self.copy(backend, resume=resume, checksum=checksum)
+        else:
+            raise ValueError("Unknown mode %s. Valid modes are %s" % (mode, MODES))
+
+        best = None
+        for i in range(repeat):
+            if setup is not None:
+                setup()
+            (self_cpu_start, children_cpu_start) = get_cpu_seconds()
+            start_time = time.time()
+            function()
+            seconds = time.time() - start_time
+            (self_cpu_end, children_cpu_end) = get_cpu_seconds()
+            result = BenchmarkResult(mode, seconds,
+                                     (self_cpu_end - self_cpu_start) + (children_cpu_end - children_cpu_start),
+                                     self.files, self.bytes)
+            if best is None or result.seconds < best.seconds:
+                best = result
+        return best
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    usage = "%prog [options] [run_dir]"
+    parser = OptionParser(usage=usage)
+
+    parser.add_option("-m", "--modes", dest="modes", type="string",
+                      default=None,
+                      help='Comma-separated modes to run, from %s [default = %s, plus %s with --sshHost]' % (
+                          ', '.join(MODES), ','.join(DEFAULT_LOCAL_MODES), ','.join(DEFAULT_SSH_MODES)))
+    parser.add_option("-H", "--sshHost", dest="ssh_host", type="string",
+                      default=None,
+                      help='Host to copy to over ssh, e.g. localhost [default = none]')
+    parser.add_option("-u", "--sshUser", dest="ssh_user", type="string",
+                      default=None,
+                      help='User to copy as over ssh [default = current user]')
+    parser.add_option("-d", "--destRoot", dest="dest_root", type="string",
+                      default=None,
+                      help='Destination run root, local to this host or --sshHost [default = a temporary directory]')
+    parser.add_option("-r", "--runRoot", dest="run_root", type="string",
+                      default=None,
+                      help='Where to generate the synthetic run [default = a temporary directory]')
+    parser.add_option("-n", "--repeat", dest="repeat", type="int",
+                      default=1,
+                      help='Times to run each mode; the fastest is reported [default = 1]')
+    parser.add_option("-k", "--keep", dest="keep", action="store_true",
+                      default=False,
+                      help='Keep the generated run and the copies [default = false]')
+    parser.add_option("-p", "--platform", dest="platform", type="choice", choices=make_synthetic_rundir.PLATFORMS,
+                      default='hiseq',
+                      help='Platform of the synthetic run [default = hiseq]')
+    parser.add_option("--reads", dest="reads", type="string",
+                      default='101,8i,101',
+                      help='Cycles of each read of the synthetic run [default = 101,8i,101]')
+    parser.add_option("--clusters", dest="clusters_per_tile", type="int",
+                      default=20000,
+                      help='Clusters per tile of the synthetic run; sets the file sizes [default = 20000]')
+    parser.add_option("--fill", dest="fill", type="choice", choices=make_synthetic_rundir.FILLS,
+                      default='random',
+                      help='How to fill the synthetic run files [default = random]')
+    parser.add_option("--cif", dest="cif", action="store_true",
+                      default=False,
+                      help='Include .cif files in the synthetic run [default = false]')
+    parser.add_option("-a", "--algorithm", dest="algorithm", type="choice", choices=manifest.ALGORITHMS,
+                      default='auto',
+                      help='Hash algorithm of the manifest mode [default = auto]')
+    parser.add_option("-t", "--threads", dest="threads", type="int",
+                      default=4,
+                      help='Hashing threads of the manifest mode [default = 4]')
+
+    (opts, args) = parser.parse_args()
+
+    if opts.modes:
+        modes = opts.modes.split(',')
+    else:
+        modes = list(DEFAULT_LOCAL_MODES)
+        if opts.ssh_host:
+            modes.extend(DEFAULT_SSH_MODES)
+    for mode in modes:
+        if mode not in MODES:
+            parser.error("Unknown mode %s. Valid modes are %s" % (mode, ', '.join(MODES)))
+
+    temp_dirs = []
+    try:
+        if len(args) > 0:
+            (root, dir) = os.path.split(os.path.abspath(args[0]))
+            rundir = RunDir(root, dir)
+        else:
+            run_root = opts.run_root
+            if run_root is None:
+                run_root = tempfile.mkdtemp()
+                temp_dirs.append(run_root)
+            run = make_synthetic_rundir.SyntheticRun(run_root, platform=opts.platform,
+                                                     reads=make_synthetic_rundir.parse_reads(opts.reads),
+                                                     clusters_per_tile=opts.clusters_per_tile, cif=opts.cif)
+            (rundir, file_count, total_bytes) = run.make(fill=opts.fill)
+            print "Generated %s: %d files, %.1f Gb" % (rundir.get_path(), file_count, total_bytes / (1024.0 ** 3))
+            if opts.run_root is not None and not opts.keep:
+                temp_dirs.append(rundir.get_path())
+
+        dest_root = opts.dest_root
+        if dest_root is None:
+            dest_root = tempfile.mkdtemp()
+            temp_dirs.append(dest_root)
+
+        benchmark = CopyBenchmark(rundir, dest_root, ssh_host=opts.ssh_host, ssh_user=opts.ssh_user,
+                                  algorithm=opts.algorithm, manifest_threads=opts.threads)
+        print "Copying %d files, %.1f Gb; best of %d" % (benchmark.files, benchmark.bytes / (1024.0 ** 3), opts.repeat)
+        print BenchmarkResult.format_header()
+        for mode in modes:
+            result = benchmark.run_mode(mode, repeat=opts.repeat)
+            print result.format()
+            sys.stdout.flush()
+
+    except (ValueError, RuntimeError), e:
+        print >> sys.stderr, os.path.basename(__file__), ":", e
+        sys.exit(1)
+
+    finally:
+        if not opts.keep:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# capacity.py - Forecasts when each run root will fill up, from how fast
+#               the runs being sequenced into it are growing.
+#
+# Comparing free space against MIN_FREE_SPACE only says a volume is already
+# nearly full. A CapacityModel is fed samples instead, every
+# CAPACITY_SAMPLE_SECONDS:
+#
+#   - sample_run(): the size and current cycle of each run still being
+#     sequenced, from the incremental disk usage engine (disk_usage.py).
+#     Two samples give the run's write rate (bytes per second) and its bytes
+#     per cycle, and so the bytes it will still write before its last cycle.
+#   - sample_root(): the free space of each run root, and the space that
+#     would be reclaimed by deleting the runs in Runs_Completed.
+#
+# forecast() then gives, per run root, the combined write rate, the seconds
+# until the free space runs out at that rate, and the bytes the runs in
+# progress still need. A root is at risk if it will fill within the warning
+# horizon, or if the runs in progress need more than is free.
+#
+###############################################################################
+
+import time
+
+class RunGrowth:
+
+    def __init__(self, run_root, run_name):
+        self.run_root = run_root
+        self.run_name = run_name
+        self.first = None   # (time, bytes, cycle)
+        self.previous = None
+        self.latest = None
+        self.total_cycles = None
+
+    def add_sample(self, now, bytes_used, cycle, total_cycles):
+        sample = (now, bytes_used, cycle)
+        if self.first is None:
+            self.first = sample
+        self.previous = self.latest
+        self.latest = sample
+        if total_cycles:
+            self.total_cycles = total_cycles
+
+    def get_write_rate(self):
+        """
+        Returns : Bytes per second between the last two samples, or None.
+        """
+        if self.previous is None:
+            return None
+        elapsed = self.latest[0] - self.previous[0]
+        if elapsed <= 0:
+            return None
+        return max(0, self.latest[1] - self.previous[1]) / float(elapsed)
+
+    def get_bytes_per_cycle(self):
+        """
+        Returns : Bytes written per cycle since the first sample, or if that is not
+                  known yet, the average over the whole run so far. None if unknown.
+        """
+        (first_time, first_bytes, first_cycle) = self.first
+        (latest_time, latest_bytes, latest_cycle) = self.latest
+        if latest_cycle is None:
+            return None
+        if first_cycle is not None and latest_cycle > first_cycle and latest_bytes >= first_bytes:
+            return (latest_bytes - first_bytes) / float(latest_cycle - first_cycle)
+        if latest_cycle > 0:
+            return latest_bytes / float(latest_cycle)
+        return None
+
+    def get_remaining_cycles(self):
+        if self.total_cycles is None or self.latest[2] is None:
+            return None
+        return max(0, self.total_cycles - self.latest[2])
+
+    def get_remaining_bytes(self):
+        """
+        Returns : Bytes the run will still write before its last cycle, or None if unknown.
+        """
+        bytes_per_cycle = self.get_bytes_per_cycle()
+        remaining_cycles = self.get_remaining_cycles()
+        if bytes_per_cycle is None or remaining_cycles is None:
+            return None
+        return bytes_per_cycle * remaining_cycles
+
+class VolumeForecast:
+
+    def __init__(self, run_root, free_bytes, reclaimable_bytes, write_rate, remaining_bytes, runs, runs_unknown):
+        self.run_root = run_root
+        self.free_bytes = free_bytes
+        self.reclaimable_bytes = reclaimable_bytes
+        self.write_rate = write_rate            # Bytes per second, all runs in progress
+        self.remaining_bytes = remaining_bytes  # Still to be written by runs in progress
+        self.runs = runs
+        self.runs_unknown = runs_unknown        # Runs in progress whose remaining bytes aren't known
+
+    def get_seconds_to_full(self, reclaim=False):
+        """
+        Returns : Seconds until the root is full at the current write rate, or None if
+                  nothing is being written. With reclaim, as if Runs_Completed were emptied.
+        """
+        if not self.write_rate:
+            return None
+        free_bytes = self.free_bytes
+        if reclaim:
+            free_bytes += self.reclaimable_bytes
+        return max(0, free_bytes) / self.write_rate
+
+    def get_shortfall(self):
+        # Bytes more than is free that the runs in progress will need.
+        return max(0, self.remaining_bytes - self.free_bytes)
+
+    def is_at_risk(self, horizon_seconds):
+        seconds_to_full = self.get_seconds_to_full()
+        if seconds_to_full is not None and seconds_to_full < horizon_seconds:
+            return True
+        return self.get_shortfall() > 0
+
+class CapacityModel:
+
+    def __init__(self):
+        self.runs = {}   # (run_root, run_name) -> RunGrowth
+        self.roots = {}  # run_root -> (time, free bytes, reclaimable bytes)
+
+    def sample_run(self, run_root, run_name, bytes_used, cycle, total_cycles, now=None):
+        """
+        Args : cycle - the last cycle written, or None if unknown.
+               total_cycles - cycles the run will have when finished, or None if unknown.
+        """
+        if now is None:
+            now = time.time()
+        key = (run_root, run_name)
+        if key not in self.runs:
+            self.runs[key] = RunGrowth(run_root, run_name)
+        self.runs[key].add_sample(now, bytes_used, cycle, total_cycles)
+
+    def sample_root(self, run_root, free_bytes, reclaimable_bytes, now=None):
+        if now is None:
+            now = time.time()
+        self.roots[run_root] = (now, free_bytes, reclaimable_bytes)
+
+    def retain(self, keys):
+        """
+        Function : Forgets runs not in keys, a list of (run_root, run_name) of the runs
+                   still being sequenced.
+        """
+        keys = set(keys)
+        for key in self.runs.keys():
+            if key not in keys:
+                del self.runs[key]
+
+    def forecast(self, run_root):
+        """
+        Returns : A VolumeForecast for run_root, or None if the root hasn't been sampled.
+        """
+        if run_root not in self.roots:
+            return None
+        (sample_time, free_bytes, reclaimable_bytes) = self.roots[run_root]
+        write_rate = 0.0
+        remaining_bytes = 0.0
+        runs = 0
+        runs_unknown = 0
+        for growth in self.runs.values():
+            if growth.run_root != run_root:
+                continue
+            runs += 1
+            write_rate += growth.get_write_rate() or 0
+            remaining = growth.get_remaining_bytes()
+            if remaining is None:
+                runs_unknown += 1
+            else:
+                remaining_bytes += remaining
+        return VolumeForecast(run_root, free_bytes, reclaimable_bytes, write_rate, remaining_bytes, runs, runs_unknown)
+
+    def get_forecasts(self):
+        return [self.forecast(run_root) for run_root in sorted(self.roots.keys())]
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# checksum_cache.py - Cache of file checksums, one SQLite file per run root.
+#
+# Run files don't change once written, but several stages hash them: the
+# copy manifest (manifest.py), make_archive_tar's MD5 file, and any repeat
+# of those after a restart. A ChecksumCache stores each digest against the
+# file's (device, inode, size, mtime), so a file is hashed once and looked up
+# afterwards. Keying on the inode rather than the path means entries survive
+# a run being moved to Runs_Completed, which is a rename on the same volume.
+#
+# A file that changes while it is being hashed is not cached. Entries that
+# haven't been used for MAX_AGE_DAYS are pruned.
+#
+# make_archive_tar opens the same database from another process, so the
+# daemon never leaves a write transaction open: new digests and the
+# last_used times of hits are kept in memory and written in one short
+# transaction every COMMIT_EVERY changes, and on commit().
+#
+###############################################################################
+
+import os
+import sqlite3
+import threading
+import time
+
+class ChecksumCache:
+
+    SUBDIR = '.autocopy'
+    FILENAME = 'checksum_cache.sqlite'
+
+    MAX_AGE_DAYS = 180
+    COMMIT_EVERY = 500 # Changes between writes. It's a cache, so a crash may lose the last few.
+    TIMEOUT_SECONDS = 30 # Wait this long for another process' write to finish
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # Shared by the hashing threads, serialized by self.lock.
+        self.db = sqlite3.connect(db_path, timeout=self.TIMEOUT_SECONDS, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS checksums (
+                               device INTEGER, inode INTEGER, size INTEGER, mtime REAL,
+                               algorithm TEXT, digest TEXT, path TEXT, last_used REAL,
+                               PRIMARY KEY (device, inode, size, mtime, algorithm))""")
+        self.db.commit()
+        self.puts = {}    # key -> (digest, path, time), not written yet
+        self.touches = {} # key -> (path, time) of hits, not written yet
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_run_root(cls, run_root):
+        cache_dir = os.path.join(run_root, cls.SUBDIR)
+        if not os.path.exists(cache_dir):
+            os.mkdir(cache_dir, 0775)
+        return cls(os.path.join(cache_dir, cls.FILENAME))
+
+    def get_key(self, st, algorithm):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, algorithm)
+
+    def get(self, path, algorithm, st=None):
+        """
+        Returns : The cached digest of the file at path, or None.
+        """
+        if st is None:
+            st = os.stat(path)
+        key = self.get_key(st, algorithm)
+        with self.lock:
+            if key in self.puts:
+                return self.puts[key][0]
+            row = self.db.execute("""SELECT digest FROM checksums WHERE device=? AND inode=? AND size=?
+                                     AND mtime=? AND algorithm=?""", key).fetchone()
+            if row is None:
+                return None
+            self.touches[key] = (path, time.time())
+            self.mark_changed()
+        return row[0]
+
+    def put(self, path, algorithm, digest, st):
+        with self.lock:
+            self.puts[self.get_key(st, algorithm)] = (digest, path, time.time())
+            self.mark_changed()
+
+    def mark_changed(self):
+        # Caller holds self.lock
+        if len(self.puts) + len(self.touches) >= self.COMMIT_EVERY:
+            try:
+                self.write()
+            except sqlite3.OperationalError:
+                # Locked by another process for longer than TIMEOUT_SECONDS. Kept for the next write.
+                pass
+
+    def write(self):
+        # Caller holds self.lock
+        if not self.puts and not self.touches:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                [key + value for (key, value) in self.puts.items()])
+            self.db.executemany("""UPDATE checksums SET path=?, last_used=? WHERE device=? AND inode=? AND size=?
+                                   AND mtime=? AND algorithm=?""",
+                                [value + key for (key, value) in self.touches.items()])
+        self.puts = {}
+        self.touches = {}
+
+    def commit(self):
+        with self.lock:
+            self.write()
+
+    def hash_file(self, path, algorithm, hash_function):
+        """
+        Function : Returns the digest of a file, from the cache if possible.
+        Args     : hash_function - called as hash_function(path, algorithm) on a cache miss.
+        """
+        st = os.stat(path)
+        digest = self.get(path, algorithm, st)
+        if digest is not None:
+            self.hits += 1
+            return digest
+        self.misses += 1
+        digest = hash_function(path, algorithm)
+        if self.get_key(os.stat(path), algorithm) == self.get_key(st, algorithm):
+            self.put(path, algorithm, digest, st)
+        return digest
+
+    def prune(self, max_age_days=None):
+        if max_age_days is None:
+            max_age_days = self.MAX_AGE_DAYS
+        with self.lock:
+            self.write()
+            with self.db:
+                self.db.execute("DELETE FROM checksums WHERE last_used < ?", (time.time() - max_age_days * 24 * 3600,))
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# circuit_breaker.py - Calls to a remote service with deadlines and a circuit
+#                      breaker, so that an outage doesn't stall the caller.
+#
+# A GuardedCaller runs calls on a bounded pool of worker threads and waits
+# at most timeout_seconds for each. A call that runs over raises
+# DeadlineExceededError; it is left to finish on its worker, and since the
+# pool is bounded, a hung service can tie up no more than `workers` threads.
+# call_many() runs a batch of calls concurrently, under one deadline.
+#
+# Failures (timeouts, and exceptions that is_failure() says are the
+# service's fault) are counted by a CircuitBreaker. After failure_threshold
+# failures in a row the circuit opens: calls fail at once with
+# CircuitOpenError, without calling the service, for cooldown_seconds. Then
+# one trial call is let through (half open); if it succeeds the circuit
+# closes, otherwise it opens for another cool-down.
+#
+# If on_result is given, it is called with the function name, the seconds
+# waited and the exception (None on success) for every call that was made,
+# e.g. to record latency metrics.
+#
+###############################################################################
+
+import multiprocessing
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+class CircuitOpenError(Exception):
+    pass
+
+class DeadlineExceededError(Exception):
+    pass
+
+class CircuitBreaker:
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=300, on_state_change=None):
+        """
+        Args : on_state_change - called as on_state_change(old_state, new_state).
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.on_state_change = on_state_change
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_time = None
+        self.trial_in_progress = False
+
+    def get_state(self):
+        with self.lock:
+            return self.state
+
+    def allow(self, now=None):
+        """
+        Returns : True if a call may go to the service now.
+        """
+        if now is None:
+            now = time.time()
+        change = None
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if now - self.opened_time < self.cooldown_seconds:
+                    return False
+                change = self.set_state(self.HALF_OPEN)
+            # Half open: one trial call at a time.
+            allowed = not self.trial_in_progress
+            self.trial_in_progress = True
+        self.notify(change)
+        return allowed
+
+    def record_success(self):
+        change = None
+        with self.lock:
+            self.failures = 0
+            self.trial_in_progress = False
+            if self.state != self.CLOSED:
+                change = self.set_state(self.CLOSED)
+        self.notify(change)
+
+    def record_failure(self, now=None):
+        if now is None:
+            now = time.time()
+        change = None
+        with self.lock:
+            self.failures += 1
+            self.trial_in_progress = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.opened_time = now
+                change = self.set_state(self.OPEN)
+        self.notify(change)
+
+    def set_state(self, state):
+        # Caller holds self.lock. Returns the change, for notify() once the lock is released.
+        change = (self.state, state)
+        self.state = state
+        return change
+
+    def notify(self, change):
+        # Outside the lock, so a slow callback (e.g. sending email) doesn't hold up other calls.
+        if change is not None and self.on_state_change:
+            self.on_state_change(*change)
+
+class GuardedCaller:
+
+    def __init__(self, workers=4, timeout_seconds=30, breaker=None, is_failure=None, on_result=None):
+        """
+        Args : is_failure - called with an exception raised by a call; False if it doesn't count
+                            against the service (e.g. a 404 answer). Default: every exception counts.
+        """
+        self.pool = ThreadPool(workers)
+        self.timeout_seconds = timeout_seconds
+        if breaker is None:
+            breaker = CircuitBreaker()
+        self.breaker = breaker
+        if is_failure is None:
+            is_failure = lambda error: True
+        self.is_failure = is_failure
+        self.on_result = on_result
+
+    def call(self, function, *args):
+        """
+        Function : Returns function(*args), run on the pool.
+                   Raises CircuitOpenError, DeadlineExceededError or the call's own exception.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("Circuit open, not calling %s" % get_name(function))
+        start_time = time.time()
+        result = self.pool.apply_async(function, args)
+        return self.get_result(result, self.timeout_seconds, get_name(function), start_time)
+
+    def call_many(self, function, keys):
+        """
+        Function : Runs function(key) for each of keys concurrently, under one deadline.
+        Returns  : A dict of key to (value, error); error is None if the call succeeded.
+        """
+        if not self.breaker.allow():
+            error = CircuitOpenError("Circuit open, not calling %s" % get_name(function))
+            return dict((key, (None, error)) for key in keys)
+        start_time = time.time()
+        pending = [(key, self.pool.apply_async(function, (key,))) for key in keys]
+        deadline = start_time + self.timeout_seconds
+        outcomes = {}
+        timed_out = False
+        for (key, result) in pending:
+            if timed_out:
+                # One failure for the batch, not one per call left waiting.
+                if not result.ready():
+                    outcomes[key] = (None, DeadlineExceededError("No answer within %s seconds" % self.timeout_seconds))
+                    self.report(get_name(function), start_time, outcomes[key][1])
+                    continue
+            try:
+                outcomes[key] = (self.get_result(result, max(0, deadline - time.time()), get_name(function), start_time), None)
+            except DeadlineExceededError as e:
+                timed_out = True
+                outcomes[key] = (None, e)
+            except Exception as e:
+                outcomes[key] = (None, e)
+        return outcomes
+
+    def get_result(self, result, timeout, name=None, start_time=None):
+        try:
+            value = result.get(timeout)
+        except multiprocessing.TimeoutError:
+            self.breaker.record_failure()
+            error = DeadlineExceededError("No answer within %s seconds" % self.timeout_seconds)
+            self.report(name, start_time, error)
+            raise error
+        except Exception as e:
+            if self.is_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            self.report(name, start_time, e)
+            raise
+        self.breaker.record_success()
+        self.report(name, start_time, None)
+        return value
+
+    def report(self, name, start_time, error):
+        if self.on_result and start_time is not None:
+            self.on_result(name, time.time() - start_time, error)
+
+def get_name(function):
+    return getattr(function, '__name__', str(function))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# copy_history.py - Append-only SQLite history of finished copies, and a
+#                   report of copy durations and throughput from it.
+#
+# Autocopy records every copy it finishes with CopyHistory.record(): the
+# run, instrument, destination, backend, start and end times, bytes and
+# files, throughput, restarts and time spent waiting in the copy queue.
+# Rows are only ever added; triggers refuse updates and deletes.
+#
+# Durations and sizes of runs copied before the history existed can be
+# added from their Autocopy_started.txt and Autocopy_complete.txt mtimes
+# with autocopyTimes.py --db.
+#
+# As a script, prints percentiles and totals grouped by instrument,
+# destination and/or month:
+#
+#   copy_history.py --db /path/to/copy_history.sqlite --by instrument,month
+#
+###############################################################################
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+COLUMNS = [
+    ('run', 'TEXT NOT NULL'),
+    ('instrument', 'TEXT'),
+    ('run_root', 'TEXT'),
+    ('destination', 'TEXT'),
+    ('backend', 'TEXT'),
+    ('host', 'TEXT'),
+    ('source', 'TEXT'),                # 'autocopy', or 'sentinel' for runs added by autocopyTimes.py
+    ('start_time', 'REAL'),
+    ('end_time', 'REAL'),
+    ('seconds', 'REAL'),
+    ('bytes', 'INTEGER'),              # Size of the run directory
+    ('bytes_transferred', 'INTEGER'),  # Less than bytes if the copy resumed an earlier one
+    ('files', 'INTEGER'),
+    ('bytes_per_second', 'REAL'),
+    ('restarts', 'INTEGER'),
+    ('queue_wait_seconds', 'REAL'),
+    ('recorded_time', 'REAL'),
+]
+COLUMN_NAMES = [name for (name, type_name) in COLUMNS]
+
+GROUPS = ['instrument', 'destination', 'backend', 'month']
+
+def percentile(values, fraction):
+    """
+    Returns : The value below which `fraction` of values lie, interpolating between
+              the nearest two. None if there are no values.
+    """
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def get_instrument(run_name):
+    # Run names are YYMMDD_INSTRUMENT_NUMBER_FLOWCELL.
+    parts = run_name.split('_')
+    if len(parts) < 2:
+        return None
+    return parts[1]
+
+def get_month(row):
+    if row['end_time'] is None:
+        return None
+    return time.strftime('%Y-%m', time.localtime(row['end_time']))
+
+class CopyHistory:
+
+    FILENAME = 'copy_history.sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Finalizer threads record copies, so the connection is shared under self.lock.
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.create_schema()
+
+    def create_schema(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("CREATE TABLE IF NOT EXISTS copies (id INTEGER PRIMARY KEY, %s)"
+                                  % ', '.join('%s %s' % column for column in COLUMNS))
+                self.conn.execute("CREATE INDEX IF NOT EXISTS copies_end_time ON copies (end_time)")
+                for action in ['UPDATE', 'DELETE']:
+                    self.conn.execute("CREATE TRIGGER IF NOT EXISTS copies_no_%s BEFORE %s ON copies "
+                                      "BEGIN SELECT RAISE(ABORT, 'copy history is append-only'); END"
+                                      % (action.lower(), action))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def record(self, **fields):
+        """
+        Function : Adds a finished copy. fields are named as in COLUMNS; seconds and
+                   bytes_per_second are worked out if they are left out.
+        """
+        unknown = set(fields.keys()) - set(COLUMN_NAMES)
+        if unknown:
+            raise ValueError("Unknown copy history fields %s" % sorted(unknown))
+        row = dict((name, fields.get(name)) for name in COLUMN_NAMES)
+        if row['seconds'] is None and row['start_time'] is not None and row['end_time'] is not None:
+            row['seconds'] = row['end_time'] - row['start_time']
+        if row['bytes_per_second'] is None and row['seconds']:
+            transferred = row['bytes_transferred']
+            if transferred is None:
+                transferred = row['bytes']
+            if transferred is not None:
+                row['bytes_per_second'] = transferred / float(row['seconds'])
+        if row['recorded_time'] is None:
+            row['recorded_time'] = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute("INSERT INTO copies (%s) VALUES (%s)" % (', '.join(COLUMN_NAMES), ', '.join(['?'] * len(COLUMN_NAMES))),
+                                  [row[name] for name in COLUMN_NAMES])
+
+    def has_run(self, run):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM copies WHERE run = ? LIMIT 1", (run,)).fetchone() is not None
+
+    def get_copies(self, since=None, until=None):
+        """
+        Returns : Copies that ended in [since, until), as dicts, oldest first.
+        """
+        query = "SELECT * FROM copies WHERE 1"
+        args = []
+        if since is not None:
+            query += " AND end_time >= ?"
+            args.append(since)
+        if until is not None:
+            query += " AND end_time < ?"
+            args.append(until)
+        query += " ORDER BY end_time, id"
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, args)]
+
+def summarize(rows, group_by):
+    """
+    Returns : A list of (group values, summary dict) sorted by group, where summary has
+              the number of copies, total terabytes, and percentiles of hours and MB/s.
+    """
+    groups = {}
+    for row in rows:
+        key = tuple(get_month(row) if name == 'month' else row[name] for name in group_by)
+        groups.setdefault(key, []).append(row)
+    summaries = []
+    for key in sorted(groups.keys()):
+        group = groups[key]
+        hours = [row['seconds'] / 3600.0 for row in group if row['seconds'] is not None]
+        rates = [row['bytes_per_second'] / 1024.0**2 for row in group if row['bytes_per_second'] is not None]
+        summaries.append((key, {
+            'copies': len(group),
+            'terabytes': sum(row['bytes'] or 0 for row in group) / 1024.0**4,
+            'restarts': sum(row['restarts'] or 0 for row in group),
+            'hours_p50': percentile(hours, 0.5),
+            'hours_p90': percentile(hours, 0.9),
+            'hours_max': max(hours) if hours else None,
+            'mb_per_second_p10': percentile(rates, 0.1),
+            'mb_per_second_p50': percentile(rates, 0.5),
+            'mb_per_second_p90': percentile(rates, 0.9),
+        }))
+    return summaries
+
+REPORT_FIELDS = ['copies', 'terabytes', 'restarts', 'hours_p50', 'hours_p90', 'hours_max',
+                 'mb_per_second_p10', 'mb_per_second_p50', 'mb_per_second_p90']
+
+def format_report(summaries, group_by):
+    """
+    Returns : The summaries as tab separated text with a header line.
+    """
+    lines = ['\t'.join(group_by + REPORT_FIELDS)]
+    for (key, summary) in summaries:
+        values = [str(value) for value in key]
+        for field in REPORT_FIELDS:
+            value = summary[field]
+            if value is None:
+                values.append('')
+            elif isinstance(value, float):
+                values.append('%.2f' % value)
+            else:
+                values.append(str(value))
+        lines.append('\t'.join(values))
+    return '\n'.join(lines) + '\n'
+
+def parse_date(text):
+    return time.mktime(datetime.datetime.strptime(text, '%Y-%m-%d').timetuple())
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    description = "Reports copy durations and throughput from the copy history kept by autocopy."
+    parser = OptionParser(usage="%prog --db DB [options]", description=description)
+    parser.add_option("--db", dest="db", help="Copy history database (%s in the .autocopy directory of the first run root)"
+                      % CopyHistory.FILENAME)
+    parser.add_option("--by", dest="by", default="instrument",
+                      help="Comma separated groups, from %s [default = %%default]" % ', '.join(GROUPS))
+    parser.add_option("--since", dest="since", default=None, help="Only copies that ended on or after this date, YYYY-MM-DD")
+    parser.add_option("--until", dest="until", default=None, help="Only copies that ended before this date, YYYY-MM-DD")
+    (opts, args) = parser.parse_args()
+
+    if not opts.db:
+        parser.error("You must supply the --db argument")
+    if not os.path.exists(opts.db):
+        parser.error("%s does not exist" % opts.db)
+    group_by = [name for name in opts.by.split(',') if name]
+    for name in group_by:
+        if name not in GROUPS:
+            parser.error("Unknown group %s. Must be one of %s" % (name, ', '.join(GROUPS)))
+
+    history = CopyHistory(opts.db)
+    rows = history.get_copies(since=parse_date(opts.since) if opts.since else None,
+                              until=parse_date(opts.until) if opts.until else None)
+    print format_report(summarize(rows, group_by), group_by),
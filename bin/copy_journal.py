@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# copy_journal.py - Durable record of copies in progress.
+#
+# Autocopy keeps copy processes in memory only (RunDir.copy_proc), so a
+# daemon restart used to forget them: the orphaned copy kept running and a
+# second one was started on top of it, with -c checksumming the whole run.
+#
+# The CopyJournal records each copy when it starts (pids, command lines,
+# backend, start time, restarts, last progress) in a JSON file under the run
+# root, rewritten atomically. Copy output goes to a file next to it rather
+# than a pipe, so the copy doesn't die with the daemon. On startup Autocopy
+# looks up each run in the journal, and either reattaches to the copy if its
+# processes are still alive with the same command lines, or resumes the copy
+# without rehashing.
+#
+###############################################################################
+
+import json
+import os
+import platform
+import signal
+import subprocess
+import tempfile
+import time
+
+from transfer import is_process_alive
+
+def get_process_command(pid):
+    """
+    Returns : The command line of a running process as a string, or None if it isn't running.
+    """
+    if platform.system() == "Linux":
+        try:
+            with open('/proc/%d/cmdline' % pid) as f:
+                cmdline = f.read()
+        except IOError:
+            return None
+        return ' '.join(cmdline.rstrip('\0').split('\0'))
+
+    ps_proc = subprocess.Popen(['ps', '-ww', '-o', 'command=', '-p', str(pid)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (ps_stdout, ps_stderr) = ps_proc.communicate()
+    if ps_proc.returncode != 0:
+        return None
+    return ps_stdout.strip() or None
+
+class AdoptedProcess:
+    """
+    Process-like object for a copy started by a previous autocopy daemon.
+    It is not our child, so its exit status can't be collected: poll()
+    returns RETCODE_UNKNOWN once the last process in the copy has exited.
+    """
+
+    RETCODE_UNKNOWN = -1
+
+    def __init__(self, pids):
+        self.pids = pids
+        self.pid = pids[-1]
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None and not is_process_alive(self.pid):
+            self.returncode = self.RETCODE_UNKNOWN
+        return self.returncode
+
+    def wait(self, poll_seconds=1):
+        while self.poll() is None:
+            time.sleep(poll_seconds)
+        return self.returncode
+
+    def kill(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+class CopyJournal:
+
+    # Hidden, so it is never mistaken for a run directory.
+    SUBDIR = '.autocopy'
+    FILENAME = 'copy_journal.json'
+
+    def __init__(self, run_root):
+        self.dir = os.path.join(run_root, self.SUBDIR)
+        self.path = os.path.join(self.dir, self.FILENAME)
+        if not os.path.exists(self.dir):
+            os.mkdir(self.dir, 0775)
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except ValueError:
+            # A torn file can't happen with save(), but don't crash on a hand-edited one.
+            self.entries = {}
+
+    def save(self):
+        """
+        Function : Writes the journal if it changed. The file is replaced atomically,
+                   so a crash leaves either the old or the new journal, never half of one.
+        """
+        if not self.dirty:
+            return
+        (fd, tmp_path) = tempfile.mkstemp(prefix=self.FILENAME + '.', dir=self.dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.dirty = False
+
+    def get_output_path(self, rundir):
+        return os.path.join(self.dir, rundir.get_dir() + '.copy.out')
+
+    def get_entry(self, rundir):
+        return self.entries.get(rundir.get_dir())
+
+    def record_start(self, rundir, copy_proc, backend_name, resume):
+        pids = getattr(copy_proc, 'pids', [copy_proc.pid])
+        self.entries[rundir.get_dir()] = {
+            'pids': pids,
+            'commands': [get_process_command(pid) for pid in pids],
+            'backend': backend_name,
+            'resume': resume,
+            'start_time': time.time(),
+            'copy_restarts': rundir.copy_restarts,
+            'progress': None,
+        }
+        self.dirty = True
+        self.save()
+
+    def record_progress(self, rundir):
+        # Kept in memory until the next save(), once per main loop pass.
+        entry = self.get_entry(rundir)
+        if entry is None or rundir.copy_progress is None:
+            return
+        snapshot = rundir.copy_progress.get_snapshot()
+        entry['progress'] = {
+            'bytes_transferred': snapshot['bytes_transferred'],
+            'files_transferred': snapshot['files_transferred'],
+            'files_total': snapshot['files_total'],
+            'updated': time.time(),
+        }
+        self.dirty = True
+
+    def record_end(self, rundir):
+        if self.entries.pop(rundir.get_dir(), None) is not None:
+            self.dirty = True
+            self.save()
+        output_path = self.get_output_path(rundir)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    def is_entry_running(self, entry):
+        """
+        Returns : True if every process of the journaled copy is alive and still
+                  running the same command line, so it is safe to reattach.
+        """
+        for (pid, command) in zip(entry['pids'], entry['commands']):
+            if command is None or not is_process_alive(pid):
+                return False
+            if get_process_command(pid) != command:
+                return False # The pid was reused by another process.
+        return True
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# copy_progress.py - Live progress telemetry for copy processes.
+#
+# rsync is run with --info=progress2 --stats, which makes it write a single
+# whole-transfer progress line, repeatedly overwritten with '\r':
+#
+#     1,238,099,968  45%   45.67MB/s    0:01:23 (xfr#1234, to-chk=100/2000)
+#
+# followed by a --stats block when it finishes. A RsyncProgressReader thread
+# reads the copy process' stdout without blocking the main loop, parses it
+# into a CopyProgress object, and passes any other output to a log function.
+#
+# The output can be a pipe, or a file the copy process writes to, which the
+# reader follows until the writer exits. A copy writing to a file outlives
+# the daemon that started it, and can be followed again after a restart.
+#
+###############################################################################
+
+import collections
+import os
+import re
+import threading
+import time
+
+PROGRESS_REG = re.compile(r'^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kMGT]?B)/s\s+(\d+(?::\d+)+)'
+                          r'(?:\s+\(xfr#(\d+),\s+(?:to|ir)-chk=(\d+)/(\d+)\))?')
+STATS_FILES_TRANSFERRED_REG = re.compile(r'^Number of (?:regular )?files transferred:\s+([\d,]+)')
+STATS_BYTES_TRANSFERRED_REG = re.compile(r'^Total transferred file size:\s+([\d,]+)')
+STATS_TOTAL_FILES_REG = re.compile(r'^Number of files:\s+([\d,]+)')
+STATS_TOTAL_BYTES_REG = re.compile(r'^Total file size:\s+([\d,]+)')
+
+RATE_UNITS = {
+    'B': 1,
+    'kB': 1024,
+    'MB': 1024**2,
+    'GB': 1024**3,
+    'TB': 1024**4,
+}
+
+def parse_int(text):
+    return int(text.replace(',', ''))
+
+def parse_duration(text):
+    # "1:23", "0:01:23" or "1:02:03:04" (days first) -> seconds
+    parts = [int(part) for part in text.split(':')]
+    if len(parts) == 4:
+        parts = [parts[0] * 24 + parts[1]] + parts[2:]
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+def read_chunks(stream, writer_alive=None, read_size=4096, follow_interval=1):
+    """
+    Function : Yields chunks read from stream until EOF.
+    Args     : writer_alive - if given, a function returning False once the writer is done.
+               EOF then only ends the stream after the writer is done, so that a file still
+               being written is followed like 'tail -f'.
+    """
+    fd = stream.fileno()
+    while True:
+        # Check before reading, so that output written just before the writer exited is not lost.
+        writer_done = writer_alive is None or not writer_alive()
+        chunk = os.read(fd, read_size)
+        if chunk:
+            yield chunk
+        elif writer_done:
+            return
+        else:
+            time.sleep(follow_interval)
+
+def parse_progress_line(line):
+    """
+    Function : Parses one rsync --info=progress2 line.
+    Returns  : A dict with keys bytes_transferred, percent, rate, eta_seconds, and
+               (if present) files_transferred, files_remaining, files_total;
+               or None if the line is not a progress line.
+    """
+    m = PROGRESS_REG.match(line)
+    if not m:
+        return None
+    (bytes_transferred, percent, rate, rate_unit, eta, xfr, to_check, total) = m.groups()
+    progress = {
+        'bytes_transferred': parse_int(bytes_transferred),
+        'percent': int(percent),
+        'rate': float(rate) * RATE_UNITS[rate_unit],
+        'eta_seconds': parse_duration(eta),
+    }
+    if xfr is not None:
+        progress['files_transferred'] = int(xfr)
+        progress['files_remaining'] = int(to_check)
+        progress['files_total'] = int(total)
+    return progress
+
+class CopyProgress:
+    """
+    Snapshot of a copy in progress. Updated by the reader thread, read by the main loop.
+    """
+
+    # (time, bytes_transferred) samples kept for get_rate_over().
+    # progress2 updates about once a second, so this covers a few hours
+    # even if the reader is fed faster.
+    MAX_SAMPLES = 4096
+    SAMPLE_INTERVAL_SECONDS = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.bytes_transferred = 0
+        self.files_transferred = 0
+        self.files_total = None
+        self.bytes_total = None
+        self.percent = None
+        self.rate = None
+        self.eta_seconds = None
+        self.last_update_time = None
+        # The stall clock starts at the first progress line, not at start_time: rsync
+        # transfers nothing while it builds the file list, which for a large run (or
+        # with -c, which reads every file) can take longer than any stall limit.
+        self.first_progress_time = None
+        self.last_bytes_time = None
+        self.finished = False
+        self.samples = collections.deque([], self.MAX_SAMPLES)
+
+    def update(self, values, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if self.first_progress_time is None:
+                self.first_progress_time = now
+                self.last_bytes_time = now
+            new_bytes = values.get('bytes_transferred')
+            if new_bytes is not None and new_bytes > self.bytes_transferred:
+                self.last_bytes_time = now
+            for (key, value) in values.items():
+                if key == 'files_remaining':
+                    continue
+                setattr(self, key, value)
+            self.last_update_time = now
+            if not self.samples or now - self.samples[-1][0] >= self.SAMPLE_INTERVAL_SECONDS:
+                self.samples.append((now, self.bytes_transferred))
+
+    def set_finished(self):
+        with self.lock:
+            self.finished = True
+
+    def get_snapshot(self):
+        with self.lock:
+            return {
+                'bytes_transferred': self.bytes_transferred,
+                'files_transferred': self.files_transferred,
+                'files_total': self.files_total,
+                'bytes_total': self.bytes_total,
+                'percent': self.percent,
+                'rate': self.rate,
+                'eta_seconds': self.eta_seconds,
+                'last_update_time': self.last_update_time,
+                'last_bytes_time': self.last_bytes_time,
+                'finished': self.finished,
+            }
+
+    def get_average_rate(self, now=None):
+        # Bytes per second over the whole copy so far.
+        if now is None:
+            now = time.time()
+        elapsed = now - self.start_time
+        if elapsed <= 0:
+            return None
+        return self.bytes_transferred / elapsed
+
+    def get_seconds_since_bytes(self, now=None):
+        # Seconds since the byte count last went up (or since the first progress line),
+        # or None if there hasn't been a progress line yet.
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if self.last_bytes_time is None:
+                return None
+            return now - self.last_bytes_time
+
+    def get_rate_over(self, seconds, now=None):
+        """
+        Function : Average transfer rate over the last 'seconds' seconds.
+        Returns  : Bytes per second, or None if the copy hasn't been reporting progress
+                   that long.
+        """
+        if now is None:
+            now = time.time()
+        window_start = now - seconds
+        with self.lock:
+            if self.first_progress_time is None or self.first_progress_time > window_start:
+                return None
+            base = self.samples[0]
+            for sample in self.samples:
+                if sample[0] > window_start:
+                    break
+                base = sample
+            bytes_transferred = self.bytes_transferred
+        elapsed = now - base[0]
+        if elapsed <= 0:
+            return None
+        return (bytes_transferred - base[1]) / float(elapsed)
+
+    def get_summary(self):
+        snapshot = self.get_snapshot()
+        parts = []
+        if snapshot['percent'] is not None:
+            parts.append("%d%%" % snapshot['percent'])
+        parts.append("%.1f GB" % (snapshot['bytes_transferred'] / 1024.0**3))
+        if snapshot['files_total']:
+            parts.append("%d/%d files" % (snapshot['files_transferred'], snapshot['files_total']))
+        else:
+            parts.append("%d files" % snapshot['files_transferred'])
+        if snapshot['rate'] is not None:
+            parts.append("%.1f MB/s" % (snapshot['rate'] / 1024.0**2))
+        if snapshot['eta_seconds'] is not None and not snapshot['finished']:
+            parts.append("ETA %ds" % snapshot['eta_seconds'])
+        return ' '.join(parts)
+
+class RsyncProgressReader(threading.Thread):
+    """
+    Reads an rsync process' stdout until EOF, updating a CopyProgress.
+    Lines that are not progress lines are passed to log_function.
+    With writer_alive, stream is a file followed until writer_alive() is False.
+    """
+
+    READ_SIZE = 4096
+
+    def __init__(self, stream, progress=None, log_function=None, writer_alive=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stream = stream
+        if progress is None:
+            progress = CopyProgress()
+        self.progress = progress
+        self.log_function = log_function
+        self.writer_alive = writer_alive
+
+    def run(self):
+        pending = ''
+        try:
+            for chunk in read_chunks(self.stream, self.writer_alive, self.READ_SIZE):
+                pending += chunk
+                # progress2 lines end in '\r', everything else in '\n'.
+                lines = re.split(r'[\r\n]', pending)
+                pending = lines.pop()
+                for line in lines:
+                    self.handle_line(line)
+            if pending:
+                self.handle_line(pending)
+        finally:
+            self.progress.set_finished()
+            self.stream.close()
+
+    def handle_line(self, line):
+        if not line.strip():
+            return
+        values = parse_progress_line(line)
+        if values is not None:
+            self.progress.update(values)
+            return
+        stats = self.parse_stats_line(line)
+        if stats:
+            self.progress.update(stats)
+        if self.log_function:
+            self.log_function(line)
+
+    def parse_stats_line(self, line):
+        for (reg, key) in ((STATS_FILES_TRANSFERRED_REG, 'files_transferred'),
+                           (STATS_BYTES_TRANSFERRED_REG, 'bytes_transferred'),
+                           (STATS_TOTAL_FILES_REG, 'files_total'),
+                           (STATS_TOTAL_BYTES_REG, 'bytes_total')):
+            m = reg.match(line)
+            if m:
+                return {key: parse_int(m.group(1))}
+        return None
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# copy_queue.py - Ordering of run directories waiting for a copy slot.
+#
+# When Autocopy has MAX_COPY_PROCESSES copies running, finished runs wait
+# in a CopyQueue until a slot frees up. The queue decides which run is
+# started next according to one of these policies:
+#
+#   oldest_finished  - Run that finished sequencing (RTAComplete) earliest.
+#   smallest_first   - Run with the smallest estimated size.
+#   lims_priority    - Run with the highest LIMS priority, oldest first on ties.
+#   instrument_fair  - Run from the instrument with the fewest copies in
+#                      progress, oldest first on ties.
+#
+# Runs from run roots that are forecast to fill up soon (see capacity.py and
+# set_pressured_roots()) go ahead of all others, in policy order among
+# themselves, so that they can be moved out of the way sooner.
+#
+# The queue also records how long each run waited for its slot.
+#
+###############################################################################
+
+import time
+
+class CopyQueueEntry:
+
+    def __init__(self, rundir, lims_runinfo, enqueued_time):
+        self.rundir = rundir
+        self.lims_runinfo = lims_runinfo
+        self.enqueued_time = enqueued_time
+
+    def get_wait_seconds(self, now=None):
+        if now is None:
+            now = time.time()
+        return now - self.enqueued_time
+
+class CopyQueue:
+
+    POLICY_OLDEST_FINISHED = 'oldest_finished'
+    POLICY_SMALLEST_FIRST = 'smallest_first'
+    POLICY_LIMS_PRIORITY = 'lims_priority'
+    POLICY_INSTRUMENT_FAIR = 'instrument_fair'
+
+    POLICIES = [
+        POLICY_OLDEST_FINISHED,
+        POLICY_SMALLEST_FIRST,
+        POLICY_LIMS_PRIORITY,
+        POLICY_INSTRUMENT_FAIR,
+    ]
+
+    def __init__(self, policy=POLICY_OLDEST_FINISHED):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown copy queue policy %s. Valid policies are %s" % (policy, self.POLICIES))
+        self.policy = policy
+        self.entries = {}
+        self.pressured_roots = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, rundir):
+        return rundir.get_path() in self.entries
+
+    def add(self, rundir, lims_runinfo=None):
+        """
+        Function : Adds a run to the queue, or refreshes its LIMS info if it is already queued.
+                   A run keeps its original enqueued time until it is popped or removed.
+        """
+        key = rundir.get_path()
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = CopyQueueEntry(rundir, lims_runinfo, time.time())
+        else:
+            entry.rundir = rundir
+            entry.lims_runinfo = lims_runinfo
+
+    def remove(self, rundir):
+        self.entries.pop(rundir.get_path(), None)
+
+    def retain(self, rundirs):
+        """
+        Function : Drops queued runs that are no longer in rundirs (moved, aborted, deleted).
+        """
+        keep = set([rundir.get_path() for rundir in rundirs])
+        for key in self.entries.keys():
+            if key not in keep:
+                del self.entries[key]
+
+    def get_rundirs(self):
+        """
+        Returns : Queued rundir.RunDir objects in the order they would be started.
+        """
+        return [entry.rundir for entry in self.get_ordered_entries()]
+
+    def set_pressured_roots(self, run_roots):
+        self.pressured_roots = set(run_roots)
+
+    def get_wait_seconds(self, rundir):
+        entry = self.entries.get(rundir.get_path())
+        if entry is None:
+            return None
+        return entry.get_wait_seconds()
+
+    def pop_next(self, copying_rundirs=None):
+        """
+        Function : Removes and returns the queue entry that should get the next copy slot.
+        Args     : copying_rundirs - list of rundir.RunDir objects with a copy in progress.
+                   Used by the instrument_fair policy.
+        Returns  : A CopyQueueEntry, or None if the queue is empty.
+        """
+        ordered = self.get_ordered_entries(copying_rundirs)
+        if not ordered:
+            return None
+        entry = ordered[0]
+        del self.entries[entry.rundir.get_path()]
+        return entry
+
+    def get_ordered_entries(self, copying_rundirs=None):
+        if copying_rundirs is None:
+            copying_rundirs = []
+
+        if self.policy == self.POLICY_SMALLEST_FIRST:
+            sort_key = lambda entry: (self.get_size_estimate(entry.rundir), self.get_finished_time(entry))
+        elif self.policy == self.POLICY_LIMS_PRIORITY:
+            sort_key = lambda entry: (-self.get_lims_priority(entry.lims_runinfo), self.get_finished_time(entry))
+        elif self.policy == self.POLICY_INSTRUMENT_FAIR:
+            active_per_machine = {}
+            for rundir in copying_rundirs:
+                machine = self.get_machine(rundir)
+                active_per_machine[machine] = active_per_machine.get(machine, 0) + 1
+            sort_key = lambda entry: (active_per_machine.get(self.get_machine(entry.rundir), 0), self.get_finished_time(entry))
+        else:
+            sort_key = self.get_finished_time
+
+        if self.pressured_roots:
+            policy_key = sort_key
+            sort_key = lambda entry: (entry.rundir.get_root() not in self.pressured_roots, policy_key(entry))
+
+        return sorted(self.entries.values(), key=sort_key)
+
+    #
+    # Sort keys. Each falls back to a neutral value so that one unreadable
+    # run directory can't stop the queue from draining.
+    #
+    def get_finished_time(self, entry):
+        finished_time = entry.rundir.get_finished_time()
+        if finished_time is None:
+            return entry.enqueued_time
+        return finished_time
+
+    def get_size_estimate(self, rundir):
+        try:
+            return rundir.get_size_estimate()
+        except Exception:
+            return 0
+
+    def get_lims_priority(self, lims_runinfo):
+        # Not every LIMS exposes a run priority; runs without one rank as 0.
+        get_priority = getattr(lims_runinfo, 'get_priority', None)
+        if get_priority is None:
+            return 0
+        try:
+            return int(get_priority() or 0)
+        except Exception:
+            return 0
+
+    def get_machine(self, rundir):
+        try:
+            return rundir.get_machine()
+        except Exception:
+            return None
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# disk_usage.py - In-process disk usage of directory trees, like 'du -s'.
+#
+# A DiskUsage engine walks a tree one level at a time, listing the
+# directories of each level in parallel on a thread pool (lanes, tiles and
+# cycles are spread across many directories). Each file counts st_blocks*512
+# bytes, as du does. Hard links are not de-duplicated.
+#
+# The bytes of the files directly in each directory are cached against the
+# directory's mtime, so a later call only re-lists directories whose entries
+# have changed; unchanged directories cost one stat. A file that grows in
+# place doesn't change its directory's mtime, so use refresh=True on trees
+# that are still being written. Entries for subdirectories that have gone
+# are dropped when their parent is listed again; call forget() for a tree
+# that has been moved or deleted as a whole.
+#
+# Directories are listed with scandir when it is available (python 3.5+, or
+# the scandir module), else with listdir and lstat.
+#
+###############################################################################
+
+import os
+import stat
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+BLOCK_SIZE = 512 # Unit of st_blocks
+
+def list_dir(path):
+    """
+    Returns : (bytes of the files directly in path, list of subdirectory paths).
+              Symlinks are counted as files and not followed.
+    """
+    file_bytes = 0
+    subdirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            else:
+                file_bytes += entry.stat(follow_symlinks=False).st_blocks * BLOCK_SIZE
+        return (file_bytes, subdirs)
+
+    for name in os.listdir(path):
+        child = os.path.join(path, name)
+        try:
+            st = os.lstat(child)
+        except OSError:
+            continue # Removed since the listing
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(child)
+        else:
+            file_bytes += st.st_blocks * BLOCK_SIZE
+    return (file_bytes, subdirs)
+
+class DiskUsage:
+
+    def __init__(self, threads=8):
+        self.pool = ThreadPool(threads)
+        self.lock = threading.Lock()
+        self.cache = {} # directory path -> (mtime, file bytes, subdirectory paths)
+        self.listed = 0 # Directories listed, rather than served from the cache
+
+    def get_usage(self, path, refresh=False):
+        """
+        Function : Disk usage of the tree under path, in bytes.
+        Args     : refresh - ignore the cache, and list every directory again.
+        """
+        path = os.path.abspath(path)
+        total = 0
+        level = [path]
+        while level:
+            results = self.pool.map(lambda directory: self.scan(directory, refresh), level)
+            level = []
+            for (dir_bytes, subdirs) in results:
+                total += dir_bytes
+                level.extend(subdirs)
+        return total
+
+    def scan(self, path, refresh=False):
+        """
+        Returns : (bytes used by the directory itself and the files in it, subdirectory paths)
+        """
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return (0, []) # Removed since its parent was listed
+        dir_bytes = st.st_blocks * BLOCK_SIZE
+        with self.lock:
+            cached = self.cache.get(path)
+        if cached is not None and cached[0] == st.st_mtime and not refresh:
+            return (dir_bytes + cached[1], cached[2])
+
+        try:
+            (file_bytes, subdirs) = list_dir(path)
+        except OSError:
+            return (dir_bytes, [])
+        with self.lock:
+            self.cache[path] = (st.st_mtime, file_bytes, subdirs)
+            self.listed += 1
+        if cached is not None:
+            for removed in set(cached[2]) - set(subdirs):
+                self.forget(removed)
+        return (dir_bytes + file_bytes, subdirs)
+
+    def forget(self, path):
+        # Drops cached entries for a tree that has been moved or deleted.
+        path = os.path.abspath(path)
+        with self.lock:
+            for cached_path in self.cache.keys():
+                if cached_path == path or cached_path.startswith(path + os.sep):
+                    del self.cache[cached_path]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Returns : The DiskUsage engine shared by the whole process.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DiskUsage()
+        return _engine
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# event_aggregator.py - Decides which events are emailed now, which wait for
+#                       a digest, and which are repeats to drop.
+#
+# Autocopy used to send one email per event, so a failing pass sent the same
+# exception every MAIN_LOOP_DELAY_SECONDS, and a busy day sent dozens of
+# routine emails. Each email now goes through EventAggregator.submit() with
+# a type, a severity and a key, and comes back with one of:
+#
+#   SEND     - send it now.
+#   DIGEST   - hold it for the next digest (pop_digest()).
+#   SUPPRESS - a repeat; it is counted, and the count shows in the digest.
+#
+# An event with the same type and key as one seen in the last dedupe_seconds
+# is a repeat, whatever its severity; key None means an event is never a
+# repeat. Otherwise URGENT events are always sent. NORMAL events are sent
+# until rate_limit of their type have been sent in rate_limit_seconds; the
+# rest go to the digest. LOW events always go to the digest.
+#
+###############################################################################
+
+import threading
+import time
+
+URGENT = 'urgent'
+NORMAL = 'normal'
+LOW = 'low'
+SEVERITIES = [URGENT, NORMAL, LOW]
+
+SEND = 'send'
+DIGEST = 'digest'
+SUPPRESS = 'suppress'
+
+class DigestEntry:
+
+    def __init__(self, event_type, subject, body, now):
+        self.event_type = event_type
+        self.subject = subject
+        self.body = body
+        self.first_time = now
+        self.last_time = now
+        self.count = 1
+
+    def get_summary(self):
+        summary = "%s  %s" % (time.strftime('%x %X', time.localtime(self.first_time)), self.subject)
+        if self.count > 1:
+            summary += " (%s times, last %s)" % (self.count, time.strftime('%x %X', time.localtime(self.last_time)))
+        return summary
+
+class EventAggregator:
+
+    def __init__(self, dedupe_seconds=21600, rate_limit=10, rate_limit_seconds=3600):
+        self.dedupe_seconds = dedupe_seconds
+        self.rate_limit = rate_limit
+        self.rate_limit_seconds = rate_limit_seconds
+        # Reentrant, as the SIGUSR1 summary calls in from a signal handler on the
+        # main thread, which may already hold it in submit().
+        self.lock = threading.RLock()
+        self.last_seen = {}   # (event_type, key) -> time
+        self.sent_times = {}  # event_type -> times sent within the rate limit window
+        self.digest = []
+        self.repeats = {}     # (event_type, key) -> DigestEntry counting suppressed repeats
+
+    def submit(self, event_type, severity, key, subject, body, now=None):
+        """
+        Returns : SEND, DIGEST or SUPPRESS.
+        """
+        if severity not in SEVERITIES:
+            raise ValueError("Unknown severity %s. Must be one of %s" % (severity, SEVERITIES))
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if key is not None:
+                identity = (event_type, key)
+                last_seen = self.last_seen.get(identity)
+                if last_seen is not None and now - last_seen < self.dedupe_seconds:
+                    self.count_repeat(identity, subject, now)
+                    return SUPPRESS
+                self.last_seen[identity] = now
+            if severity == LOW:
+                self.digest.append(DigestEntry(event_type, subject, body, now))
+                return DIGEST
+            if severity == NORMAL:
+                sent_times = [t for t in self.sent_times.get(event_type, []) if now - t < self.rate_limit_seconds]
+                self.sent_times[event_type] = sent_times
+                if len(sent_times) >= self.rate_limit:
+                    self.digest.append(DigestEntry(event_type, subject, body, now))
+                    return DIGEST
+            self.sent_times.setdefault(event_type, []).append(now)
+            return SEND
+
+    def count_repeat(self, identity, subject, now):
+        # Caller holds self.lock
+        entry = self.repeats.get(identity)
+        if entry is None:
+            entry = DigestEntry(identity[0], subject, None, now)
+            entry.count = 0
+            self.repeats[identity] = entry
+        entry.count += 1
+        entry.last_time = now
+
+    def pop_digest(self, now=None):
+        """
+        Returns : (held events, suppressed repeats), both lists of DigestEntry,
+                  and starts a new digest. Old dedupe state is dropped too.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            digest = self.digest
+            repeats = sorted(self.repeats.values(), key=lambda entry: entry.first_time)
+            self.digest = []
+            self.repeats = {}
+            for (identity, last_seen) in self.last_seen.items():
+                if now - last_seen >= self.dedupe_seconds:
+                    del self.last_seen[identity]
+            return (digest, repeats)
+
+    def get_digest_size(self):
+        with self.lock:
+            return len(self.digest) + len(self.repeats)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# event_log.py - Structured log of what the main loop spent its time on.
+#
+# The text log says what autocopy did, but not how long it took. Autocopy
+# now also writes JSON events, one per line, to an EventLog: chiefly phase
+# timings from timed(), each with the loop ID, run name, phase and duration
+# in seconds, e.g.
+#
+#   {"event": "phase", "loop": 12, "phase": "lims_lookup", "pid": 4242,
+#    "run": "141117_MONK_0387_AC4JCDACXX", "seconds": 0.8312, "time": ...}
+#
+# write() only puts the event on a queue, so it costs the main loop next to
+# nothing. A writer thread writes the queue out in batches, at most every
+# flush_seconds. If the writer falls behind by max_queued events, new events
+# are dropped and counted rather than held up.
+#
+# The file is rotated when it grows past max_bytes or is older than
+# rotate_seconds: path becomes path.1, path.1 becomes path.2, and so on,
+# keeping the newest backups files.
+#
+###############################################################################
+
+import contextlib
+import json
+import os
+import Queue
+import threading
+import time
+import traceback
+
+class EventLog:
+
+    FILENAME = 'autocopy_events.jsonl'
+    BATCH_SIZE = 1000
+
+    def __init__(self, path=None, max_bytes=100*1024**2, rotate_seconds=86400, backups=14, flush_seconds=5,
+                 max_queued=10000, log_function=None):
+        """
+        Args : path - file to write events to. If None, events are discarded.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.flush_seconds = flush_seconds
+        self.log_function = log_function
+        self.queue = Queue.Queue(max_queued)
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.file = None
+        self.opened_time = None
+        self.thread = None
+        self.stop = object()
+
+    def log(self, text):
+        if self.log_function:
+            self.log_function(text)
+
+    def write(self, event, **fields):
+        """
+        Function : Queues an event for the writer thread. fields must be JSON serializable.
+        """
+        if self.path is None:
+            return
+        record = {'time': time.time(), 'event': event, 'pid': self.pid}
+        record.update(fields)
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    @contextlib.contextmanager
+    def timed(self, phase, **fields):
+        """
+        Function : Context manager that writes a 'phase' event with the seconds spent in
+                   the block, and the exception if the block raised one.
+        """
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            fields['error'] = repr(e)
+            raise
+        finally:
+            self.write('phase', phase=phase, seconds=round(time.time() - start, 6), **fields)
+
+    def start(self):
+        if self.path is None:
+            return
+        self.thread = threading.Thread(target=self.work, name='event-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self, timeout_seconds=10):
+        """
+        Function : Writes out the events queued so far and stops the writer thread.
+        """
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(self.stop, timeout=timeout_seconds)
+        except Queue.Full:
+            return
+        self.thread.join(timeout_seconds)
+        self.thread = None
+
+    def work(self):
+        lines = []
+        last_flush = time.time()
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0.01, last_flush + self.flush_seconds - time.time()))
+            except Queue.Empty:
+                record = None
+            if record is not None and record is not self.stop:
+                try:
+                    lines.append(json.dumps(record, sort_keys=True))
+                except (TypeError, ValueError) as e:
+                    self.log("Dropping event that can't be written as JSON: %s" % e)
+            if record is self.stop or len(lines) >= self.BATCH_SIZE or time.time() - last_flush >= self.flush_seconds:
+                try:
+                    self.write_lines(lines, time.time())
+                except Exception:
+                    # e.g. the disk is full. Lose this batch, but keep the thread alive.
+                    self.log("Event log write failed:\n%s" % traceback.format_exc())
+                    self.close_file()
+                lines = []
+                last_flush = time.time()
+            if record is self.stop:
+                self.close_file()
+                return
+
+    def write_lines(self, lines, now):
+        if not lines:
+            return
+        if self.file is None:
+            self.open_file(now)
+        elif self.should_rotate(now):
+            self.rotate(now)
+        self.file.write(''.join(line + '\n' for line in lines))
+        self.file.flush()
+
+    def open_file(self, now):
+        self.file = open(self.path, 'a')
+        self.opened_time = self.get_first_time()
+        if self.opened_time is None:
+            self.opened_time = now
+
+    def close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except IOError:
+                pass
+            self.file = None
+
+    def get_first_time(self):
+        # The time of the first event in an existing file, so that its age survives a restart.
+        try:
+            with open(self.path) as f:
+                return json.loads(f.readline())['time']
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def should_rotate(self, now):
+        if self.max_bytes and os.fstat(self.file.fileno()).st_size >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and now - self.opened_time >= self.rotate_seconds
+
+    def rotate(self, now):
+        self.close_file()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                backup = '%s.%d' % (self.path, i)
+                if os.path.exists(backup):
+                    os.rename(backup, '%s.%d' % (self.path, i + 1))
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.open_file(now)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# eviction.py - Deletes copied runs from Runs_Completed when a run root is
+#               running out of space.
+#
+# Runs moved to Runs_Completed stay there until someone deletes them. An
+# Evictor thread checks the free space of each run root every
+# check_seconds. When it is below start_free_bytes, it deletes completed
+# runs, in the order set by its policy, until free space is back above
+# stop_free_bytes:
+#
+#   oldest_first  - Run directory last modified earliest.
+#   largest_first - Largest run directory.
+#
+# A run is only deleted if verify_copy() says its copy at the destination
+# is good. That means the copy complete sentinel is there, and either
+#   - autocopy verified the run's checksum manifest at the destination when
+#     it finished the copy (it leaves VERIFIED_FILENAME in the run to say
+#     so) and the manifest is still there, or
+#   - every file of the run is at the destination with the same size.
+# Runs that fail verification are skipped and reported, never deleted.
+# Runs moved to Runs_Completed less than min_age_seconds ago are left alone,
+# so people have time to look at them.
+#
+# Deleting a large run means hundreds of thousands of unlinks on the volume
+# the instruments are writing to, so they are rate-limited to
+# files_per_second. A run is first renamed to .evicting_<run>, so that a
+# deletion cut short by a restart is finished without verifying again.
+#
+###############################################################################
+
+import json
+import os
+import threading
+import time
+import traceback
+
+import disk_usage
+import manifest
+from transfer import quote_dest_arg
+
+ORDER_OLDEST_FIRST = 'oldest_first'
+ORDER_LARGEST_FIRST = 'largest_first'
+ORDERS = [ORDER_OLDEST_FIRST, ORDER_LARGEST_FIRST]
+
+VERIFIED_FILENAME = 'Autocopy_verified.json'
+COPY_COMPLETED_SENTINEL_FILENAME = 'Autocopy_complete.txt'
+EVICTING_PREFIX = '.evicting_'
+
+def write_verified_file(run_path, manifest_filename, files):
+    """
+    Function : Records in a run directory that its manifest was verified at the destination.
+    """
+    with open(os.path.join(run_path, VERIFIED_FILENAME), 'w') as f:
+        json.dump({'manifest': manifest_filename, 'files': files, 'verified_time': time.time()}, f)
+
+def verify_copy(backend, run_path):
+    """
+    Function : Checks that the copy of the run at run_path at the destination is complete.
+    Returns  : (True, how it was verified) or (False, why not).
+    """
+    dest_path = os.path.join(backend.dest_run_root, os.path.basename(run_path))
+    verified_path = os.path.join(run_path, VERIFIED_FILENAME)
+    if os.path.exists(verified_path):
+        with open(verified_path) as f:
+            manifest_filename = json.load(f)['manifest']
+        script = 'test -e %s && test -e %s' % (quote_dest_arg(os.path.join(dest_path, COPY_COMPLETED_SENTINEL_FILENAME)),
+                                              quote_dest_arg(os.path.join(dest_path, manifest_filename)))
+        (retcode, output) = backend.run_dest_script(script)
+        if retcode != 0:
+            return (False, "copy complete sentinel or %s missing at the destination" % manifest_filename)
+        return (True, "checksum manifest verified")
+
+    script = 'cd %s && test -e %s && find . -type f -printf "%%s %%P\\n"' % (quote_dest_arg(dest_path), COPY_COMPLETED_SENTINEL_FILENAME)
+    (retcode, output) = backend.run_dest_script(script)
+    if retcode != 0:
+        return (False, "copy complete sentinel missing at the destination")
+    remote_sizes = {}
+    for line in output.splitlines():
+        parts = line.split(' ', 1)
+        if len(parts) == 2:
+            remote_sizes[parts[1]] = int(parts[0])
+    relpaths = manifest.list_files(run_path, backend.EXCLUDES)
+    for relpath in relpaths:
+        if remote_sizes.get(relpath) != os.path.getsize(os.path.join(run_path, relpath)):
+            return (False, "%s is missing or a different size at the destination" % relpath)
+    return (True, "sizes of %d files match" % len(relpaths))
+
+class EvictionCandidate:
+
+    def __init__(self, run_root, path):
+        self.run_root = run_root
+        self.path = path
+        self.name = os.path.basename(path)
+        stats = os.stat(path)
+        self.mtime = stats.st_mtime
+        self.ctime = stats.st_ctime # Changed when the run was moved into the directory
+        self.bytes = None
+
+class Evictor:
+
+    def __init__(self, completed_dirs, get_free_bytes, verify_function, get_bytes=None, order=ORDER_OLDEST_FIRST,
+                 start_free_bytes=3*1024**4, stop_free_bytes=5*1024**4, min_age_seconds=86400, files_per_second=200,
+                 check_seconds=600, on_evicted=None, on_failed=None, log_function=None):
+        """
+        Args : completed_dirs - dict of run root to its Runs_Completed directory.
+               get_free_bytes - called with a run root.
+               verify_function - called with a run path; returns (ok, reason), as verify_copy.
+               get_bytes - called with a run path, for largest_first.
+               on_evicted, on_failed - called with (candidate, reason) after a run is deleted,
+                                       or not deleted because it failed verification.
+        """
+        if order not in ORDERS:
+            raise ValueError("Unknown eviction order %s. Must be one of %s" % (order, ORDERS))
+        self.completed_dirs = completed_dirs
+        self.get_free_bytes = get_free_bytes
+        self.verify_function = verify_function
+        self.get_bytes = get_bytes
+        self.order = order
+        self.start_free_bytes = start_free_bytes
+        self.stop_free_bytes = stop_free_bytes
+        self.min_age_seconds = min_age_seconds
+        self.files_per_second = files_per_second
+        self.check_seconds = check_seconds
+        self.on_evicted = on_evicted
+        self.on_failed = on_failed
+        self.log_function = log_function
+        self.failed = {}   # run path -> ctime when it failed verification
+        self.evicted = 0
+        self.thread = None
+
+    def log(self, text):
+        if self.log_function:
+            self.log_function(text)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.work, name='evictor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self):
+        while True:
+            for run_root in sorted(self.completed_dirs.keys()):
+                try:
+                    self.check_run_root(run_root)
+                except Exception:
+                    self.log("Eviction in %s failed:\n%s" % (run_root, traceback.format_exc()))
+            time.sleep(self.check_seconds)
+
+    def check_run_root(self, run_root, now=None):
+        """
+        Function : Deletes verified runs from the run root's Runs_Completed directory, if its
+                   free space is below start_free_bytes, until it is above stop_free_bytes.
+        Returns  : The names of the runs deleted.
+        """
+        completed_dir = self.completed_dirs[run_root]
+        if not os.path.isdir(completed_dir):
+            return []
+        # Finish deletions cut short by a restart first; they were verified already.
+        for name in os.listdir(completed_dir):
+            if name.startswith(EVICTING_PREFIX):
+                self.delete_tree(os.path.join(completed_dir, name))
+        if self.get_free_bytes(run_root) >= self.start_free_bytes:
+            return []
+        evicted = []
+        for candidate in self.get_candidates(run_root, now):
+            if self.get_free_bytes(run_root) >= self.stop_free_bytes:
+                break
+            (ok, reason) = self.verify_function(candidate.path)
+            if not ok:
+                self.failed[candidate.path] = candidate.ctime
+                self.log("Not evicting run %s: %s" % (candidate.name, reason))
+                if self.on_failed:
+                    self.on_failed(candidate, reason)
+                continue
+            self.evict(candidate)
+            evicted.append(candidate.name)
+            self.log("Evicted run %s from %s (%s)" % (candidate.name, completed_dir, reason))
+            if self.on_evicted:
+                self.on_evicted(candidate, reason)
+        return evicted
+
+    def get_candidates(self, run_root, now=None):
+        """
+        Returns : EvictionCandidates in run_root's Runs_Completed directory, in eviction order.
+                  Runs that are too new, or that failed verification and haven't been moved
+                  again since, are left out.
+        """
+        if now is None:
+            now = time.time()
+        completed_dir = self.completed_dirs[run_root]
+        candidates = []
+        for name in os.listdir(completed_dir):
+            path = os.path.join(completed_dir, name)
+            if name.startswith('.') or not os.path.isdir(path) or os.path.islink(path):
+                continue
+            candidate = EvictionCandidate(run_root, path)
+            if now - candidate.ctime < self.min_age_seconds:
+                continue
+            if self.failed.get(path) == candidate.ctime:
+                continue
+            candidates.append(candidate)
+        if self.order == ORDER_LARGEST_FIRST:
+            for candidate in candidates:
+                candidate.bytes = self.get_bytes(candidate.path)
+            candidates.sort(key=lambda candidate: (-candidate.bytes, candidate.mtime))
+        else:
+            candidates.sort(key=lambda candidate: candidate.mtime)
+        return candidates
+
+    def evict(self, candidate):
+        evicting_path = os.path.join(os.path.dirname(candidate.path), EVICTING_PREFIX + candidate.name)
+        os.rename(candidate.path, evicting_path)
+        self.delete_tree(evicting_path)
+        engine = disk_usage.get_engine()
+        engine.forget(candidate.path)
+        engine.forget(evicting_path)
+        self.evicted += 1
+
+    def delete_tree(self, path):
+        # Like shutil.rmtree, at most files_per_second unlinks a second.
+        deleted = 0
+        start = time.time()
+        for (dirpath, dirnames, filenames) in os.walk(path, topdown=False):
+            for filename in filenames:
+                os.remove(os.path.join(dirpath, filename))
+                deleted += 1
+                if self.files_per_second:
+                    ahead = deleted / float(self.files_per_second) - (time.time() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            for dirname in dirnames:
+                dir_path = os.path.join(dirpath, dirname)
+                if os.path.islink(dir_path):
+                    os.remove(dir_path)
+                else:
+                    os.rmdir(dir_path)
+        os.rmdir(path)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# finalizer.py - Background worker pool for finishing copied runs.
+#
+# After a run is copied, Autocopy validates it, measures its disk usage,
+# moves it to Runs_Completed, drops the sentinel file at the destination and
+# emails a report. That can take minutes on a large run, so the main loop
+# hands it to a Finalizer and goes on with the other runs. Each run has a
+# state: finalising while queued or running, then finalised or failed.
+# The main loop collects finished runs with pop_finished() on each pass.
+#
+###############################################################################
+
+import Queue
+import threading
+import traceback
+
+class Finalizer:
+
+    FINALISING = 'finalising'
+    FINALISED = 'finalised'
+    FAILED = 'failed'
+
+    def __init__(self, workers=2, log_function=None):
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.states = {}
+        self.errors = {}
+        self.finished = []
+        self.log_function = log_function
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.work, name='finalizer-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, function, *args):
+        """
+        Function : Queues function(*args) to finalise the run identified by key.
+        """
+        with self.lock:
+            self.states[key] = self.FINALISING
+            self.errors.pop(key, None)
+        self.queue.put((key, function, args))
+
+    def work(self):
+        while True:
+            (key, function, args) = self.queue.get()
+            try:
+                function(*args)
+                state = self.FINALISED
+                error = None
+            except Exception:
+                state = self.FAILED
+                error = traceback.format_exc()
+                if self.log_function:
+                    self.log_function("Finalising %s failed:\n%s" % (key, error))
+            with self.lock:
+                self.states[key] = state
+                if error is not None:
+                    self.errors[key] = error
+                self.finished.append(key)
+            self.queue.task_done()
+
+    def get_state(self, key):
+        with self.lock:
+            return self.states.get(key)
+
+    def get_error(self, key):
+        with self.lock:
+            return self.errors.get(key)
+
+    def pop_finished(self):
+        """
+        Returns : A list of (key, state, error) for runs finished since the last call.
+                  error is a traceback for failed runs, else None.
+        """
+        with self.lock:
+            finished = [(key, self.states[key], self.errors.get(key)) for key in self.finished]
+            self.finished = []
+        return finished
+
+    def get_pending_count(self):
+        with self.lock:
+            return len([state for state in self.states.values() if state == self.FINALISING])
+
+    def join(self):
+        # Waits until everything submitted has been processed. For tests and shutdown.
+        self.queue.join()
@@ -6,6 +6,11 @@
 # and it needs to set the archiving_done flag in the LIMS to True.
 
 # Once APF goes away, this can go away too.    
+#
+# To update many runs at once, over one connection, use
+# lims.py --batch FILE modifyRun
+# where each line of FILE (or stdin if FILE is -) is
+# RUN_DIR FIELD VALUE [FIELD VALUE]
 
 import os
 import pwd
@@ -15,25 +20,80 @@ import socket
 import subprocess
 import sys
 
+from lims_batch import read_batch_commands, run_concurrently
 from scgpm_lims import Connection, RunInfo
 
-def lims_run_modify_params(run, update):
-    conn=Connection()
+def lims_run_modify_params(run, update, conn=None):
+    if conn is None:
+        conn=Connection()
     run_id = RunInfo(conn, run).get_solexa_run_id()
     conn.updatesolexarun(run_id, update)
 
+def parse_modify_run_args(args):
+    """
+    Function : Parses "RUNDIR FIELD VALUE [FIELD VALUE]".
+    Returns  : (run, update dictionary).
+    """
+    if len(args) < 3 or len(args) % 2 == 0:
+        raise Exception("Expected a run directory and FIELD VALUE pairs, but I got this: %s" % ' '.join(args))
+    run = args[0]
+
+    # Make a dictionary of the remaining arguments.
+    arg_dict = {}
+    for idx in range(2,len(args),2):
+        key = args[idx-1]
+        value = args[idx]
+        if not key == 'archiving_done':
+            raise Exception("Disabled this script to do anything but 'archiving_done'. Refusing to do '%s'." % args[idx-1])
+        if value.lower() == "true":
+            value = True
+        elif value.lower() == "false":
+            value = False
+        else:
+            raise Exception("Looking for True or False, but I got this: %s" % value)
+        arg_dict[key] = value
+    return (run, arg_dict)
+
+def lims_batch_modify_params(commands, workers=8):
+    """
+    Function : Applies modifyRun commands for many runs over one connection. The updates
+               for each run are merged into one, and runs are resolved and updated concurrently.
+    Args     : commands - a list of (line number, words) from lims_batch.read_batch_commands.
+    Returns  : A list of (run, error) for the runs that failed.
+    """
+    updates = {}
+    runs = []
+    for (number, words) in commands:
+        try:
+            (run, update) = parse_modify_run_args(words)
+        except Exception, e:
+            raise Exception("Line %s: %s" % (number, e))
+        if run not in updates:
+            runs.append(run)
+            updates[run] = {}
+        updates[run].update(update)
+
+    conn = Connection()
+    results = run_concurrently(lambda run: lims_run_modify_params(run, updates[run], conn=conn), runs, workers=workers)
+    return [(run, error) for (run, result, error) in results if error is not None]
+
 if __name__ == "__main__":
     from optparse import OptionParser
     import os.path
     import sys
 
-    usage = "%prog [options] command run_dir [command-specific args]"
+    usage = "%prog [options] command run_dir [command-specific args]\n       %prog --batch FILE command"
     parser = OptionParser(usage=usage)
+    parser.add_option("-b", "--batch", dest="batch", default=None,
+                      help="Read one 'run_dir [command-specific args]' per line from this file, or - for stdin, "
+                      "and apply them all over one LIMS connection.")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=8,
+                      help="With --batch, the number of runs to update at once [default = %default]")
 
     (opts, args) = parser.parse_args()
 
     if not len(args):
-        print >> sys.stderr, os.path.basename(__file__), ": No run directories given"
+        print >> sys.stderr, os.path.basename(__file__), ": No command given"
         sys.exit(1)
 
     # Argument 1 is command:
@@ -43,23 +103,18 @@ if __name__ == "__main__":
     args = args[1:]
 
     if command == "modifyRun":
-        run = args[0]
-
-        # Make a dictionary of the remaining arguments.
-        arg_dict = {}
-        for idx in range(2,len(args),2):
-            key = args[idx-1]
-            value = args[idx]
-            if not key == 'archiving_done':
-                raise Exception("Disabled this script to do anything but 'archiving_done'. Refusing to do '%s'." % args[idx-1])
-            if value.lower() == "true":
-                value = True
-            elif value.lower() == "false":
-                value = False
-            else:
-                raise Exception("Looking for True or False, but I got this: %s" % value)
-            
-            lims_run_modify_params(run, {key: value})
+        if opts.batch:
+            failures = lims_batch_modify_params(read_batch_commands(opts.batch), workers=opts.workers)
+            for (run, error) in failures:
+                print >> sys.stderr, "%s: %s" % (run, error)
+            if failures:
+                sys.exit(1)
+        else:
+            if not len(args):
+                print >> sys.stderr, os.path.basename(__file__), ": No run directories given"
+                sys.exit(1)
+            (run, arg_dict) = parse_modify_run_args(args)
+            lims_run_modify_params(run, arg_dict)
 
     else:
         raise Exception("unknown command")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# lims_batch.py - Look up many runs in the LIMS with one request.
+#
+# scgpm_lims looks runs up one at a time, so a pass over N runs costs N
+# requests. A LimsBatchClient asks a batch endpoint for the RunInfo records
+# of many runs at once, in pages of batch_size runs. The records are handed
+# to scgpm_lims through a PrefetchedConnection, so that RunInfo objects are
+# built from them without a request of their own, and still write to the
+# LIMS through the real connection.
+#
+# The batch endpoint (LIMS_BATCH_URL) takes a POST of
+#     {"runs": ["<run name>", ...]}
+# with the LIMS token as the 'token' parameter, and answers
+#     {"runs": {"<run name>": <record as returned for a single run>, ...}}
+# leaving out runs that it doesn't know. Where the LIMS itself has no such
+# endpoint, a small service beside it can provide one.
+#
+# read_batch_commands() and run_concurrently() serve the --batch options of
+# lims.py, startrun.py and endrun.py, which update many runs in one process
+# over one connection, rather than one process and connection per run.
+#
+###############################################################################
+
+import json
+import sys
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+class LimsBatchClient:
+
+    def __init__(self, batch_url, token=None, batch_size=100, timeout=60):
+        self.batch_url = batch_url
+        self.token = token
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.requests = 0
+
+    def get_runinfo_records(self, run_names):
+        """
+        Returns : A dict of run name to RunInfo record, for those of run_names the LIMS knows.
+                  Raises requests.exceptions.RequestException or ValueError if a page fails.
+        """
+        records = {}
+        for start in range(0, len(run_names), self.batch_size):
+            records.update(self.fetch_page(run_names[start:start + self.batch_size]))
+        return records
+
+    def fetch_page(self, run_names):
+        self.requests += 1
+        params = {}
+        if self.token:
+            params['token'] = self.token
+        response = requests.post(self.batch_url, params=params, data=json.dumps({'runs': run_names}),
+                                 headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+        response.raise_for_status()
+        records = response.json().get('runs')
+        if not isinstance(records, dict):
+            raise ValueError("Bad response from LIMS batch endpoint %s: no 'runs' object" % self.batch_url)
+        return records
+
+class PrefetchedConnection:
+    """
+    Stands in for a scgpm_lims Connection. Run info lookups are answered from
+    prefetched records where possible; everything else goes to the real connection.
+    """
+
+    def __init__(self, conn, records):
+        self.conn = conn
+        self.records = records
+
+    def getruninfo(self, run, *args, **kwargs):
+        if run in self.records:
+            return self.records[run]
+        return self.conn.getruninfo(run, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+def read_batch_commands(path):
+    """
+    Function : Reads batch commands for lims.py, startrun.py or endrun.py --batch,
+               one per line, from a file or from stdin if path is '-'.
+               Blank lines and lines starting with '#' are skipped.
+    Returns  : A list of (line number, list of words).
+    """
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(path) as f:
+            lines = f.readlines()
+    commands = []
+    for (number, line) in enumerate(lines, 1):
+        words = line.split()
+        if words and not words[0].startswith('#'):
+            commands.append((number, words))
+    return commands
+
+def run_concurrently(function, items, workers=8):
+    """
+    Function : Calls function(item) for each item on a pool of worker threads, e.g. to
+               resolve runs and update them in the LIMS over one shared connection.
+    Returns  : A list of (item, result, error) in the order of items. error is the
+               exception's message if the call raised, otherwise None.
+    """
+    def call(item):
+        try:
+            return (item, function(item), None)
+        except Exception as e:
+            return (item, None, '%s: %s' % (e.__class__.__name__, e))
+    if not items:
+        return []
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# lims_cache.py - Short-lived cache of LIMS lookups, one entry per run.
+#
+# Autocopy looks up every monitored run in the LIMS on every pass, and the
+# answers rarely change between passes. A LimsCache keeps each answer for
+# ttl_seconds. After that the entry is stale: get() still returns it at
+# once, and refreshes it from the LIMS on a background thread, so a slow
+# LIMS doesn't hold up the main loop (stale-while-revalidate). Past
+# max_stale_seconds, or with refresh=True, get() fetches synchronously.
+# Autocopy forces a refresh before acting on LIMS data, e.g. before a copy
+# is started, so that state transitions never use stale data.
+#
+# Errors from a synchronous fetch are raised to the caller, which may fall
+# back to peek(). Errors from a background refresh are logged, and the
+# stale entry is kept.
+#
+# Runs the LIMS doesn't know are kept apart, in a NegativeCache, which backs
+# off from looking them up again.
+#
+###############################################################################
+
+import threading
+import time
+import traceback
+
+class LimsCacheEntry:
+
+    def __init__(self, value, fetched_time):
+        self.value = value
+        self.fetched_time = fetched_time
+
+    def get_age(self, now=None):
+        if now is None:
+            now = time.time()
+        return now - self.fetched_time
+
+class LimsCache:
+
+    def __init__(self, fetch_function, ttl_seconds=900, max_stale_seconds=3600, log_function=None):
+        """
+        Args : fetch_function - called as fetch_function(key) to look a key up in the LIMS.
+        """
+        self.fetch_function = fetch_function
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.log_function = log_function
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, refresh=False, now=None):
+        """
+        Function : Returns the LIMS data for key, from the cache if it is fresh enough.
+        Args     : refresh - always fetch from the LIMS.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or refresh:
+            self.misses += 1
+            return self.fetch(key)
+        age = entry.get_age(now)
+        if age <= self.ttl_seconds:
+            self.hits += 1
+            return entry.value
+        if age <= self.max_stale_seconds:
+            self.stale_hits += 1
+            self.start_refresh(key)
+            return entry.value
+        self.misses += 1
+        return self.fetch(key)
+
+    def get_expired(self, keys, now=None):
+        """
+        Returns : Those of keys that aren't cached, or whose entries are past ttl_seconds.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return [key for key in keys
+                    if key not in self.entries or self.entries[key].get_age(now) > self.ttl_seconds]
+
+    def peek(self, key):
+        """
+        Returns : The cached value for key however old it is, or None. Never calls the LIMS.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry.value
+
+    def fetch(self, key):
+        value = self.fetch_function(key)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.entries[key] = LimsCacheEntry(value, now)
+
+    def start_refresh(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        thread = threading.Thread(target=self.refresh, args=(key,), name='lims-refresh-%s' % key)
+        thread.daemon = True
+        thread.start()
+
+    def refresh(self, key):
+        try:
+            self.fetch(key)
+        except Exception:
+            if self.log_function:
+                self.log_function("Refreshing LIMS data for %s failed, using cached data:\n%s" % (key, traceback.format_exc()))
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def forget(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def retain(self, keys):
+        # Drops the entries of runs no longer monitored.
+        keys = set(keys)
+        with self.lock:
+            for key in self.entries.keys():
+                if key not in keys:
+                    del self.entries[key]
+
+    def get_refreshing_count(self):
+        with self.lock:
+            return len(self.refreshing)
+
+class NegativeCache:
+    """
+    Remembers runs that the LIMS didn't know (404), so they aren't looked up on
+    every pass until the techs enter them. After the n-th miss in a row a run is
+    skipped for retry_seconds * 2**(n-1), up to max_retry_seconds. Each miss is
+    recorded with a signature of the run directory (e.g. the mtimes of its
+    descriptor files); if that changes, the run is looked up again at once.
+    """
+
+    def __init__(self, retry_seconds=300, max_retry_seconds=3600):
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.skips = 0
+
+    def record_miss(self, key, signature, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            (misses, old_signature, retry_time) = self.entries.get(key, (0, None, 0))
+            if old_signature != signature:
+                misses = 0
+            misses += 1
+            delay = min(self.max_retry_seconds, self.retry_seconds * 2 ** (misses - 1))
+            self.entries[key] = (misses, signature, now + delay)
+            return delay
+
+    def should_skip(self, key, signature, now=None):
+        """
+        Returns : True if key missed recently and its signature hasn't changed since.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            (misses, old_signature, retry_time) = entry
+            if old_signature != signature:
+                del self.entries[key]
+                return False
+            if now < retry_time:
+                self.skips += 1
+                return True
+            return False
+
+    def get_misses(self, key):
+        with self.lock:
+            return self.entries.get(key, (0, None, 0))[0]
+
+    def forget(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def retain(self, keys):
+        keys = set(keys)
+        with self.lock:
+            for key in self.entries.keys():
+                if key not in keys:
+                    del self.entries[key]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
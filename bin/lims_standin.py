@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# lims_standin.py - A local stand-in for the UHTS LIMS, with injected latency
+#                   and errors, for load testing autocopy.
+#
+# The scgpm_lims --local_only flatfiles answer instantly and never fail. To
+# see how the daemon loop and copy latency hold up when the LIMS is slow or
+# failing, point autocopy at this server instead:
+#     "UHTS_LIMS_URL": "http://localhost:8642",
+#     "LIMS_BATCH_URL": "http://localhost:8642/api/v1/run_info_batch"
+#
+# It serves the part of the UHTS API that autocopy uses, under /api/v1:
+#     GET        run_info?run=<run name>       RunInfo lookup
+#     POST       run_info_batch                 batch lookup (see lims_batch.py)
+#     GET, PATCH solexa_runs/<id>               e.g. updatesolexarun() and the
+#     GET, PATCH solexa_flow_cells/<id>         flags set by set_flags_for_*()
+#     GET, PATCH pipeline_runs/<id>             (startrun.py, endrun.py)
+# PUT is taken as PATCH. Updates are merged into the records and kept in a
+# list, so a test can check which flags were set. Two more endpoints, which
+# never have faults injected, control the stand-in itself:
+#     POST standin/sequencing_failed?run=<run name>   mark a run as failed
+#     GET  standin/stats                              request and update counts
+#
+# Runs come from a JSON file of RunInfo records keyed by run name (e.g.
+# saved from the real LIMS), from the run directories in --runRoot, or, with
+# --anyRun, are made up for any run name asked for. Made-up records only
+# carry the fields autocopy checks; see make_runinfo_record().
+#
+# Each endpoint can be given faults with --fault, e.g.
+#     --fault run_info:latency=2,jitter=1,errors=0.1,notfound=0.05
+# which delays every run_info request by 2-3 seconds, answers 10% of them
+# with a 500, and 5% with a 404. notfound_burst=N makes each 404 the first
+# of N in a row, as when a whole set of runs is missing from the LIMS.
+#
+###############################################################################
+
+import BaseHTTPServer
+import json
+import os
+import random
+import re
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+
+ENDPOINTS = ['run_info', 'run_info_batch', 'solexa_runs', 'solexa_flow_cells', 'pipeline_runs']
+
+SEQUENCING_FAILED = 'sequencing_failed'
+RUNDIR_REG = re.compile(r'^\d{6}_')
+
+class EndpointFaults:
+
+    FIELDS = {'latency': float, 'jitter': float, 'errors': float, 'notfound': float, 'notfound_burst': int}
+
+    def __init__(self, latency=0.0, jitter=0.0, errors=0.0, notfound=0.0, notfound_burst=1):
+        """
+        Args : latency, jitter - each request is delayed latency + random(0, jitter) seconds.
+               errors, notfound - fraction of requests answered with a 500, or a 404.
+               notfound_burst - each injected 404 starts a run of this many.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+        self.notfound = notfound
+        self.notfound_burst = notfound_burst
+        self.notfound_left = 0
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Function : Parses "endpoint:key=value,..." as given to --fault.
+        Returns  : (endpoint, EndpointFaults). Raises ValueError if spec is bad.
+        """
+        (endpoint, sep, settings) = spec.partition(':')
+        if endpoint not in ENDPOINTS:
+            raise ValueError("Unknown endpoint %s in fault %s. Must be one of %s" % (endpoint, spec, ENDPOINTS))
+        kwargs = {}
+        for setting in filter(None, settings.split(',')):
+            (key, sep, value) = setting.partition('=')
+            if key not in cls.FIELDS:
+                raise ValueError("Unknown setting %s in fault %s. Must be one of %s" % (key, spec, sorted(cls.FIELDS.keys())))
+            kwargs[key] = cls.FIELDS[key](value)
+        return (endpoint, cls(**kwargs))
+
+    def get_delay(self, rand):
+        return self.latency + rand.uniform(0, self.jitter)
+
+    def get_status(self, rand):
+        """
+        Returns : 500 or 404 to inject an error, otherwise None.
+        """
+        if self.notfound_left > 0:
+            self.notfound_left -= 1
+            return 404
+        draw = rand.random()
+        if draw < self.errors:
+            return 500
+        if draw < self.errors + self.notfound:
+            self.notfound_left = self.notfound_burst - 1
+            return 404
+        return None
+
+def make_runinfo_record(run_name, solexa_run_id, flow_cell_id, machine='unknown', software='unknown',
+                        paired_end=True, read1_cycles=101, read2_cycles=101):
+    # Only the fields that autocopy reads; a record saved from the LIMS has many more.
+    return {
+        'run_name': run_name,
+        'solexa_run_id': solexa_run_id,
+        'flow_cell_id': flow_cell_id,
+        'sequencing_instrument': machine,
+        'sequencer_software': software,
+        'paired_end': paired_end,
+        'read1_cycles': read1_cycles,
+        'read2_cycles': read2_cycles,
+        'sequencing_run_status': 'sequencing_in_progress',
+        'sequencer_done': False,
+        'analysis_done': False,
+        'archiving_done': False,
+    }
+
+class LimsStandin:
+
+    def __init__(self, records=None, faults=None, any_run=False, seed=None):
+        """
+        Args : records - dict of run name to RunInfo record.
+               faults - dict of endpoint to EndpointFaults.
+               any_run - make up a record for any run name that looks like a run directory.
+        """
+        self.lock = threading.RLock()
+        self.runs = {}
+        self.solexa_runs = {}
+        self.flow_cells = {}
+        self.pipeline_runs = {}
+        self.updates = []
+        self.requests = dict((endpoint, 0) for endpoint in ENDPOINTS)
+        self.injected = dict((endpoint, 0) for endpoint in ENDPOINTS)
+        self.faults = faults or {}
+        self.any_run = any_run
+        self.random = random.Random(seed)
+        for (run_name, record) in (records or {}).items():
+            self.add_record(run_name, record)
+
+    def add_record(self, run_name, record):
+        with self.lock:
+            self.runs[run_name] = record
+            if record.get('solexa_run_id') is not None:
+                self.solexa_runs[int(record['solexa_run_id'])] = record
+            if record.get('flow_cell_id') is not None:
+                self.flow_cells.setdefault(int(record['flow_cell_id']), {'id': record['flow_cell_id']})
+
+    def add_run(self, run_name, **kwargs):
+        with self.lock:
+            solexa_run_id = max(self.solexa_runs.keys() + [0]) + 1
+            flow_cell_id = max(self.flow_cells.keys() + [0]) + 1
+            record = make_runinfo_record(run_name, solexa_run_id, flow_cell_id, **kwargs)
+            self.add_record(run_name, record)
+            return record
+
+    def add_rundir(self, rundir):
+        # rundir is a rundir.RunDir; the record matches it, so check_rundir_against_lims finds no problems.
+        rundir.get_platform()
+        software = rundir.get_control_software_version_string().replace(' ','_').replace('.','_').lower()
+        return self.add_run(rundir.get_dir(), machine=rundir.get_machine(), software=software,
+                            paired_end=rundir.is_paired_end(), read1_cycles=rundir.get_read1_cycles(),
+                            read2_cycles=rundir.get_read2_cycles())
+
+    def get_runinfo(self, run_name):
+        with self.lock:
+            record = self.runs.get(run_name)
+            if record is None and self.any_run and RUNDIR_REG.match(run_name):
+                record = self.add_run(run_name)
+            return record
+
+    def set_sequencing_failed(self, run_name):
+        record = self.get_runinfo(run_name)
+        if record is None:
+            return False
+        with self.lock:
+            record['sequencing_run_status'] = SEQUENCING_FAILED
+        return True
+
+    def get_table(self, endpoint):
+        return {'solexa_runs': self.solexa_runs, 'solexa_flow_cells': self.flow_cells,
+                'pipeline_runs': self.pipeline_runs}[endpoint]
+
+    def get_object(self, endpoint, object_id):
+        with self.lock:
+            return self.get_table(endpoint).get(object_id)
+
+    def update_object(self, endpoint, object_id, params):
+        """
+        Returns : The updated object, or None if there is none with this id.
+                  Pipeline runs are created on their first update.
+        """
+        with self.lock:
+            table = self.get_table(endpoint)
+            if object_id not in table:
+                if endpoint != 'pipeline_runs':
+                    return None
+                table[object_id] = {'id': object_id}
+            table[object_id].update(params)
+            self.updates.append((endpoint, object_id, params))
+            return table[object_id]
+
+    def get_updates(self, endpoint=None):
+        with self.lock:
+            return [update for update in self.updates if endpoint is None or update[0] == endpoint]
+
+    def inject(self, endpoint):
+        """
+        Function : Counts a request, sleeps for its latency, and picks an injected error.
+        Returns  : An HTTP status code to answer with instead, or None.
+        """
+        faults = self.faults.get(endpoint)
+        with self.lock:
+            self.requests[endpoint] += 1
+            if faults is None:
+                return None
+            delay = faults.get_delay(self.random)
+            status = faults.get_status(self.random)
+            if status is not None:
+                self.injected[endpoint] += 1
+        if delay > 0:
+            time.sleep(delay)
+        return status
+
+    def get_stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'injected_errors': dict(self.injected),
+                    'updates': len(self.updates), 'runs': len(self.runs)}
+
+class StandinRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    API_PREFIX = '/api/v1/'
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_PUT(self):
+        self.handle_request('PATCH')
+
+    def handle_request(self, method):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if not url.path.startswith(self.API_PREFIX):
+            return self.send_json(404, {'error': 'Not found: %s' % url.path})
+        parts = url.path[len(self.API_PREFIX):].strip('/').split('/')
+        standin = self.server.standin
+        if parts[0] == 'standin':
+            return self.handle_standin(method, parts[1:], query)
+        if parts[0] not in ENDPOINTS:
+            return self.send_json(404, {'error': 'Not found: %s' % url.path})
+        endpoint = parts[0]
+        status = standin.inject(endpoint)
+        if status is not None:
+            return self.send_json(status, {'error': 'Injected error'})
+        try:
+            body = self.read_json()
+        except ValueError as e:
+            return self.send_json(400, {'error': 'Bad JSON: %s' % e})
+        if endpoint == 'run_info' and method == 'GET':
+            record = standin.get_runinfo(query.get('run', ''))
+            if record is None:
+                return self.send_json(404, {'error': 'Run not found: %s' % query.get('run')})
+            return self.send_json(200, record)
+        if endpoint == 'run_info_batch' and method == 'POST':
+            if not isinstance(body, dict) or not isinstance(body.get('runs'), list):
+                return self.send_json(400, {'error': "Expected {\"runs\": [...]}"})
+            records = {}
+            for run_name in body['runs']:
+                record = standin.get_runinfo(run_name)
+                if record is not None:
+                    records[run_name] = record
+            return self.send_json(200, {'runs': records})
+        if endpoint in ('solexa_runs', 'solexa_flow_cells', 'pipeline_runs') and len(parts) == 2 and parts[1].isdigit():
+            object_id = int(parts[1])
+            if method == 'GET':
+                obj = standin.get_object(endpoint, object_id)
+            elif method == 'PATCH':
+                if not isinstance(body, dict):
+                    return self.send_json(400, {'error': 'Expected a JSON object'})
+                obj = standin.update_object(endpoint, object_id, body)
+            else:
+                return self.send_json(405, {'error': 'Method not allowed'})
+            if obj is None:
+                return self.send_json(404, {'error': 'Not found: %s %s' % (endpoint, object_id)})
+            return self.send_json(200, obj)
+        return self.send_json(405, {'error': 'Method not allowed'})
+
+    def handle_standin(self, method, parts, query):
+        standin = self.server.standin
+        if parts == ['sequencing_failed'] and method == 'POST':
+            if not standin.set_sequencing_failed(query.get('run', '')):
+                return self.send_json(404, {'error': 'Run not found: %s' % query.get('run')})
+            return self.send_json(200, standin.get_runinfo(query['run']))
+        if parts == ['stats'] and method == 'GET':
+            return self.send_json(200, standin.get_stats())
+        return self.send_json(404, {'error': 'Not found: %s' % self.path})
+
+    def read_json(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class StandinHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, standin, host='localhost', port=8642, quiet=False):
+        """
+        Args : port - 0 to pick a free port; see get_url().
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), StandinRequestHandler)
+        self.standin = standin
+        self.quiet = quiet
+
+    def get_url(self):
+        (host, port) = self.server_address[0:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        # Serves on a background thread, until shutdown().
+        thread = threading.Thread(target=self.serve_forever, name='lims-standin')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    from rundir import RunDir
+
+    usage = "%prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-p", "--port", dest="port", type="int", default=8642,
+                      help="Port to listen on [default = %default]")
+    parser.add_option("--host", dest="host", default='localhost',
+                      help="Address to listen on [default = %default]")
+    parser.add_option("-r", "--records", dest="records", default=None,
+                      help="JSON file of RunInfo records keyed by run name")
+    parser.add_option("--runRoot", dest="run_roots", action="append", default=[],
+                      help="Add a record for each run directory in this run root. May be repeated.")
+    parser.add_option("--anyRun", dest="any_run", action="store_true", default=False,
+                      help="Make up a record for any run name asked for")
+    parser.add_option("--failed", dest="failed", action="append", default=[],
+                      help="Mark this run as sequencing failed. May be repeated.")
+    parser.add_option("-f", "--fault", dest="faults", action="append", default=[],
+                      help="Faults for one endpoint, e.g. run_info:latency=2,jitter=1,errors=0.1,notfound=0.05,notfound_burst=5. "
+                      "Endpoints: %s. May be repeated." % ', '.join(ENDPOINTS))
+    parser.add_option("--seed", dest="seed", type="int", default=None,
+                      help="Random seed, to inject the same faults on every run")
+    parser.add_option("-q", "--quiet", dest="quiet", action="store_true", default=False,
+                      help="Don't log each request")
+
+    (opts, args) = parser.parse_args()
+
+    faults = {}
+    try:
+        for spec in opts.faults:
+            (endpoint, endpoint_faults) = EndpointFaults.parse(spec)
+            faults[endpoint] = endpoint_faults
+    except ValueError, e:
+        print >> sys.stderr, os.path.basename(__file__), ":", e
+        sys.exit(1)
+
+    records = None
+    if opts.records:
+        with open(opts.records) as f:
+            records = json.load(f)
+
+    standin = LimsStandin(records=records, faults=faults, any_run=opts.any_run, seed=opts.seed)
+    for run_root in opts.run_roots:
+        for dirname in sorted(os.listdir(run_root)):
+            if RUNDIR_REG.match(dirname) and os.path.isdir(os.path.join(run_root, dirname)):
+                try:
+                    standin.add_rundir(RunDir(run_root, dirname))
+                except Exception, e:
+                    print >> sys.stderr, "Skipping %s: %s" % (dirname, e)
+    for run_name in opts.failed:
+        if not standin.set_sequencing_failed(run_name):
+            print >> sys.stderr, "Run %s not found, can't mark it as failed" % run_name
+
+    server = StandinHTTPServer(standin, host=opts.host, port=opts.port, quiet=opts.quiet)
+    print "LIMS stand-in serving %s runs at %s%s" % (standin.get_stats()['runs'], server.get_url(), StandinRequestHandler.API_PREFIX)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# lims_write_queue.py - Durable write-behind queue for LIMS status updates.
+#
+# Autocopy used to set LIMS flags (sequencing finished, sequencing failed)
+# inline, so a slow LIMS held up the main loop and a failed write was lost.
+# Now the main loop put()s the update on a LimsWriteQueue and goes on, and a
+# background worker applies it.
+#
+# An update is a run name and the name of a scgpm_lims RunInfo method that
+# sets flags (see OPERATIONS); these set flags to fixed values, so applying
+# one twice does no harm. The queue is saved to a JSON file on every change,
+# rewritten atomically as in copy_journal.py, so updates survive a restart.
+#
+# Updates for a run are applied in the order they were queued. Queuing an
+# update that is already pending does nothing, and queuing one drops any
+# pending updates it supersedes, so each run has at most a couple of writes
+# waiting. If an update fails, it is retried after retry_seconds, doubling
+# up to max_retry_seconds, and the run's later updates wait behind it.
+# Other runs' updates go ahead.
+#
+###############################################################################
+
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+
+SEQUENCING_FINISHED = 'set_flags_for_sequencing_finished_analysis_started'
+SEQUENCING_FAILED = 'set_flags_for_sequencing_failed'
+OPERATIONS = [SEQUENCING_FINISHED, SEQUENCING_FAILED]
+
+# A failed run is never going to be analysed.
+SUPERSEDES = {SEQUENCING_FAILED: [SEQUENCING_FINISHED]}
+
+class LimsWriteQueue:
+
+    FILENAME = 'lims_write_queue.json'
+
+    def __init__(self, path, apply_function, retry_seconds=60, max_retry_seconds=3600, log_function=None):
+        """
+        Args : apply_function - called as apply_function(run_name, operation) by the worker
+                                to write an update to the LIMS. Raises if the write failed.
+        """
+        self.path = path
+        self.apply_function = apply_function
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.log_function = log_function
+        # Reentrant, as the SIGUSR1 summary calls in from a signal handler on the
+        # main thread, which may already hold it in put().
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.entries = []
+        self.next_id = 1
+        self.applied = 0
+        self.failures = 0
+        self.thread = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except ValueError:
+            if self.log_function:
+                self.log_function("Ignoring unreadable LIMS write queue %s" % self.path)
+            return
+        for entry in entries:
+            # Retry at once after a restart; the LIMS may well be back.
+            entry['next_attempt_time'] = 0
+            entry['id'] = self.next_id
+            self.next_id += 1
+        self.entries = entries
+
+    def save(self):
+        # Caller holds self.lock
+        directory = os.path.dirname(self.path)
+        (fd, tmp_path) = tempfile.mkstemp(prefix=self.FILENAME + '.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put(self, run_name, operation, now=None):
+        """
+        Function : Queues a LIMS update for run_name, to be applied by the worker.
+        """
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown LIMS update %s. Must be one of %s" % (operation, OPERATIONS))
+        if now is None:
+            now = time.time()
+        with self.lock:
+            superseded = SUPERSEDES.get(operation, [])
+            pending = [entry for entry in self.entries if entry['run'] == run_name]
+            if any(entry['operation'] == operation for entry in pending):
+                return
+            self.entries = [entry for entry in self.entries
+                            if not (entry['run'] == run_name and entry['operation'] in superseded)]
+            self.entries.append({
+                'id': self.next_id,
+                'run': run_name,
+                'operation': operation,
+                'queued_time': now,
+                'attempts': 0,
+                'next_attempt_time': 0,
+                'last_error': None,
+            })
+            self.next_id += 1
+            self.save()
+            self.wakeup.notify()
+
+    def get_heads(self):
+        # Caller holds self.lock. The first pending update of each run, oldest first.
+        seen = set()
+        heads = []
+        for entry in self.entries:
+            if entry['run'] not in seen:
+                seen.add(entry['run'])
+                heads.append(entry)
+        return heads
+
+    def get_due(self, now):
+        """
+        Returns : Copies of the first pending update of each run, if it is due, oldest first.
+        """
+        with self.lock:
+            return [dict(entry) for entry in self.get_heads() if entry['next_attempt_time'] <= now]
+
+    def drain_once(self, now=None):
+        """
+        Function : Applies every update that is due.
+        Returns  : The number applied.
+        """
+        if now is None:
+            now = time.time()
+        applied = 0
+        for entry in self.get_due(now):
+            try:
+                self.apply_function(entry['run'], entry['operation'])
+            except Exception as e:
+                self.record_failure(entry, e, now)
+            else:
+                self.record_success(entry)
+                applied += 1
+        return applied
+
+    def record_success(self, entry):
+        with self.lock:
+            self.applied += 1
+            # Gone already if a newer update superseded it while it was being applied.
+            self.entries = [e for e in self.entries if e['id'] != entry['id']]
+            self.save()
+
+    def record_failure(self, entry, error, now):
+        with self.lock:
+            self.failures += 1
+            for e in self.entries:
+                if e['id'] == entry['id']:
+                    e['attempts'] += 1
+                    delay = min(self.max_retry_seconds, self.retry_seconds * 2 ** (e['attempts'] - 1))
+                    e['next_attempt_time'] = now + delay
+                    e['last_error'] = str(error)
+                    self.save()
+                    break
+            else:
+                delay = None
+        if self.log_function:
+            self.log_function("LIMS update %s for %s failed, retrying in %s seconds: %s"
+                              % (entry['operation'], entry['run'], delay, error))
+
+    def get_depth(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get_oldest_age(self, now=None):
+        """
+        Returns : Seconds since the oldest pending update was queued, or None if there is none.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.entries:
+                return None
+            return now - min(entry['queued_time'] for entry in self.entries)
+
+    def get_pending(self, run_name=None):
+        with self.lock:
+            return [entry['operation'] for entry in self.entries if run_name is None or entry['run'] == run_name]
+
+    def get_next_wait(self, now):
+        # Caller holds self.lock
+        if not self.entries:
+            return None
+        return max(0, min(entry['next_attempt_time'] for entry in self.get_heads()) - now)
+
+    def start(self, poll_seconds=60):
+        """
+        Function : Starts the worker thread. It wakes when an update is queued or one is due
+                   for a retry, and at least every poll_seconds.
+        """
+        self.thread = threading.Thread(target=self.work, args=(poll_seconds,), name='lims-write-queue')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self, poll_seconds):
+        while True:
+            try:
+                self.drain_once()
+            except Exception:
+                if self.log_function:
+                    self.log_function("LIMS write queue worker error:\n%s" % traceback.format_exc())
+            with self.lock:
+                wait = self.get_next_wait(time.time())
+                if wait is None or wait > 0:
+                    self.wakeup.wait(min(wait, poll_seconds) if wait is not None else poll_seconds)
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# make_synthetic_rundir.py - Build a synthetic Illumina run directory.
+#
+# Writes a GA, HiSeq or MiSeq run directory with the metadata files RunDir
+# reads (runParameters.xml, RunInfo.xml, Status.xml, RunLog_*, status files)
+# and the data tree of a real run: per-lane, per-cycle, per-tile .bcl and
+# .stats files, .filter and position (.clocs/.locs/_pos.txt) files, InterOp,
+# and optionally .cif intensities and thumbnails. The lanes and tiles are
+# taken from RunDir.get_lane_list() and get_tile_list() on the metadata just
+# written, so the tree is the one validate() and make_archive_tar expect.
+#
+# File sizes follow from the number of clusters per tile, e.g. a .bcl file
+# is 4 + clusters bytes. Files are filled in one of three ways:
+#   sparse  - truncated to size; takes no space, reads as zeros.
+#   zero    - written with zeros.
+#   random  - written with random bytes, different in each file. Use this
+#             when the filesystem or network compresses.
+# Write the run to a tmpfs (e.g. /dev/shm) to take the source disk out of
+# a benchmark.
+#
+# ARGS:
+#   1: Run root to create the run directory in.
+#
+# SWITCHES: See --help.
+#
+###############################################################################
+
+import os
+import sys
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from rundir import RunDir
+
+PLATFORMS = ['ga', 'hiseq', 'miseq']
+FILLS = ['sparse', 'zero', 'random']
+
+# Defaults per platform: run name, control software version, reads, clusters per tile.
+DEFAULT_LAYOUTS = {
+    'ga': {
+        'run_name': '100528_HWI-EAS1_0042_FC61ABCAAXX',
+        'software_version': '2.6.26',
+        'reads': [(76, False), (76, False)],
+        'clusters_per_tile': 250000,
+    },
+    'hiseq': {
+        'run_name': '141117_MONK_0387_AC4JCDACXX',
+        'software_version': '1.5.15.1',
+        'reads': [(101, False), (8, True), (101, False)],
+        'clusters_per_tile': 3000000,
+    },
+    'miseq': {
+        'run_name': '150105_M00123_0042_000000000-A1B2C',
+        'software_version': '2.4.1.3',
+        'reads': [(151, False), (8, True), (151, False)],
+        'clusters_per_tile': 1200000,
+    },
+}
+
+# InterOp files, with bytes per (lane, tile, cycle) record. TileMetricsOut is per tile.
+INTEROP_RECORD_BYTES = {
+    'CorrectedIntMetricsOut.bin': 48,
+    'ErrorMetricsOut.bin': 30,
+    'ExtractionMetricsOut.bin': 38,
+    'ImageMetricsOut.bin': 60,
+    'QMetricsOut.bin': 206,
+}
+TILE_METRICS_BYTES_PER_TILE = 120
+
+THUMBNAIL_BYTES = 50000
+STATS_BYTES = 108
+
+FILL_BLOCK_SIZE = 1024 * 1024
+
+def parse_reads(text):
+    """
+    Function : Parses a read layout like "101,8i,101"; an 'i' marks an index read.
+    Returns  : A list of (cycles, is_index) tuples.
+    """
+    reads = []
+    for read in text.split(','):
+        read = read.strip()
+        is_index = read.endswith('i')
+        try:
+            cycles = int(read.rstrip('i'))
+        except ValueError:
+            raise ValueError("Bad read %s in %s; expected e.g. 101,8i,101" % (read, text))
+        reads.append((cycles, is_index))
+    return reads
+
+class SyntheticRun:
+
+    def __init__(self, run_root, platform='hiseq', run_name=None, reads=None, clusters_per_tile=None,
+                 software_version=None, flowcell_version='v3', cif=False, thumbnails=False, finished=True):
+        if platform not in PLATFORMS:
+            raise ValueError("Unknown platform %s. Valid platforms are %s" % (platform, PLATFORMS))
+        defaults = DEFAULT_LAYOUTS[platform]
+        self.run_root = run_root
+        self.platform = platform
+        self.run_name = run_name or defaults['run_name']
+        self.reads = reads or defaults['reads']
+        self.clusters_per_tile = clusters_per_tile or defaults['clusters_per_tile']
+        self.software_version = software_version or defaults['software_version']
+        self.flowcell_version = flowcell_version
+        self.cif = cif
+        self.thumbnails = thumbnails
+        self.finished = finished
+        self.zero_block = None
+        self.random_block = None
+
+    def get_path(self):
+        return os.path.join(self.run_root, self.run_name)
+
+    def get_total_cycles(self):
+        return sum([cycles for (cycles, is_index) in self.reads])
+
+    def get_run_date(self):
+        return self.run_name.split('_')[0]
+
+    def get_instrument(self):
+        return self.run_name.split('_')[1]
+
+    def get_run_number(self):
+        return self.run_name.split('_')[2].lstrip('0')
+
+    def get_flowcell_barcode(self):
+        barcode = self.run_name.split('_')[-1]
+        if self.platform == 'hiseq' and barcode[0] in 'AB':
+            barcode = barcode[1:] # Leading letter is the flowcell position
+        return barcode
+
+    def make(self, fill='sparse', threads=8):
+        """
+        Function : Writes the run directory.
+        Returns  : (RunDir, number of files written, total size of the files in bytes)
+        """
+        if fill not in FILLS:
+            raise ValueError("Unknown fill %s. Valid fills are %s" % (fill, FILLS))
+        if os.path.exists(self.get_path()):
+            raise ValueError("%s already exists" % self.get_path())
+        os.makedirs(self.get_path())
+
+        files = self.write_metadata()
+        rundir = RunDir(self.run_root, self.run_name)
+        rundir.get_platform() # Reading the cycles from runParameters.xml needs the platform.
+        if rundir.get_cycle_list() != [cycles for (cycles, is_index) in self.reads]:
+            raise ValueError("RunDir reads the cycles of %s as %s, not as given (%s)" % (
+                self.run_name, rundir.get_cycle_list(), self.reads))
+        files.extend(self.get_data_files(rundir))
+
+        for directory in sorted(set([os.path.dirname(relpath) for (relpath, size) in files])):
+            path = os.path.join(self.get_path(), directory)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        if fill == 'zero':
+            self.zero_block = '\0' * FILL_BLOCK_SIZE
+        elif fill == 'random':
+            self.random_block = os.urandom(FILL_BLOCK_SIZE)
+        pool = ThreadPool(threads)
+        try:
+            pool.map(lambda f: self.write_file(f[0], f[1], fill),
+                     [f for f in files if f[1] is not None], chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+
+        return (rundir, len(files), sum([os.path.getsize(os.path.join(self.get_path(), relpath))
+                                         for (relpath, size) in files]))
+
+    def write_text(self, relpath, text):
+        path = os.path.join(self.get_path(), relpath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        # A size of None marks the file as already written.
+        return (relpath, None)
+
+    def write_file(self, relpath, size, fill):
+        with open(os.path.join(self.get_path(), relpath), 'wb') as f:
+            if fill == 'sparse':
+                f.truncate(size)
+                return
+            if fill == 'zero':
+                block = self.zero_block
+                offset = 0
+            else:
+                # Start at an offset given by the file name, so no two files are the same.
+                block = self.random_block
+                offset = zlib.crc32(relpath) % FILL_BLOCK_SIZE
+            remaining = size
+            while remaining > 0:
+                data = block[offset:offset + remaining]
+                f.write(data)
+                remaining -= len(data)
+                offset = 0
+
+    def write_metadata(self):
+        files = []
+        reads_xml = ''.join(['      <%s Number="%d" NumCycles="%d" IsIndexedRead="%s" />\n' % (
+                                 'RunInfoRead' if self.platform == 'miseq' else 'Read',
+                                 number + 1, cycles, 'Y' if is_index else 'N')
+                             for (number, (cycles, is_index)) in enumerate(self.reads)])
+
+        if self.platform == 'hiseq':
+            files.append(self.write_text('runParameters.xml',
+                '<?xml version="1.0"?>\n'
+                '<RunParameters>\n'
+                '  <Setup>\n'
+                '    <Flowcell>HiSeq Flow Cell %s</Flowcell>\n'
+                '    <ApplicationName>HiSeq Control Software</ApplicationName>\n'
+                '    <ApplicationVersion>%s</ApplicationVersion>\n'
+                '    <RunID>%s</RunID>\n'
+                '    <RunStartDate>%s</RunStartDate>\n'
+                '    <Barcode>%s</Barcode>\n'
+                '    <Reads>\n%s    </Reads>\n'
+                '  </Setup>\n'
+                '</RunParameters>\n' % (self.flowcell_version, self.software_version, self.run_name,
+                                        self.get_run_date(), self.get_flowcell_barcode(),
+                                        reads_xml)))
+        elif self.platform == 'miseq':
+            files.append(self.write_text('runParameters.xml',
+                '<?xml version="1.0"?>\n'
+                '<RunParameters>\n'
+                '  <Setup>\n'
+                '    <ApplicationName>MiSeq Control Software</ApplicationName>\n'
+                '    <ApplicationVersion>%s</ApplicationVersion>\n'
+                '  </Setup>\n'
+                '  <RunID>%s</RunID>\n'
+                '  <RunStartDate>%s</RunStartDate>\n'
+                '  <Barcode>%s</Barcode>\n'
+                '  <Reads>\n%s  </Reads>\n'
+                '</RunParameters>\n' % (self.software_version, self.run_name, self.get_run_date(),
+                                        self.get_flowcell_barcode(), reads_xml)))
+        else:
+            # GA: no runParameters.xml; the platform is known by EventScripts/,
+            # and the reads and cycles are read from Status.xml.
+            os.mkdir(os.path.join(self.get_path(), 'EventScripts'))
+            files.append(self.write_text('RunLog_%s.xml' % self.get_run_date(),
+                '<?xml version="1.0"?>\n'
+                '<RunLog>\n'
+                '  <Software version="%s" />\n'
+                '</RunLog>\n' % self.software_version))
+            files.append(self.write_text(RunDir.DATA_STATUS_PATH,
+                '<?xml version="1.0"?>\n'
+                '<Status>\n'
+                '  <Configuration>\n'
+                '    <NumberOfReads>%d</NumberOfReads>\n'
+                '    <IsPairedEndRun>%s</IsPairedEndRun>\n'
+                '  </Configuration>\n'
+                '  <NumCycles>%d</NumCycles>\n'
+                '</Status>\n' % (len(self.reads),
+                                 len([read for read in self.reads if not read[1]]) > 1,
+                                 self.get_total_cycles())))
+
+        if self.platform in ('ga', 'miseq'):
+            files.append(self.write_text(os.path.join('Data', 'Intensities', 'config.xml'),
+                '<?xml version="1.0"?>\n'
+                '<ImageAnalysis>\n'
+                '  <RunParameters>\n'
+                '    <Instrument>%s</Instrument>\n'
+                '  </RunParameters>\n'
+                '</ImageAnalysis>\n' % self.get_instrument()))
+
+        files.append(self.write_text('RunInfo.xml',
+            '<?xml version="1.0"?>\n'
+            '<RunInfo Version="2">\n'
+            '  <Run Id="%s" Number="%s">\n'
+            '    <Flowcell>%s</Flowcell>\n'
+            '    <Instrument>%s</Instrument>\n'
+            '    <Date>%s</Date>\n'
+            '    <Reads>\n%s    </Reads>\n'
+            '  </Run>\n'
+            '</RunInfo>\n' % (self.run_name, self.get_run_number(), self.get_flowcell_barcode(),
+                              self.get_instrument(), self.get_run_date(),
+                              reads_xml.replace('RunInfoRead', 'Read'))))
+
+        files.append(self.write_text(os.path.join('Data', 'Intensities', 'BaseCalls', 'config.xml'),
+                                     '<?xml version="1.0"?>\n<BaseCallAnalysis />\n'))
+        if self.platform == 'miseq':
+            offsets_file = 'SubTileOffsets.txt'
+        else:
+            offsets_file = 'offsets.txt'
+        files.append(self.write_text(os.path.join('Data', 'Intensities', 'Offsets', offsets_file),
+                                     '0\t0\t0\t0\n'))
+
+        files.extend(self.write_status_files())
+        return files
+
+    def write_status_files(self):
+        files = [self.write_text(RunDir.STATUS_FILES[RunDir.STATUS_STARTED], '')]
+        if self.platform == 'ga':
+            # is_finished() wants the status to be READ2 (or SINGLEREAD) exactly.
+            if len(self.reads) == 1:
+                status_files = [RunDir.STATUS_FILES[RunDir.STATUS_BASECALLING_COMPLETE_SINGLEREAD]]
+            else:
+                status_files = [RunDir.STATUS_FILES[RunDir.STATUS_BASECALLING_COMPLETE_READ1],
+                                RunDir.STATUS_FILES[RunDir.STATUS_BASECALLING_COMPLETE_READ2]]
+        else:
+            status_files = [RunDir.STATUS_FILES[RunDir.STATUS_BASECALLING_COMPLETE_READ1 + read]
+                            for read in range(len(self.reads))]
+            status_files.append(RunDir.STATUS_FILES[RunDir.STATUS_RTA_COMPLETE])
+        if not self.finished:
+            status_files = status_files[:-1]
+        files.extend([self.write_text(status_file, '') for status_file in status_files])
+        return files
+
+    def get_data_files(self, rundir):
+        """
+        Returns : (relative path, size) of each data file of the run, laid out for rundir.
+        """
+        clusters = self.clusters_per_tile
+        lanes = rundir.get_lane_list()
+        tiles = rundir.get_tile_list()
+        cycles = range(1, rundir.get_total_cycles() + 1)
+        sw_version = rundir.get_control_software_version_integer()
+
+        intensities = os.path.join('Data', 'Intensities')
+        basecalls = os.path.join(intensities, 'BaseCalls')
+        files = []
+        for lane in lanes:
+            lane_dir = 'L%03d' % lane
+            for tile in tiles:
+                # Cluster positions and filters moved into the lane directories in HCS 1.3.8.
+                if self.platform == 'miseq':
+                    files.append((os.path.join(intensities, lane_dir, 's_%d_%04d.locs' % (lane, tile)), 12 + 8 * clusters))
+                    files.append((os.path.join(basecalls, lane_dir, 's_%d_%04d.filter' % (lane, tile)), 12 + clusters))
+                elif self.platform == 'hiseq' and sw_version >= 1308:
+                    files.append((os.path.join(intensities, lane_dir, 's_%d_%04d.clocs' % (lane, tile)), 5 + clusters))
+                    files.append((os.path.join(basecalls, lane_dir, 's_%d_%04d.filter' % (lane, tile)), 12 + clusters))
+                else:
+                    files.append((os.path.join(intensities, 's_%d_%04d_pos.txt' % (lane, tile)), 20 * clusters))
+                    files.append((os.path.join(basecalls, 's_%d_%04d.filter' % (lane, tile)), 12 + clusters))
+
+            for cycle in cycles:
+                cycle_dir = 'C%d.1' % cycle
+                for tile in tiles:
+                    files.append((os.path.join(basecalls, lane_dir, cycle_dir, 's_%d_%d.bcl' % (lane, tile)), 4 + clusters))
+                    files.append((os.path.join(basecalls, lane_dir, cycle_dir, 's_%d_%d.stats' % (lane, tile)), STATS_BYTES))
+                    if self.cif:
+                        # 4 channels of 2 bytes per cluster.
+                        files.append((os.path.join(intensities, lane_dir, cycle_dir, 's_%d_%d.cif' % (lane, tile)), 13 + 8 * clusters))
+                    if self.thumbnails:
+                        for base in 'acgt':
+                            files.append((os.path.join('Thumbnail_Images', lane_dir, cycle_dir,
+                                                       's_%d_%d_%s.jpg' % (lane, tile, base)), THUMBNAIL_BYTES))
+            if not self.cif:
+                # The lane directory is there even when intensities aren't kept.
+                path = os.path.join(self.get_path(), intensities, lane_dir)
+                if not os.path.exists(path):
+                    os.makedirs(path)
+
+        records = len(lanes) * len(tiles) * len(cycles)
+        for (filename, record_bytes) in sorted(INTEROP_RECORD_BYTES.items()):
+            files.append((os.path.join('InterOp', filename), 1 + record_bytes * records))
+        files.append((os.path.join('InterOp', 'TileMetricsOut.bin'),
+                      2 + TILE_METRICS_BYTES_PER_TILE * len(lanes) * len(tiles)))
+        return files
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    usage = "%prog [options] run_root"
+    parser = OptionParser(usage=usage)
+
+    parser.add_option("-p", "--platform", dest="platform", type="choice", choices=PLATFORMS,
+                      default='hiseq',
+                      help='Platform of the run, one of %s [default = hiseq]' % ', '.join(PLATFORMS))
+    parser.add_option("-n", "--name", dest="run_name", type="string",
+                      default=None,
+                      help='Run directory name [default = a typical name for the platform]')
+    parser.add_option("-r", "--reads", dest="reads", type="string",
+                      default=None,
+                      help='Cycles of each read, index reads marked with i, e.g. 101,8i,101 [default for the platform]')
+    parser.add_option("-c", "--clusters", dest="clusters_per_tile", type="int",
+                      default=None,
+                      help='Clusters per tile; sets the file sizes [default for the platform]')
+    parser.add_option("-s", "--softwareVersion", dest="software_version", type="string",
+                      default=None,
+                      help='Control software version, e.g. 1.1.37 for an early HiSeq run [default for the platform]')
+    parser.add_option("-f", "--flowcellVersion", dest="flowcell_version", type="choice", choices=['v1', 'v3'],
+                      default='v3',
+                      help='HiSeq flowcell version: v1 has 2 swaths, v3 has 3 [default = v3]')
+    parser.add_option("--fill", dest="fill", type="choice", choices=FILLS,
+                      default='sparse',
+                      help='How to fill the data files, one of %s [default = sparse]' % ', '.join(FILLS))
+    parser.add_option("--cif", dest="cif", action="store_true",
+                      default=False,
+                      help='Include the intensity files (.cif) [default = false]')
+    parser.add_option("--thumbnails", dest="thumbnails", action="store_true",
+                      default=False,
+                      help='Include Thumbnail_Images [default = false]')
+    parser.add_option("--unfinished", dest="unfinished", action="store_true",
+                      default=False,
+                      help='Leave out the final status file (e.g. RTAComplete.txt) [default = false]')
+    parser.add_option("-t", "--threads", dest="threads", type="int",
+                      default=8,
+                      help='Threads writing files [default = 8]')
+
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 1:
+        print >> sys.stderr, os.path.basename(__file__), ": Give one run root"
+        sys.exit(1)
+
+    try:
+        reads = None
+        if opts.reads:
+            reads = parse_reads(opts.reads)
+        run = SyntheticRun(args[0], platform=opts.platform, run_name=opts.run_name, reads=reads,
+                           clusters_per_tile=opts.clusters_per_tile, software_version=opts.software_version,
+                           flowcell_version=opts.flowcell_version, cif=opts.cif, thumbnails=opts.thumbnails,
+                           finished=not opts.unfinished)
+        (rundir, file_count, total_bytes) = run.make(fill=opts.fill, threads=opts.threads)
+    except ValueError, e:
+        print >> sys.stderr, os.path.basename(__file__), ":", e
+        sys.exit(1)
+
+    print "%s: %d files, %.1f Gb" % (rundir.get_path(), file_count, total_bytes / (1024.0 ** 3))
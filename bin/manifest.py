@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# manifest.py - Per-file checksum manifest of a run directory.
+#
+# A ManifestBuilder hashes every file of a run on a pool of threads while the
+# copy is running (hashlib releases the GIL on large reads, so the threads
+# hash in parallel). When the copy has finished, the manifest is written into
+# the run directory at the destination, and verified there by one remote
+# command that re-hashes the copied files in parallel with xargs -P. Only the
+# digests come back over the network, so integrity is checked end to end
+# without an rsync -c pass.
+#
+# Digests are looked up in, and added to, a checksum_cache.ChecksumCache if
+# one is given, so a run is only hashed once however many times it is copied.
+#
+# The manifest is in the format of md5sum/sha1sum/b2sum ("digest  path"),
+# so it can also be checked by hand at the destination with "b2sum -c".
+#
+# Algorithms, fastest first. Each needs a matching tool at the destination.
+#   xxh64    - xxhash module locally, 'xxhsum -H1' remotely
+#   blake2b  - hashlib (python 3.6+) or pyblake2 locally, 'b2sum' remotely
+#   sha1     - 'sha1sum' remotely
+#   md5      - 'md5sum' remotely
+#   auto     - blake2b if available locally, else md5
+#
+###############################################################################
+
+import hashlib
+import os
+import pipes
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+REMOTE_HASH_COMMANDS = {
+    'xxh64': 'xxhsum -H1',
+    'blake2b': 'b2sum',
+    'sha1': 'sha1sum',
+    'md5': 'md5sum',
+}
+ALGORITHMS = ['auto'] + sorted(REMOTE_HASH_COMMANDS.keys())
+
+def get_hash_function(algorithm):
+    """
+    Returns : A function returning a new hash object for algorithm.
+              Raises ValueError if the algorithm is unknown or not available here.
+    """
+    if algorithm == 'xxh64':
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError("Hash algorithm xxh64 needs the xxhash module")
+        return xxhash.xxh64
+    if algorithm == 'blake2b':
+        if hasattr(hashlib, 'blake2b'):
+            return hashlib.blake2b
+        try:
+            import pyblake2
+        except ImportError:
+            raise ValueError("Hash algorithm blake2b needs python 3.6+ or the pyblake2 module")
+        return pyblake2.blake2b
+    if algorithm in ('sha1', 'md5'):
+        return getattr(hashlib, algorithm)
+    raise ValueError("Unknown hash algorithm %s. Valid algorithms are %s" % (algorithm, ALGORITHMS))
+
+def resolve_algorithm(algorithm):
+    if algorithm != 'auto':
+        get_hash_function(algorithm)
+        return algorithm
+    try:
+        get_hash_function('blake2b')
+        return 'blake2b'
+    except ValueError:
+        return 'md5'
+
+def hash_file(path, algorithm, read_size=1024*1024):
+    h = get_hash_function(algorithm)()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(read_size)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+def list_files(run_path, excludes=None):
+    """
+    Returns : Paths of the regular files under run_path, relative to it. Symlinks are
+              skipped, as they are copied as links. excludes are relative directory names
+              to leave out, e.g. 'Thumbnail_Images/'.
+    """
+    if excludes is None:
+        excludes = []
+    excludes = set([exclude.rstrip('/') for exclude in excludes])
+    relpaths = []
+    for (dirpath, dirnames, filenames) in os.walk(run_path):
+        reldir = os.path.relpath(dirpath, run_path)
+        if reldir == '.':
+            reldir = ''
+        dirnames[:] = [d for d in dirnames if os.path.join(reldir, d) not in excludes]
+        for filename in filenames:
+            if os.path.isfile(os.path.join(dirpath, filename)) and not os.path.islink(os.path.join(dirpath, filename)):
+                relpaths.append(os.path.join(reldir, filename))
+    return relpaths
+
+def format_manifest(digests):
+    return ''.join(["%s  %s\n" % (digests[relpath], relpath) for relpath in sorted(digests.keys())])
+
+def parse_manifest(text):
+    """
+    Returns : A dict of relative path to digest, from md5sum-style output.
+    """
+    digests = {}
+    for line in text.splitlines():
+        parts = line.split('  ', 1)
+        if len(parts) == 2:
+            digests[parts[1]] = parts[0]
+    return digests
+
+def get_manifest_filename(algorithm):
+    return 'Autocopy_manifest.%s' % algorithm
+
+def get_remote_verify_script(dest_run_path, algorithm, parallelism=8, files_per_process=64):
+    """
+    Function : Shell script that hashes, in parallel, every file listed in the manifest at
+               dest_run_path, printing md5sum-style lines. Files that are missing at the
+               destination are simply absent from the output.
+    """
+    # Paths start after the digest and two spaces.
+    digest_length = len(get_hash_function(algorithm)().hexdigest())
+    if dest_run_path.startswith('~/'):
+        cd_path = '~/' + pipes.quote(dest_run_path[2:])
+    else:
+        cd_path = pipes.quote(dest_run_path)
+    return "cd %s && cut -c %d- %s | tr '\\n' '\\000' | xargs -0 -P %d -n %d %s" % (
+        cd_path, digest_length + 3, get_manifest_filename(algorithm), parallelism, files_per_process,
+        REMOTE_HASH_COMMANDS[algorithm])
+
+def compare_digests(expected, actual):
+    """
+    Returns : (missing, mismatched), sorted lists of relative paths.
+    """
+    missing = []
+    mismatched = []
+    for (relpath, digest) in expected.items():
+        if relpath not in actual:
+            missing.append(relpath)
+        elif actual[relpath] != digest:
+            mismatched.append(relpath)
+    return (sorted(missing), sorted(mismatched))
+
+class ManifestBuilder(threading.Thread):
+    """
+    Hashes the files of a run directory on a thread pool, in the background.
+    """
+
+    def __init__(self, run_path, algorithm, threads=4, excludes=None, checksum_cache=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.run_path = run_path
+        self.algorithm = algorithm
+        self.threads = threads
+        self.excludes = excludes
+        self.checksum_cache = checksum_cache
+        self.digests = {}
+        self.errors = []
+        self.start_time = None
+        self.end_time = None
+        self.bytes_hashed = 0
+
+    def run(self):
+        self.start_time = time.time()
+        pool = ThreadPool(self.threads)
+        try:
+            relpaths = list_files(self.run_path, self.excludes)
+            results = pool.imap_unordered(self.hash_one, relpaths, chunksize=16)
+            for (relpath, digest, size, error) in results:
+                if error is None:
+                    self.digests[relpath] = digest
+                    self.bytes_hashed += size
+                else:
+                    self.errors.append("%s: %s" % (relpath, error))
+        except Exception as e:
+            self.errors.append(str(e))
+        finally:
+            pool.close()
+            pool.join()
+            if self.checksum_cache is not None:
+                self.checksum_cache.commit()
+            self.end_time = time.time()
+
+    def hash_one(self, relpath):
+        path = os.path.join(self.run_path, relpath)
+        try:
+            if self.checksum_cache is None:
+                digest = hash_file(path, self.algorithm)
+            else:
+                digest = self.checksum_cache.hash_file(path, self.algorithm, hash_file)
+            return (relpath, digest, os.path.getsize(path), None)
+        except (IOError, OSError) as e:
+            return (relpath, None, 0, e)
+
+    def is_done(self):
+        return self.end_time is not None
+
+    def is_ok(self):
+        return self.is_done() and not self.errors
+
+    def get_manifest(self):
+        return format_manifest(self.digests)
+
+class ManifestVerifier(threading.Thread):
+    """
+    Writes a finished manifest into the run directory at the destination and
+    verifies the copied files against it there, in the background.
+    After is_done(): error is set if verification couldn't be done, otherwise
+    missing and mismatched list the files that failed.
+    """
+
+    def __init__(self, builder, backend, dest_run_path, parallelism=8):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.builder = builder
+        self.backend = backend
+        self.dest_run_path = dest_run_path
+        self.parallelism = parallelism
+        self.missing = []
+        self.mismatched = []
+        self.error = None
+        self.done = False
+
+    def run(self):
+        algorithm = self.builder.algorithm
+        try:
+            manifest_path = os.path.join(self.dest_run_path, get_manifest_filename(algorithm))
+            retcode = self.backend.write_dest_file(manifest_path, self.builder.get_manifest())
+            if retcode != 0:
+                self.error = "could not write %s (exit code %s)" % (manifest_path, retcode)
+                return
+            script = get_remote_verify_script(self.dest_run_path, algorithm, self.parallelism)
+            (retcode, output) = self.backend.run_dest_script(script)
+            remote_digests = parse_manifest(output)
+            if self.builder.digests and not remote_digests:
+                # Rather than every file missing, the hash tool is probably missing.
+                self.error = "no files could be hashed at the destination (exit code %s)" % retcode
+                return
+            (self.missing, self.mismatched) = compare_digests(self.builder.digests, remote_digests)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.done = True
+
+    def is_done(self):
+        return self.done
+
+    def is_ok(self):
+        return self.done and self.error is None and not self.missing and not self.mismatched
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# metrics.py - Counters, gauges and histograms for graphing autocopy,
+#              in the Prometheus text format.
+#
+# Autocopy keeps a MetricsRegistry and updates its metrics as it goes:
+# counters when something happens (a copy finished, a LIMS call failed),
+# gauges once per main loop pass (runs by state, queue depths, free space),
+# and histograms for durations (loop passes, LIMS calls, copy throughput).
+#
+# The registry can be exported two ways, both optional:
+#   - write_textfile() writes it atomically to a file, for the node_exporter
+#     textfile collector. Autocopy does this after every pass.
+#   - MetricsHTTPServer serves it at /metrics, for Prometheus to scrape.
+#
+# Metrics may have labels, e.g. autocopy_rundirs{state="copying"}. Label
+# values are given as keyword arguments, and every value of a metric must be
+# given the same label names.
+#
+###############################################################################
+
+import BaseHTTPServer
+import os
+import SocketServer
+import tempfile
+import threading
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return '%d' % value
+    return repr(value)
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape_label_value(value)) for (name, value) in zip(names, values))
+
+class Metric:
+
+    TYPE = None
+
+    def __init__(self, name, help_text, label_names=(), lock=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = lock or threading.Lock()
+        self.values = {} # label values tuple -> value
+
+    def get_key(self, labels):
+        if set(labels.keys()) != set(self.label_names):
+            raise ValueError("Metric %s takes labels %s, not %s" % (self.name, list(self.label_names), sorted(labels.keys())))
+        return tuple(labels[name] for name in self.label_names)
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.get_key(labels), 0)
+
+    def clear(self):
+        # Forget all label values, e.g. states that no run is in any more.
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        # Caller holds self.lock
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s %s' % (self.name, self.TYPE)]
+        for key in sorted(self.values.keys()):
+            lines.append('%s%s %s' % (self.name, format_labels(self.label_names, key), format_value(self.values[key])))
+        return lines
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counter %s can't go down" % self.name)
+        with self.lock:
+            key = self.get_key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # For mirroring a count kept elsewhere, e.g. Notifier.sent.
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            key = self.get_key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, help_text, buckets, label_names=(), lock=None):
+        Metric.__init__(self, name, help_text, label_names, lock)
+        self.buckets = sorted(buckets) + [float('inf')]
+
+    def observe(self, value, **labels):
+        with self.lock:
+            key = self.get_key(labels)
+            if key not in self.values:
+                self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            entry = self.values[key]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def get(self, **labels):
+        # Returns (count, sum)
+        with self.lock:
+            entry = self.values.get(self.get_key(labels))
+            if entry is None:
+                return (0, 0.0)
+            return (entry['count'], entry['sum'])
+
+    def render(self):
+        # Caller holds self.lock
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s %s' % (self.name, self.TYPE)]
+        names = self.label_names + ('le',)
+        for key in sorted(self.values.keys()):
+            entry = self.values[key]
+            for (bound, count) in zip(self.buckets, entry['counts']):
+                lines.append('%s_bucket%s %s' % (self.name, format_labels(names, key + (format_value(float(bound)),)), count))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(self.label_names, key), format_value(entry['sum'])))
+            lines.append('%s_count%s %s' % (self.name, format_labels(self.label_names, key), entry['count']))
+        return lines
+
+class MetricsRegistry:
+
+    FILENAME = 'autocopy.prom'
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics = []
+        self.names = set()
+
+    def add(self, metric):
+        with self.lock:
+            if metric.name in self.names:
+                raise ValueError("Metric %s is already registered" % metric.name)
+            self.names.add(metric.name)
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.add(Counter(name, help_text, label_names, lock=self.lock))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self.add(Gauge(name, help_text, label_names, lock=self.lock))
+
+    def histogram(self, name, help_text, buckets, label_names=()):
+        return self.add(Histogram(name, help_text, buckets, label_names, lock=self.lock))
+
+    def render(self):
+        """
+        Returns : Every metric, in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # Atomically, so a collector never reads half a file.
+        text = self.render()
+        (fd, tmp_path) = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would swamp the autocopy log.
+        pass
+
+class MetricsHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, registry, host='localhost', port=9642):
+        """
+        Args : port - 0 to pick a free port; see get_url().
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), MetricsRequestHandler)
+        self.registry = registry
+
+    def get_url(self):
+        (host, port) = self.server_address[0:2]
+        return 'http://%s:%s/metrics' % (host, port)
+
+    def start(self):
+        # Serves on a background thread, until shutdown().
+        thread = threading.Thread(target=self.serve_forever, name='metrics-server')
+        thread.daemon = True
+        thread.start()
+        return thread
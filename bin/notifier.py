@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# notifier.py - Sends email from a background thread, so that a slow or
+#               flaky mail relay doesn't hold up the main loop.
+#
+# Autocopy used to send each email on the calling thread, reconnecting
+# inline if the SMTP session had dropped; a second failure raised into the
+# main loop. Now send_email() put()s the message on a Notifier and returns.
+#
+# The Notifier keeps its queue in memory and in a JSON file, rewritten
+# atomically as in copy_journal.py, so mail queued before a restart is sent
+# after it. One sender thread holds an SMTP session open, checking it with
+# NOOP when it has been idle for keepalive_seconds, and reconnects when it
+# is lost. Messages go out in order; if sending fails, the sender waits
+# retry_seconds, doubling up to max_retry_seconds, and tries again. A
+# message that fails max_attempts times, or that the server refuses
+# outright, is dropped and logged. If more than max_queued messages are
+# waiting, the oldest are dropped.
+#
+###############################################################################
+
+import json
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+class Notifier:
+
+    FILENAME = 'notification_queue.json'
+
+    def __init__(self, connect_function, path=None, max_queued=500, retry_seconds=30, max_retry_seconds=1800,
+                 max_attempts=20, keepalive_seconds=120, log_function=None):
+        """
+        Args : connect_function - returns a new, logged in smtplib.SMTP object.
+               path - file to keep the queue in. If None, the queue is in memory only.
+        """
+        self.connect_function = connect_function
+        self.path = path
+        self.max_queued = max_queued
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.max_attempts = max_attempts
+        self.keepalive_seconds = keepalive_seconds
+        self.log_function = log_function
+        # Reentrant, as the signal handlers put() on the main thread, which may
+        # already hold it in put() or get_depth().
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.messages = []
+        self.session = None
+        self.last_used = None
+        self.sent = 0
+        self.dropped = 0
+        self.thread = None
+        self.load()
+
+    def log(self, text):
+        if self.log_function:
+            self.log_function(text)
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.messages = json.load(f)
+        except ValueError:
+            self.log("Ignoring unreadable email queue %s" % self.path)
+
+    def save(self):
+        # Caller holds self.lock
+        if self.path is None:
+            return
+        (fd, tmp_path) = tempfile.mkstemp(prefix=self.FILENAME + '.', dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.messages, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put(self, from_addr, to, message):
+        """
+        Function : Queues a message for the sender thread.
+        Args     : to - an address or a list of addresses.
+                   message - the whole message as a string, headers included.
+        """
+        with self.lock:
+            self.messages.append({'from': from_addr, 'to': to, 'message': message,
+                                  'queued_time': time.time(), 'attempts': 0})
+            overflow = len(self.messages) - self.max_queued
+            if overflow > 0:
+                del self.messages[0:overflow]
+                self.dropped += overflow
+            self.save()
+            self.wakeup.notify()
+        if overflow > 0:
+            self.log("Email queue is full, dropped the %s oldest messages" % overflow)
+
+    def get_depth(self):
+        with self.lock:
+            return len(self.messages)
+
+    def get_oldest_age(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.messages:
+                return None
+            return now - self.messages[0]['queued_time']
+
+    def start(self):
+        self.thread = threading.Thread(target=self.work, name='notifier')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def flush(self, timeout_seconds):
+        """
+        Function : Waits up to timeout_seconds for the queue to empty, e.g. before exiting.
+        Returns  : True if it emptied.
+        """
+        deadline = time.time() + timeout_seconds
+        while self.get_depth() and time.time() < deadline:
+            time.sleep(0.1)
+        return self.get_depth() == 0
+
+    def work(self):
+        retry_time = 0
+        while True:
+            with self.lock:
+                head = None
+                wait = self.keepalive_seconds
+                if self.messages:
+                    wait = retry_time - time.time()
+                    if wait <= 0:
+                        head = self.messages[0]
+                if head is None:
+                    self.wakeup.wait(min(wait, self.keepalive_seconds))
+            try:
+                if head is None:
+                    self.keep_alive()
+                elif not self.send_head(head):
+                    retry_time = time.time() + min(self.max_retry_seconds, self.retry_seconds * 2 ** (head['attempts'] - 1))
+            except Exception:
+                # e.g. the queue file couldn't be written. Keep the thread alive.
+                self.log("Email sender error:\n%s" % traceback.format_exc())
+                retry_time = time.time() + self.retry_seconds
+
+    def send_head(self, head):
+        """
+        Function : Sends the message at the head of the queue, and removes it if it was
+                   sent or can never be sent.
+        Returns  : False if it should be retried later.
+        """
+        try:
+            self.send(head)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused), e:
+            self.log("Dropping email that the mail server refused: %s" % e)
+            self.remove_head(head, dropped=True)
+            return True
+        except Exception:
+            self.close_session()
+            with self.lock:
+                head['attempts'] += 1
+                self.save()
+            if head['attempts'] >= self.max_attempts:
+                self.log("Dropping email after %s failed attempts:\n%s" % (head['attempts'], traceback.format_exc()))
+                self.remove_head(head, dropped=True)
+                return True
+            self.log("Sending email failed, will retry:\n%s" % traceback.format_exc())
+            return False
+        self.remove_head(head)
+        return True
+
+    def send(self, head):
+        if self.session is None:
+            self.open_session()
+        try:
+            self.session.sendmail(head['from'], head['to'], head['message'])
+        except smtplib.SMTPServerDisconnected:
+            # The server closed an idle session; one fresh try before counting a failure.
+            self.close_session()
+            self.open_session()
+            self.session.sendmail(head['from'], head['to'], head['message'])
+        self.last_used = time.time()
+
+    def open_session(self):
+        self.session = self.connect_function()
+        # Set here too, as the first sendmail may be refused.
+        self.last_used = time.time()
+
+    def remove_head(self, head, dropped=False):
+        with self.lock:
+            if self.messages and self.messages[0] is head:
+                del self.messages[0]
+                self.save()
+            if dropped:
+                self.dropped += 1
+            else:
+                self.sent += 1
+
+    def keep_alive(self):
+        if self.session is None or time.time() - self.last_used < self.keepalive_seconds:
+            return
+        try:
+            self.session.noop()
+            self.last_used = time.time()
+        except (smtplib.SMTPException, socket.error):
+            # Reconnect when there is something to send.
+            self.close_session()
+
+    def close_session(self):
+        if self.session is None:
+            return
+        try:
+            self.session.quit()
+        except (smtplib.SMTPException, socket.error):
+            pass
+        self.session = None
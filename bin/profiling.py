@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# profiling.py - Stack dumps and main loop profiling on demand, for a daemon
+#                that seems slow or hung.
+#
+# format_thread_stacks() gives the current stack of every thread, to see
+# where each one is stuck (validate, du, a LIMS call, a stat on a stale NFS
+# mount...).
+#
+# A LoopProfiler runs the main loop under cProfile for the next few passes
+# when asked to with request(), then writes the profile to a .pstats file
+# and a summary of the hottest functions to a .txt file beside it. Until it
+# is asked, profile() just calls the function, so it costs nothing to leave
+# in place.
+#
+# Autocopy asks for both on SIGUSR2. A signal handler only runs when the
+# main thread is between Python instructions, though, so if the main thread
+# is stuck in a system call it never runs. A ControlFileWatcher thread looks
+# for a control file instead, every poll_seconds, and passes each line of
+# it as a command to a handler function, e.g.
+#
+#     echo stacks > /var/log/autocopy.debug
+#     echo profile 3 > /var/log/autocopy.debug
+#
+###############################################################################
+
+import cProfile
+import os
+import pstats
+import StringIO
+import sys
+import threading
+import time
+import traceback
+
+def format_thread_stacks():
+    """
+    Returns : The stack of every thread, as text, main thread first.
+    """
+    names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+    frames = sys._current_frames().items()
+    current_ident = threading.current_thread().ident
+    frames.sort(key=lambda item: (names.get(item[0]) != 'MainThread', names.get(item[0], ''), item[0]))
+    text = "Stacks of %d threads:\n" % len(frames)
+    for (ident, frame) in frames:
+        marker = ''
+        if ident == current_ident:
+            marker = ' (dumping)'
+        text += "\nThread %s (%s)%s:\n" % (names.get(ident, 'unknown'), ident, marker)
+        text += ''.join(traceback.format_stack(frame))
+    return text
+
+class LoopProfiler:
+
+    def __init__(self, directory, top=25, log_function=None):
+        self.directory = directory
+        self.top = top
+        self.log_function = log_function
+        # Reentrant, as the SIGUSR2 handler calls request() on the main thread,
+        # which may already hold it in is_active() or profile().
+        self.lock = threading.RLock()
+        self.passes_remaining = 0
+        self.passes_profiled = 0
+        self.profiler = None
+
+    def log(self, text):
+        if self.log_function:
+            self.log_function(text)
+
+    def request(self, passes):
+        """
+        Function : Profiles the next `passes` calls to profile(). Safe to call from a
+                   signal handler or another thread.
+        """
+        with self.lock:
+            self.passes_remaining = passes
+
+    def is_active(self):
+        with self.lock:
+            return self.passes_remaining > 0
+
+    def profile(self, function, *args):
+        """
+        Function : Returns function(*args), run under cProfile if a profile was requested.
+        """
+        if not self.is_active():
+            return function(*args)
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.passes_profiled = 0
+        self.profiler.enable()
+        try:
+            return function(*args)
+        finally:
+            self.profiler.disable()
+            self.passes_profiled += 1
+            with self.lock:
+                self.passes_remaining -= 1
+                done = self.passes_remaining <= 0
+            if done:
+                self.finish()
+
+    def finish(self):
+        profile = self.profiler
+        self.profiler = None
+        try:
+            (stats_path, summary_path) = self.write_report(profile, self.passes_profiled)
+        except Exception:
+            # A profile is never worth a failed pass.
+            self.log("Failed to write profile:\n%s" % traceback.format_exc())
+            return
+        self.log("Wrote profile of %s passes to %s, summary in %s" % (self.passes_profiled, stats_path, summary_path))
+
+    def write_report(self, profile, passes):
+        """
+        Returns : (pstats path, summary path)
+        """
+        base = os.path.join(self.directory, 'autocopy_profile_%s_%d' % (time.strftime('%y%m%d_%H%M%S'), os.getpid()))
+        stats_path = base + '.pstats'
+        summary_path = base + '.txt'
+        profile.dump_stats(stats_path)
+        with open(summary_path, 'w') as f:
+            f.write(self.get_summary(profile, passes))
+        return (stats_path, summary_path)
+
+    def get_summary(self, profile, passes):
+        out = StringIO.StringIO()
+        out.write("Profile of %s main loop passes\n" % passes)
+        for (sort_key, title) in [('cumulative', 'including calls'), ('time', 'excluding calls')]:
+            out.write("\nTop %d functions by time %s:\n" % (self.top, title))
+            stats = pstats.Stats(profile, stream=out)
+            stats.strip_dirs().sort_stats(sort_key).print_stats(self.top)
+        return out.getvalue()
+
+class ControlFileWatcher:
+
+    def __init__(self, path, handle_command, poll_seconds=5, log_function=None):
+        """
+        Args : handle_command - called with the words of each line of the control file.
+        """
+        self.path = path
+        self.handle_command = handle_command
+        self.poll_seconds = poll_seconds
+        self.log_function = log_function
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.work, name='control-file-watcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                if self.log_function:
+                    self.log_function("Control file error:\n%s" % traceback.format_exc())
+            time.sleep(self.poll_seconds)
+
+    def check(self):
+        """
+        Returns : The commands found in the control file, which is then removed.
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            lines = f.readlines()
+        os.remove(self.path)
+        commands = [line.split() for line in lines if line.strip()]
+        for words in commands:
+            self.handle_command(words)
+        return commands
@@ -4,14 +4,13 @@ import datetime
 import glob
 import os
 import os.path
-import platform
 import re
-import subprocess
 import sys
 import xml.dom.minidom
 import xml.dom.pulldom
 
 import rundir_utils
+import disk_usage
 
 #
 # The RunDir object encapsulates all the functionality associated with an Illumina run directory.
@@ -175,6 +174,15 @@ class RunDir:
         self.copy_proc = None
         self.copy_start_time = None
         self.copy_end_time = None
+        self.copy_queue_wait = None
+        self.copy_progress = None
+        self.copy_restarts = 0
+        self.copy_backend = None
+        self.manifest = None
+        self.manifest_verifier = None
+        self.manifest_status = None
+        self.manifest_repaired = False
+        self.finalize_state = None
 
         self.start_date = None
         self.machine = None
@@ -483,9 +491,12 @@ class RunDir:
         self.copy_proc = None
         self.copy_start_time = None
         self.copy_end_time = None
+        self.copy_progress = None
 
     def kill_copy_process(self):
         self.copy_proc.kill()
+        # Reap it, so that nothing following its output waits on a zombie.
+        self.copy_proc.wait()
         self.reset_to_copy_not_started()
 
     def seconds_since_copy_started(self):
@@ -493,7 +504,8 @@ class RunDir:
             return None
         else:
             timedelta = datetime.datetime.now() - self.copy_start_time
-        return timedelta.seconds
+        # total_seconds(), not .seconds, which wraps around every day.
+        return timedelta.total_seconds()
 
     def is_copying(self):
         if self.copy_proc:
@@ -531,6 +543,24 @@ class RunDir:
     def is_seq_finished(self):
         return self.is_finished()
 
+    def get_finished_time(self):
+        # Returns the mtime (seconds since epoch) of the status file for the
+        #  current sequencing status, i.e. RTAComplete.txt for a finished
+        #  HiSeq/MiSeq run, or None if no status file is present.
+        status = self.get_status()
+        status_file = RunDir.STATUS_FILES[status]
+        if status_file is None:
+            return None
+        try:
+            return os.path.getmtime(os.path.join(self.get_path(), status_file))
+        except OSError:
+            return None
+
+    def get_size_estimate(self):
+        # Size of the run in bytes, as it is now. Cheap to call repeatedly, since the
+        #  disk usage engine only re-lists directories that have changed.
+        return self.get_disk_usage_bytes()
+
     #
     # ANALYSIS STATUS METHODS
     #
@@ -615,34 +645,20 @@ class RunDir:
             if os.path.exists(status_path):
                 os.remove(status_path)
 
-    def get_disk_usage(self):
+    def get_disk_usage(self, refresh=False):
+        # Disk usage of the run directory in gigabytes, as 'du -s' would count it.
+        return self.get_disk_usage_bytes(refresh=refresh) / (1024.0 ** 3)
+
+    def get_disk_usage_bytes(self, refresh=False):
         #
-        # Run 'du' on the run directory.
+        # Walks the run directory in-process. Directories unchanged since the
+        #  last call are not listed again, see disk_usage.py.
         #
-        du_cmd_list = ['du', '-s']
-
-        # Set block size switches for various platforms.
-        #  The desired unit of measure is gigabytes.
-        platfm = platform.system()
-        if platfm == "Linux":
-            du_cmd_list.append("--block-size=1G")
-        elif platfm == "Darwin":
-            du_cmd_list.append("-g")
-        else:
-            print >> sys.stderr, "get_disk_usage(): Unknown OS platform %s" % (platfm)
-            disk_usage = None
-            return self.disk_usage
-
-        # Add the run directory path to the command.
-        du_cmd_list.append(self.get_path())
-
-        # Run the disk usage command and get the output.
-        du_cmd_pipe = subprocess.Popen(du_cmd_list, stdout=subprocess.PIPE)
-        (du_stdout, du_stderr) = du_cmd_pipe.communicate()
+        return disk_usage.get_engine().get_usage(self.get_path(), refresh=refresh)
 
-        # Parse the output.
-        (disk_usage, dir) = du_stdout.split()
-        return int(disk_usage)
+    def forget_disk_usage(self):
+        # Drops the cached walk of the run directory once it has been moved away.
+        disk_usage.get_engine().forget(self.get_path())
 
     ###
     # Other methods
@@ -1154,9 +1170,9 @@ if __name__ == "__main__":
         print rundir.str(),
 
         if opts.disk_usage:
-            disk_usage = rundir.get_disk_usage()
+            disk_usage_gb = rundir.get_disk_usage()
 
-            print "  Disk Usage: %d Gb" % disk_usage
+            print "  Disk Usage: %.1f Gb" % disk_usage_gb
 
         if opts.validate:
             print
@@ -1,11 +1,14 @@
 import os
 import os.path
-import platform
 import shutil
+import sqlite3
 import subprocess
 import sys
 import tarfile
 
+from checksum_cache import ChecksumCache
+from manifest import hash_file
+
 ##########################################################################
 #
 # rundir_utils.py - Utilities which act on RunDirs
@@ -578,6 +581,25 @@ def make_thumbnail_subset_tar(rundir, overwrite=False, verbose=False):
         print >> sys.stderr, "make_thumbnail_subset_tar(): %s: No images chosen; No tar file created." % rundir.get_dir()
         return False
 
+#
+# The tar is unchanged if this is a rerun, so its checksum may be cached.
+# The cache is shared with the autocopy daemon; if it can't be used (e.g.
+# the database is locked), the tar is just hashed.
+#
+def get_tar_md5(rundir, compressed_tar_path):
+    md5 = None
+    try:
+        checksum_cache = ChecksumCache.for_run_root(rundir.get_root())
+        try:
+            md5 = checksum_cache.hash_file(compressed_tar_path, "md5", hash_file)
+        finally:
+            checksum_cache.close()
+    except sqlite3.Error as e:
+        print >> sys.stderr, "make_archive_tar(): Checksum cache not used for %s: %s" % (compressed_tar_path, e)
+    if md5 is None:
+        md5 = hash_file(compressed_tar_path, "md5")
+    return md5
+
 #
 #
 #
@@ -888,19 +910,16 @@ def make_archive_tar(rundir, **opts):
         print >> sys.stderr, "make_archive_tar(): creating MD5 checksum file listing for %s compressed tar" % rundir.get_dir()
 
     if ssh_socket is None:
-        if platform.system() == "Linux":
-            md5_cmd_list = ["md5sum"]
-        elif platform.system() == "Darwin":
-            md5_cmd_list = ["md5", "-r"]
-        else:
-            md5_cmd_list = ["md5sum"]
-
-        md5_cmd_list.append(compressed_tar_path)
-
-        md5_file = open(md5_path_tmp, "w")
-        if debug: print >> sys.stderr, "DEBUG: %s" % " ".join(md5_cmd_list)
-        retcode = subprocess.call(md5_cmd_list, stdout=md5_file)
-        md5_file.close()
+        try:
+            md5 = get_tar_md5(rundir, compressed_tar_path)
+            if debug: print >> sys.stderr, "DEBUG: md5 %s = %s" % (compressed_tar_path, md5)
+            md5_file = open(md5_path_tmp, "w")
+            md5_file.write("%s  %s\n" % (md5, compressed_tar_path))  # md5sum format
+            md5_file.close()
+            retcode = 0
+        except (IOError, OSError) as e:
+            print >> sys.stderr, "make_archive_tar(): Error computing MD5 of %s: %s" % (compressed_tar_path, e)
+            retcode = 1
     else:
         #
         # ASSUMPTION: an ssh socket will be into a Linux machine.
@@ -3,12 +3,15 @@
 from optparse import OptionParser
 import sys
 
+from lims_batch import read_batch_commands, run_concurrently
 from scgpm_lims import Connection, RunInfo
 
 class StartRun:
 
-    def __init__(self, run_name, pipeline_run_id, reverse):
-        self.conn=Connection()
+    def __init__(self, run_name, pipeline_run_id, reverse, conn=None):
+        if conn is None:
+            conn=Connection()
+        self.conn=conn
         self.run_name=run_name
         self.reverse = reverse
         if reverse:
@@ -27,8 +30,27 @@ class StartRun:
             update = {'started': True}
         self.conn.updatepipelinerun(self.pipeline_run_id, paramdict=update)
 
+def update_runs(commands, reverse, workers=8):
+    """
+    Function : Updates many runs over one connection, looking up their pipeline runs concurrently.
+    Args     : commands - a list of (line number, words) from lims_batch.read_batch_commands,
+                          where words are run_name [pipeline_id].
+    Returns  : A list of (run_name, error) for the runs that failed.
+    """
+    for (number, words) in commands:
+        if len(words) > 2:
+            raise Exception("Line %s: expected run_name [pipeline_id], but I got this: %s" % (number, ' '.join(words)))
+    conn = Connection()
+    def update(words):
+        pipeline_run_id = None
+        if len(words) == 2:
+            pipeline_run_id = words[1]
+        StartRun(words[0], pipeline_run_id=pipeline_run_id, reverse=reverse, conn=conn).update()
+    results = run_concurrently(update, [words for (number, words) in commands], workers=workers)
+    return [(words[0], error) for (words, result, error) in results if error is not None]
+
 if __name__=='__main__':
-    usage = "%prog [options] run_name"
+    usage = "%prog [options] run_name\n       %prog [options] --batch FILE"
     description = "Updates status flags on the LIMS. Sets the analysis run status in the LIMS to 'Started' (unsetting it if -r)."
     parser = OptionParser(usage=usage)
     parser.add_option("-p", "--pipeline_id", dest="pipeline_id", 
@@ -37,8 +59,24 @@ if __name__=='__main__':
     parser.add_option("-r", "--reverse", dest="reverse", action="store_true",
                       default=False,
                       help="Uncheck the 'Started' check box. [default = False]")
+    parser.add_option("-b", "--batch", dest="batch", default=None,
+                      help="Read one 'run_name [pipeline_id]' per line from this file, or - for stdin, "
+                      "and update them all over one LIMS connection.")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=8,
+                      help="With --batch, the number of runs to update at once [default = %default]")
     (opts, args) = parser.parse_args()
 
+    if opts.batch:
+        if args or opts.pipeline_id:
+            print >> sys.stderr, "--batch takes no run name or --pipeline_id"
+            sys.exit(-1)
+        failures = update_runs(read_batch_commands(opts.batch), opts.reverse, workers=opts.workers)
+        for (run_name, error) in failures:
+            print >> sys.stderr, "%s: %s" % (run_name, error)
+        if failures:
+            sys.exit(1)
+        sys.exit(0)
+
     if len(args) != 1:
         print >> sys.stderr, "need exactly one run name"
         sys.exit(-1)
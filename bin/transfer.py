@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+###############################################################################
+#
+# transfer.py - Transfer backends used by Autocopy to copy run directories.
+#
+# Each backend knows how to start a copy of a run directory to the
+# destination run root, and how to run a command at the destination (e.g.
+# to drop a sentinel file). A copy is a process-like object with poll(),
+# wait() and kill(), plus a copy_progress.CopyProgress fed by a reader thread.
+#
+# Copy output can be written to a file instead of a pipe (output_path), so
+# that the copy survives the daemon exiting and can be followed again with
+# follow_output() by the next one.
+#
+# Backends:
+#   rsync    - rsync over ssh. Resumable. The default.
+#   tar_ssh  - 'tar -c | ssh tar -x' stream. Much lower per-file overhead than
+#              rsync for trees of many small files, but not resumable, so it
+#              is only used for first-time copies.
+#   local    - rsync to a destination run root on a locally mounted
+#              filesystem. No ssh; usable in tests.
+#
+###############################################################################
+
+import errno
+import os
+import pipes
+import re
+import subprocess
+import threading
+
+from copy_progress import CopyProgress, RsyncProgressReader, read_chunks
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: alive, but owned by another user.
+        return e.errno == errno.EPERM
+    return True
+
+def quote_dest_arg(arg):
+    # Shell-quote an argument for the destination, leaving a leading '~/'
+    # unquoted so that the remote shell still expands it.
+    if arg.startswith('~/'):
+        return '~/' + pipes.quote(arg[2:])
+    return pipes.quote(arg)
+
+class TransferBackend:
+
+    NAME = None
+    RESUMABLE = False
+
+    # Files never copied, relative to the run directory.
+    EXCLUDES = ['Thumbnail_Images/']
+
+    def __init__(self, dest_host, dest_user, dest_run_root, log_file=None, rsync_progress_args=None):
+        self.dest_host = dest_host
+        self.dest_user = dest_user
+        self.dest_run_root = dest_run_root.rstrip('/')
+        self.log_file = log_file
+        if rsync_progress_args is None:
+            rsync_progress_args = []
+        self.rsync_progress_args = rsync_progress_args
+
+    def get_dest_path(self, rundir):
+        return os.path.join(self.dest_run_root, rundir.get_dir())
+
+    def start(self, rundir, resume=False, log_function=None, output_path=None, checksum=None):
+        """
+        Function : Starts copying rundir to the destination run root.
+        Args     : resume - the copy is a restart of an interrupted copy.
+                   log_function - called with each line of copy output that isn't progress.
+                   output_path - file to write copy output to, instead of a pipe.
+                   checksum - compare files already at the destination by content rather than
+                   size and mtime, where the backend can. Defaults to 'not resume'.
+        Returns  : (copy_proc, copy_progress)
+        """
+        raise NotImplementedError()
+
+    def follow_output(self, rundir, copy_proc, output_path, log_function=None):
+        """
+        Function : Starts a reader thread following the output file of a running copy.
+        Returns  : A copy_progress.CopyProgress.
+        """
+        raise NotImplementedError()
+
+    def open_output(self, output_path):
+        if output_path is None:
+            return subprocess.PIPE
+        # A new file rather than a truncated one, in case a reader of a killed copy still has it open.
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return open(output_path, 'w')
+
+    def get_dest_command(self, cmd_list):
+        # Wraps a command so that it runs at the destination.
+        return ['ssh', '-l', self.dest_user, self.dest_host, ' '.join([quote_dest_arg(arg) for arg in cmd_list])]
+
+    def call_dest_command(self, cmd_list):
+        return subprocess.call(self.get_dest_command(cmd_list),
+                               stdout=self.log_file, stderr=self.log_file)
+
+    def touch(self, dest_path):
+        return self.call_dest_command(['touch', dest_path])
+
+    def write_dest_file(self, dest_path, contents):
+        proc = subprocess.Popen(self.get_dest_command(['tee', dest_path]), stdin=subprocess.PIPE,
+                                stdout=open(os.devnull, 'w'), stderr=self.log_file)
+        proc.communicate(contents)
+        return proc.returncode
+
+    def run_dest_script(self, script):
+        """
+        Function : Runs a shell script at the destination.
+        Returns  : (returncode, stdout)
+        """
+        proc = subprocess.Popen(self.get_dest_command(['sh', '-c', script]),
+                                stdout=subprocess.PIPE, stderr=self.log_file)
+        (stdout, stderr) = proc.communicate()
+        return (proc.returncode, stdout)
+
+class RsyncBackend(TransferBackend):
+
+    NAME = 'rsync'
+    RESUMABLE = True
+
+    def get_rsync_dest(self):
+        return '%s:%s' % (self.dest_host, self.dest_run_root)
+
+    def get_rsync_remote_shell_args(self):
+        return ['-e', 'ssh -l %s' % self.dest_user]
+
+    def get_copy_command(self, rundir, resume=False, checksum=None):
+        if checksum is None:
+            checksum = not resume
+        rsync_flags = ['-rlpt']
+        if checksum:
+            rsync_flags = ['-rlptc']
+        if resume:
+            rsync_flags.append('--partial')
+        copy_cmd_list = ['rsync'] + rsync_flags + self.get_rsync_remote_shell_args()
+        copy_cmd_list.extend(['--exclude=%s' % exclude for exclude in self.EXCLUDES])
+        copy_cmd_list.append('--chmod=Dug=rwX,Do=rX,Fug=rw,Fo=r')
+        copy_cmd_list.extend(self.rsync_progress_args)
+        copy_cmd_list.extend([rundir.get_path().rstrip('/'), self.get_rsync_dest()])
+        return copy_cmd_list
+
+    def start(self, rundir, resume=False, log_function=None, output_path=None, checksum=None):
+        output = self.open_output(output_path)
+        copy_proc = subprocess.Popen(self.get_copy_command(rundir, resume=resume, checksum=checksum),
+                                     stdout=output, stderr=self.log_file)
+        if output_path is None:
+            reader = RsyncProgressReader(copy_proc.stdout, log_function=log_function)
+            reader.start()
+            return (copy_proc, reader.progress)
+        output.close()
+        return (copy_proc, self.follow_output(rundir, copy_proc, output_path, log_function))
+
+    def follow_output(self, rundir, copy_proc, output_path, log_function=None):
+        reader = RsyncProgressReader(open(output_path), log_function=log_function,
+                                     writer_alive=lambda: is_process_alive(copy_proc.pid))
+        reader.start()
+        return reader.progress
+
+class LocalBackend(RsyncBackend):
+
+    NAME = 'local'
+
+    def __init__(self, *args, **kwargs):
+        RsyncBackend.__init__(self, *args, **kwargs)
+        self.dest_run_root = os.path.expanduser(self.dest_run_root)
+
+    def get_rsync_dest(self):
+        return self.dest_run_root
+
+    def get_rsync_remote_shell_args(self):
+        return []
+
+    def get_dest_command(self, cmd_list):
+        return cmd_list
+
+class PipelineProcess:
+    """
+    Process-like wrapper around a producer | consumer pipeline.
+    The pipeline is finished when the consumer exits; its return code is
+    the first non-zero return code of the two.
+    """
+
+    def __init__(self, producer, consumer):
+        self.producer = producer
+        self.consumer = consumer
+        self.pid = consumer.pid
+        self.pids = [producer.pid, consumer.pid]
+
+    def poll(self):
+        consumer_retcode = self.consumer.poll()
+        if consumer_retcode is None:
+            return None
+        producer_retcode = self.producer.poll()
+        if producer_retcode is None:
+            # The consumer is gone, so the producer will die of SIGPIPE shortly.
+            self.producer.kill()
+            producer_retcode = self.producer.wait()
+        return producer_retcode or consumer_retcode
+
+    def wait(self):
+        self.consumer.wait()
+        self.producer.wait()
+        return self.poll()
+
+    def kill(self):
+        for proc in (self.producer, self.consumer):
+            if proc.poll() is None:
+                proc.kill()
+
+class TarProgressReader(threading.Thread):
+    """
+    Reads the file names listed by 'tar -v' and counts files and bytes sent.
+    With writer_alive, stream is a file followed until writer_alive() is False.
+    """
+
+    def __init__(self, stream, source_root, log_function=None, writer_alive=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stream = stream
+        self.source_root = source_root
+        self.log_function = log_function
+        self.writer_alive = writer_alive
+        self.progress = CopyProgress()
+        self.files_transferred = 0
+        self.bytes_transferred = 0
+
+    def run(self):
+        pending = ''
+        try:
+            for chunk in read_chunks(self.stream, self.writer_alive):
+                pending += chunk
+                lines = pending.split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    self.handle_line(line)
+            if pending:
+                self.handle_line(pending)
+        finally:
+            self.progress.set_finished()
+            self.stream.close()
+
+    def handle_line(self, line):
+        name = re.sub(r'^a ', '', line) # bsdtar prefixes "a "
+        path = os.path.join(self.source_root, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            if self.log_function:
+                self.log_function(line)
+            return
+        self.files_transferred += 1
+        self.bytes_transferred += st.st_size
+        self.progress.update({'files_transferred': self.files_transferred,
+                              'bytes_transferred': self.bytes_transferred})
+
+class TarSshBackend(TransferBackend):
+
+    NAME = 'tar_ssh'
+    RESUMABLE = False
+
+    def get_tar_command(self, rundir):
+        tar_cmd_list = ['tar', '-C', rundir.get_root(), '-c', '-v', '-f', '-']
+        for exclude in self.EXCLUDES:
+            tar_cmd_list.extend(['--exclude', os.path.join(rundir.get_dir(), exclude.rstrip('/'))])
+        tar_cmd_list.append(rundir.get_dir())
+        return tar_cmd_list
+
+    def start(self, rundir, resume=False, log_function=None, output_path=None, checksum=None):
+        # Everything is sent, so there is nothing to compare by checksum.
+        if resume:
+            raise ValueError("%s backend cannot resume a copy" % self.NAME)
+        # Match the permissions the rsync backend sets with --chmod.
+        untar_cmd = 'mkdir -p %s && tar -C %s -x -f - && chmod -R ug=rwX,o=rX %s' % (
+            quote_dest_arg(self.dest_run_root), quote_dest_arg(self.dest_run_root),
+            quote_dest_arg(self.get_dest_path(rundir)))
+        output = self.open_output(output_path)
+        producer = subprocess.Popen(self.get_tar_command(rundir),
+                                    stdout=subprocess.PIPE, stderr=output)
+        consumer = subprocess.Popen(['ssh', '-l', self.dest_user, self.dest_host, untar_cmd],
+                                    stdin=producer.stdout, stdout=self.log_file, stderr=self.log_file)
+        # Only the consumer should hold the read end of the pipe, so tar sees SIGPIPE if ssh dies.
+        producer.stdout.close()
+        copy_proc = PipelineProcess(producer, consumer)
+        if output_path is None:
+            reader = TarProgressReader(producer.stderr, rundir.get_root(), log_function=log_function)
+            reader.start()
+            return (copy_proc, reader.progress)
+        output.close()
+        return (copy_proc, self.follow_output(rundir, copy_proc, output_path, log_function))
+
+    def follow_output(self, rundir, copy_proc, output_path, log_function=None):
+        # tar writes the file list; it is done when the producer (first pid) exits.
+        reader = TarProgressReader(open(output_path), rundir.get_root(), log_function=log_function,
+                                   writer_alive=lambda: is_process_alive(copy_proc.pids[0]))
+        reader.start()
+        return reader.progress
+
+BACKENDS = dict((backend.NAME, backend) for backend in (RsyncBackend, TarSshBackend, LocalBackend))
+
+def get_backend_class(name):
+    if name not in BACKENDS:
+        raise ValueError("Unknown transfer backend %s. Valid backends are %s" % (name, sorted(BACKENDS.keys())))
+    return BACKENDS[name]
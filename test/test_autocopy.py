@@ -2,6 +2,7 @@
 
 DEBUG=True
 
+import datetime
 import grp
 import os
 import pwd
@@ -9,6 +10,7 @@ import re
 import shutil
 import sys
 import tempfile
+import time
 
 if sys.version_info[0:2] == (2, 6):
     import unittest2 as unittest
@@ -19,6 +21,9 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
 from bin.autocopy import Autocopy
 from bin.autocopy import ValidationError
 from bin.rundir import RunDir
+from bin.copy_progress import CopyProgress
+from bin import disk_usage
+from bin.eviction import EvictionCandidate
 
 class CopyProcHelper:
     # This can be assigned to Rundir.copyproc
@@ -58,6 +63,8 @@ class TestAutocopy(unittest.TestCase):
     def testOptionsLogfile(self):
         a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
         self.assertEqual(a.LOG_FILE.name, self.tmp_file.name)
+        # No event log unless EVENT_LOG_FILE is set
+        self.assertEqual(a.event_log.path, None)
         a.cleanup()
 
     def testOptionsCopyOnly(self):
@@ -141,9 +148,22 @@ class TestAutocopy(unittest.TestCase):
         a.log_processing_dir(rundir)
         a.log_start_copy(rundir)
         a.log_lims_error(error)
+        a.log_lims_batch(10, 9)
+        a.log_lims_breaker_state('closed', 'open')
+        a.log_event_held('subject', 'digest')
         a.log_connecting_to_mail_server()
         a.log_lost_smtp_connection()
-        a.log_reached_copy_processes_max(rundir)    
+        a.log_reached_copy_processes_max(rundir)
+        a.log_enqueue_copy(rundir)
+        a.log_restart_copy(rundir, 'reason')
+        a.log_dispatch_finalize(rundir)
+        a.log_finalize_state(rundir)
+        a.log_waiting_for_manifest(rundir)
+        a.log_verifying_manifest(rundir)
+        a.log_manifest_status(rundir)
+        a.log_adopt_copy(rundir, [123, 456])
+        a.log_resume_interrupted_copy(rundir)
+        a.log_adopted_copy_exited(rundir)
         a.log_creating_copy_complete_sentinel_file(rundir, 'filename')
 
     def testLIMSConnection(self):
@@ -181,6 +201,12 @@ class TestAutocopy(unittest.TestCase):
         a.send_email_missing_rundir(rundir)
         a.send_email_low_freespace(runroot, dummy_disk_usage)
         a.send_email_rundirs_monitored_summary()
+        a.send_email_finalize_failed(rundir, 'Traceback')
+        a.send_email_lims_unavailable()
+        a.send_email_event_digest()
+        candidate = EvictionCandidate(runroot, rundir.get_path())
+        a.send_email_run_evicted(candidate, 'sizes of 10 files match')
+        a.send_email_eviction_refused(candidate, 'copy complete sentinel missing at the destination')
         a.cleanup()
 
     # --------------- GENERAL UNIT TESTS -----------------
@@ -195,6 +221,102 @@ class TestAutocopy(unittest.TestCase):
         self.assertFalse(a.is_rundir_aborted(lims_runinfo))
         a.cleanup()
 
+    def testExportMetrics(self):
+        metrics_file = os.path.join(self.run_root, 'autocopy.prom')
+        self.config.update({'METRICS_TEXTFILE': metrics_file})
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        a.export_metrics()
+        self.assertEqual(sum(a.metric_rundirs.values.values()), 1)
+        self.assertTrue(a.metric_free_bytes.get(run_root=self.run_root) > 0)
+        with open(metrics_file) as f:
+            self.assertIn('autocopy_copy_processes 0', f.read())
+        a.cleanup()
+
+    def testMetricsServerClosed(self):
+        self.config.update({'METRICS_PORT': 0})
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        port = a.metrics_server.server_address[1]
+        a.cleanup()
+        # The port is free again for the next Autocopy.
+        self.config.update({'METRICS_PORT': port})
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        self.assertEqual(a.metrics_server.server_address[1], port)
+        a.cleanup()
+
+    def testDebugCommands(self):
+        self.config.update({'PROFILE_DIR': self.run_root,
+                            'DEBUG_CONTROL_FILE': os.path.join(self.run_root, 'autocopy.debug')})
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.handle_debug_command(['stacks'])
+        a.handle_debug_command(['profile', 'two'])
+        self.assertFalse(a.loop_profiler.is_active())
+        a.handle_debug_command(['profile', '1'])
+        self.assertTrue(a.loop_profiler.is_active())
+        a.loop_profiler.profile(a._main)
+        self.assertEqual(len([name for name in os.listdir(self.run_root) if name.startswith('autocopy_profile_')]), 2)
+        a.cleanup()
+
+    def testRecordCopyHistory(self):
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        rundir = a.get_rundir(dirname=self.test_run_name)
+        rundir.copy_start_time = datetime.datetime.now() - datetime.timedelta(hours=2)
+        rundir.copy_end_time = datetime.datetime.now()
+        rundir.copy_restarts = 1
+        a.record_copy_history(rundir, 1.5)
+        (row,) = a.copy_history.get_copies()
+        self.assertEqual(row['run'], self.test_run_name)
+        self.assertEqual(row['instrument'], 'MONK')
+        self.assertEqual(row['bytes'], int(1.5 * a.ONEGIG))
+        self.assertAlmostEqual(row['seconds'], 7200, places=0)
+        self.assertEqual(row['restarts'], 1)
+        a.cleanup()
+
+    def testUpdateCapacityForecast(self):
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        self.assertTrue(a.is_time_for_capacity_sample())
+        a.update_capacity_forecast()
+        self.assertFalse(a.is_time_for_capacity_sample())
+        forecast = a.capacity_model.forecast(self.run_root)
+        self.assertTrue(forecast.free_bytes > 0)
+        self.assertIn('GB free', a.get_capacity_summary())
+        a.send_email_capacity_forecast(forecast)
+        a.cleanup()
+
+    def testInitializeEvictor(self):
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        self.assertEqual(a.evictor, None)
+        a.cleanup()
+        self.config.update({'EVICTION_ENABLED': True, 'EVICTION_ORDER': 'largest_first', 'EVICTION_START_FREE_SPACE': 0})
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        self.assertEqual(a.evictor.completed_dirs, {self.run_root: os.path.join(self.run_root, a.SUBDIR_COMPLETED)})
+        self.assertEqual(a.evictor.check_run_root(self.run_root), [])
+        a.cleanup()
+
+    def testGetRunInfoFromLimsCached(self):
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        rundir = a.get_rundir(dirname=self.test_run_name)
+        runinfo = a.get_runinfo_from_lims(rundir)
+        self.assertTrue(a.get_runinfo_from_lims(rundir) is runinfo)
+        self.assertFalse(a.get_runinfo_from_lims(rundir, refresh=True) is runinfo)
+        a.cleanup()
+
+    def testMissingFromLims(self):
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        self.assertFalse(a.is_missing_from_lims(self.run_root, self.test_run_name))
+        a.record_missing_from_lims(self.run_root, self.test_run_name)
+        self.assertTrue(a.is_missing_from_lims(self.run_root, self.test_run_name))
+        a.update_rundirs_monitored()
+        self.assertEqual(a.rundirs_monitored, [])
+        self.assertEqual(a.get_or_create_rundir(self.run_root, self.test_run_name), None)
+        # A new descriptor file means the run is looked up again.
+        os.utime(os.path.join(self.test_run_path, 'RunInfo.xml'), (0, 0))
+        self.assertFalse(a.is_missing_from_lims(self.run_root, self.test_run_name))
+        a.cleanup()
+
     def testIsRundirReadyForCopy(self):
         run_root = os.path.realpath(os.path.join(os.path.dirname(__file__), 'testdata', 'RunRoot0'))
         self.config.update({'COPY_SOURCE_RUN_ROOTS': [run_root]})
@@ -240,6 +362,25 @@ class TestAutocopy(unittest.TestCase):
         dest_path = os.path.join(run_root, a.SUBDIR_COMPLETED, dirname)
         self.assertFalse(os.path.exists(source_path))
         self.assertTrue(os.path.exists(dest_path))
+        self.assertFalse(os.path.abspath(source_path) in disk_usage.get_engine().cache)
+        a.cleanup()
+
+    def testDispatchCompletedRundir(self):
+        dirname=self.test_run_name
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        rundir = a.get_rundir(dirname=dirname)
+        lims_runinfo = a.get_runinfo_from_lims(rundir)
+        rundir.set_copy_proc_and_start_time(1)
+        a.dispatch_completed_rundir(rundir, lims_runinfo)
+        self.assertFalse(rundir.is_copying())
+        self.assertEqual(a.get_rundir_status(rundir), 'finalising')
+
+        a.finalizer.join()
+        a.collect_finalised_rundirs()
+        self.assertEqual(rundir.finalize_state, 'finalised')
+        self.assertFalse(rundir in a.rundirs_monitored)
+        self.assertTrue(os.path.exists(os.path.join(self.run_root, a.SUBDIR_COMPLETED, dirname)))
         a.cleanup()
 
     def testUpdateRundirsMonitored(self):
@@ -277,6 +418,39 @@ class TestAutocopy(unittest.TestCase):
         self.assertEqual(problems_found[0], 'Mismatched value "%s". Value in run directory: "%s". Value in LIMS: "%s"' % (field, rundirval, limsval))
         a.cleanup()
 
+    def testGetCopyStallReason(self):
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        rundir = RunDir(self.run_root, self.test_run_name)
+        rundir.set_copy_proc_and_start_time(CopyProcHelper(None))
+        rundir.copy_progress = CopyProgress()
+        self.assertEqual(a.get_copy_stall_reason(rundir), None)
+
+        # Nothing is transferred while rsync builds the file list; that isn't a stall.
+        rundir.copy_start_time -= datetime.timedelta(seconds=a.COPY_STALL_SECONDS + 1)
+        self.assertEqual(a.get_copy_stall_reason(rundir), None)
+
+        rundir.copy_progress.update({'bytes_transferred': 0})
+        self.assertEqual(a.get_copy_stall_reason(rundir), None)
+        rundir.copy_progress.last_bytes_time -= a.COPY_STALL_SECONDS + 1
+        self.assertTrue(a.get_copy_stall_reason(rundir))
+
+        # Without progress information, only the elapsed time counts.
+        rundir.copy_progress = None
+        self.assertEqual(a.get_copy_stall_reason(rundir), None)
+        rundir.copy_start_time -= datetime.timedelta(seconds=a.SECONDS_BEFORE_COPY_RESTART + 1)
+        self.assertTrue(a.get_copy_stall_reason(rundir))
+        a.cleanup()
+
+    def testCopyQueuePostponedAtMaxCopyProcesses(self):
+        a = Autocopy(no_copy=True, log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        rundir = a.get_rundir(dirname=self.test_run_name)
+        a.enqueue_ready_for_copy_rundir(rundir, None)
+        a.start_queued_copies()
+        self.assertTrue(rundir in a.copy_queue)
+        self.assertFalse(rundir.is_copying())
+        a.cleanup()
+
     def testStartCopy(self):
         run_name = '000000_RUNDIR_1234_ABCDEFG'
         source_run_root = os.path.join(self.run_root, 'source')
@@ -313,5 +487,56 @@ class TestAutocopy(unittest.TestCase):
         self.assertTrue(re.search("Hello", text))
         a.cleanup()
 
+    def testStartCopyLocalBackend(self):
+        run_name = '000000_RUNDIR_1234_ABCDEFG'
+        source_run_root = os.path.join(self.run_root, 'source')
+        source_rundir = os.path.join(source_run_root, run_name)
+        os.makedirs(os.path.join(source_rundir, 'Thumbnail_Images'))
+        testfile = 'test.txt'
+        with open(os.path.join(source_rundir, testfile), 'w') as f:
+            f.write("Hello")
+
+        dest_run_root = os.path.join(self.run_root, 'dest')
+        os.makedirs(dest_run_root)
+        config = {
+            'COPY_BACKEND': 'local',
+            'COPY_DEST_RUN_ROOT': dest_run_root,
+            'COPY_SOURCE_RUN_ROOTS': [source_run_root],
+        }
+
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=config, errors_to_terminal=DEBUG)
+        a.update_rundirs_monitored()
+        rundir = a.get_rundir(dirname=run_name)
+        a.start_copy(rundir)
+        self.assertEqual(rundir.copy_backend, 'local')
+        retcode = rundir.copy_proc.wait()
+        self.assertEqual(retcode, 0)
+        self.assertTrue(os.path.exists(os.path.join(dest_run_root, run_name, testfile)))
+        self.assertFalse(os.path.exists(os.path.join(dest_run_root, run_name, 'Thumbnail_Images')))
+
+        for i in range(100):
+            if a.is_copy_verified(rundir):
+                break
+            time.sleep(0.1)
+        self.assertTrue(rundir.manifest_verifier.is_ok())
+        self.assertTrue(os.path.exists(os.path.join(dest_run_root, run_name, 'Autocopy_manifest.%s' % a.manifest_algorithm)))
+
+        a.create_copy_complete_sentinel_file(rundir)
+        self.assertTrue(os.path.exists(os.path.join(dest_run_root, run_name, 'Autocopy_complete.txt')))
+        a.cleanup()
+
+    def testGetTransferBackend(self):
+        self.config.update({
+            'COPY_BACKEND_FIRST_COPY': 'tar_ssh',
+            'COPY_BACKEND_RULES': [['_SPENSER_', 'local']],
+        })
+        a = Autocopy(log_file=self.tmp_file.name, no_email=True, test_mode_lims=True, config=self.config, errors_to_terminal=DEBUG)
+        rundir = RunDir(self.run_root, self.test_run_name)
+        self.assertEqual(a.get_transfer_backend(rundir).NAME, 'tar_ssh')
+        # tar_ssh can't resume, so restarts fall back to rsync
+        self.assertEqual(a.get_transfer_backend(rundir, resume=True).NAME, 'rsync')
+        self.assertEqual(a.get_transfer_backend(RunDir(self.run_root, '150101_SPENSER_0001_000000000-ABCDE')).NAME, 'local')
+        a.cleanup()
+
 if __name__=='__main__':
     unittest.main()
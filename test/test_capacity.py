@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.capacity import CapacityModel
+
+GIG = 1024**3
+
+class TestCapacityModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = CapacityModel()
+
+    def testRunGrowth(self):
+        self.model.sample_run('/runs', 'run1', 10 * GIG, 10, 210, now=0)
+        growth = self.model.runs[('/runs', 'run1')]
+        # One sample: no rate yet, bytes per cycle from the average so far.
+        self.assertEqual(growth.get_write_rate(), None)
+        self.assertEqual(growth.get_bytes_per_cycle(), GIG)
+        self.model.sample_run('/runs', 'run1', 30 * GIG, 20, 210, now=1000)
+        self.assertEqual(growth.get_write_rate(), 20 * GIG / 1000.0)
+        self.assertEqual(growth.get_bytes_per_cycle(), 2 * GIG)
+        self.assertEqual(growth.get_remaining_bytes(), 190 * 2 * GIG)
+
+    def testUnknownCycles(self):
+        self.model.sample_run('/runs', 'run1', 10 * GIG, None, None, now=0)
+        self.model.sample_run('/runs', 'run1', 11 * GIG, None, None, now=100)
+        self.model.sample_root('/runs', 100 * GIG, 0)
+        forecast = self.model.forecast('/runs')
+        self.assertEqual(forecast.runs_unknown, 1)
+        self.assertEqual(forecast.remaining_bytes, 0)
+        self.assertAlmostEqual(forecast.get_seconds_to_full(), 100 * 100)
+
+    def testForecast(self):
+        self.assertEqual(self.model.forecast('/runs'), None)
+        for (name, other_root) in [('run1', '/runs'), ('run2', '/runs'), ('run3', '/other')]:
+            self.model.sample_run(other_root, name, 0, 0, 100, now=0)
+            self.model.sample_run(other_root, name, 36 * GIG, 10, 100, now=3600)
+        self.model.sample_root('/runs', 720 * GIG, 500 * GIG)
+        forecast = self.model.forecast('/runs')
+        self.assertEqual(forecast.runs, 2)
+        self.assertEqual(forecast.write_rate, 72 * GIG / 3600.0)
+        self.assertEqual(forecast.get_seconds_to_full(), 36000)
+        self.assertEqual(forecast.get_seconds_to_full(reclaim=True), 61000)
+        # Each run will write another 90 cycles at 3.6 GB per cycle.
+        self.assertAlmostEqual(forecast.remaining_bytes, 2 * 90 * 3.6 * GIG)
+        self.assertEqual(forecast.get_shortfall(), 0)
+        self.assertTrue(forecast.is_at_risk(12 * 3600))
+        self.assertFalse(forecast.is_at_risk(9 * 3600))
+        self.model.retain([('/runs', 'run1')])
+        self.assertEqual(self.model.forecast('/runs').runs, 1)
+
+    def testShortfall(self):
+        self.model.sample_run('/runs', 'run1', 0, 0, 100, now=0)
+        self.model.sample_run('/runs', 'run1', 10 * GIG, 10, 100, now=3600000)
+        self.model.sample_root('/runs', 50 * GIG, 0)
+        forecast = self.model.forecast('/runs')
+        # Slow enough not to fill within the horizon, but 90 GB more won't fit in 50.
+        self.assertTrue(forecast.get_seconds_to_full() > 12 * 3600)
+        self.assertAlmostEqual(forecast.get_shortfall(), 40 * GIG)
+        self.assertTrue(forecast.is_at_risk(12 * 3600))
+
+if __name__ == '__main__':
+    unittest.main()
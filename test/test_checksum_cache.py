@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.checksum_cache import ChecksumCache
+from bin import manifest
+from bin import rundir_utils
+
+class RunDirHelper:
+
+    def __init__(self, run_root):
+        self.run_root = run_root
+
+    def get_root(self):
+        return self.run_root
+
+class TestChecksumCache(unittest.TestCase):
+
+    def setUp(self):
+        self.run_root = tempfile.mkdtemp()
+        self.path = os.path.join(self.run_root, 'file.bcl')
+        with open(self.path, 'w') as f:
+            f.write('data')
+        self.cache = ChecksumCache.for_run_root(self.run_root)
+        self.hashed = []
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.run_root)
+
+    def hash_function(self, path, algorithm):
+        self.hashed.append(path)
+        return manifest.hash_file(path, algorithm)
+
+    def testHashedOnce(self):
+        digest = self.cache.hash_file(self.path, 'md5', self.hash_function)
+        self.assertEqual(self.cache.hash_file(self.path, 'md5', self.hash_function), digest)
+        self.assertEqual(self.hashed, [self.path])
+        # Another algorithm is another entry.
+        self.cache.hash_file(self.path, 'sha1', self.hash_function)
+        self.assertEqual(len(self.hashed), 2)
+
+    def testSurvivesRenameAndReopen(self):
+        digest = self.cache.hash_file(self.path, 'md5', self.hash_function)
+        self.cache.close()
+        new_path = os.path.join(self.run_root, 'moved.bcl')
+        os.rename(self.path, new_path)
+
+        self.cache = ChecksumCache.for_run_root(self.run_root)
+        self.assertEqual(self.cache.hash_file(new_path, 'md5', self.hash_function), digest)
+        self.assertEqual(self.hashed, [self.path])
+
+    def testModifiedFile(self):
+        self.cache.hash_file(self.path, 'md5', self.hash_function)
+        with open(self.path, 'w') as f:
+            f.write('other')
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(self.cache.hash_file(self.path, 'md5', self.hash_function),
+                         manifest.hash_file(self.path, 'md5'))
+        self.assertEqual(len(self.hashed), 2)
+
+    def testPrune(self):
+        self.cache.hash_file(self.path, 'md5', self.hash_function)
+        self.cache.prune(max_age_days=0)
+        self.assertEqual(self.cache.get(self.path, 'md5'), None)
+
+    def testNoWriteTransactionLeftOpen(self):
+        self.cache.hash_file(self.path, 'md5', self.hash_function)
+        self.cache.commit()
+        # A hit, a put and nothing written yet: another process can still write.
+        self.cache.hash_file(self.path, 'md5', self.hash_function)
+        self.cache.hash_file(self.path, 'sha1', self.hash_function)
+        other = sqlite3.connect(self.cache.db_path, timeout=0)
+        other.execute("BEGIN IMMEDIATE")
+        other.rollback()
+        (count,) = other.execute("SELECT COUNT(*) FROM checksums").fetchone()
+        self.assertEqual(count, 1)
+        self.cache.commit()
+        (count,) = other.execute("SELECT COUNT(*) FROM checksums").fetchone()
+        self.assertEqual(count, 2)
+        other.close()
+
+    def testTarMd5WhenCacheLocked(self):
+        self.cache.close()
+        other = sqlite3.connect(os.path.join(self.run_root, ChecksumCache.SUBDIR, ChecksumCache.FILENAME))
+        other.execute("BEGIN EXCLUSIVE")
+        timeout = ChecksumCache.TIMEOUT_SECONDS
+        ChecksumCache.TIMEOUT_SECONDS = 0
+        try:
+            md5 = rundir_utils.get_tar_md5(RunDirHelper(self.run_root), self.path)
+        finally:
+            ChecksumCache.TIMEOUT_SECONDS = timeout
+            other.rollback()
+            other.close()
+        self.assertEqual(md5, manifest.hash_file(self.path, 'md5'))
+        self.cache = ChecksumCache.for_run_root(self.run_root)
+
+    def testManifestUsesCache(self):
+        for i in range(2):
+            builder = manifest.ManifestBuilder(self.run_root, 'md5', threads=2, excludes=[ChecksumCache.SUBDIR],
+                                               checksum_cache=self.cache)
+            builder.run()
+        self.assertEqual(builder.digests.keys(), ['file.bcl'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
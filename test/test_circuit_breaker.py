@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.circuit_breaker import CircuitBreaker, CircuitOpenError, DeadlineExceededError, GuardedCaller
+
+class NotFound(Exception):
+    pass
+
+class FakeService:
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def lookup(self, key):
+        self.calls += 1
+        self.release.wait()
+        if self.fail:
+            raise IOError('service unavailable')
+        if key == 'missing':
+            raise NotFound(key)
+        return key.upper()
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = []
+        self.breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=60,
+                                      on_state_change=lambda old, new: self.changes.append((old, new)))
+
+    def testOpensAfterFailures(self):
+        now = time.time()
+        self.breaker.record_failure(now)
+        self.assertTrue(self.breaker.allow(now))
+        self.breaker.record_failure(now)
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow(now + 30))
+        self.assertEqual(self.changes, [(CircuitBreaker.CLOSED, CircuitBreaker.OPEN)])
+
+    def testSuccessResetsCount(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+
+    def testHalfOpen(self):
+        now = time.time()
+        self.breaker.record_failure(now)
+        self.breaker.record_failure(now)
+        # One trial call after the cool-down.
+        self.assertTrue(self.breaker.allow(now + 61))
+        self.assertFalse(self.breaker.allow(now + 61))
+        self.breaker.record_failure(now + 61)
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow(now + 90))
+        self.assertTrue(self.breaker.allow(now + 122))
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+        self.assertEqual(self.changes[-1], (CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED))
+
+class TestGuardedCaller(unittest.TestCase):
+
+    def setUp(self):
+        self.service = FakeService()
+        self.caller = GuardedCaller(workers=2, timeout_seconds=0.2,
+                                    breaker=CircuitBreaker(failure_threshold=2, cooldown_seconds=60),
+                                    is_failure=lambda error: not isinstance(error, NotFound))
+
+    def tearDown(self):
+        self.service.release.set()
+
+    def testCall(self):
+        self.assertEqual(self.caller.call(self.service.lookup, 'run'), 'RUN')
+        with self.assertRaises(NotFound):
+            self.caller.call(self.service.lookup, 'missing')
+        self.assertEqual(self.caller.breaker.failures, 0)
+
+    def testDeadlineAndOpen(self):
+        self.service.release.clear()
+        start = time.time()
+        for i in range(2):
+            with self.assertRaises(DeadlineExceededError):
+                self.caller.call(self.service.lookup, 'run')
+        self.assertTrue(time.time() - start < 1)
+        # Now open: fails at once, without calling the service.
+        calls = self.service.calls
+        with self.assertRaises(CircuitOpenError):
+            self.caller.call(self.service.lookup, 'run')
+        self.assertEqual(self.service.calls, calls)
+
+    def testCallMany(self):
+        outcomes = self.caller.call_many(self.service.lookup, ['run1', 'run2', 'missing'])
+        self.assertEqual(outcomes['run1'], ('RUN1', None))
+        self.assertEqual(outcomes['run2'], ('RUN2', None))
+        self.assertTrue(isinstance(outcomes['missing'][1], NotFound))
+
+    def testCallManyDeadline(self):
+        self.service.release.clear()
+        outcomes = self.caller.call_many(self.service.lookup, ['run%d' % i for i in range(6)])
+        self.assertTrue(all(isinstance(error, DeadlineExceededError) for (value, error) in outcomes.values()))
+        # One failure for the whole batch.
+        self.assertEqual(self.caller.breaker.failures, 1)
+
+    def testOnResult(self):
+        results = []
+        self.caller.on_result = lambda name, seconds, error: results.append((name, error.__class__))
+        self.caller.call(self.service.lookup, 'run')
+        self.caller.call_many(self.service.lookup, ['missing'])
+        self.assertEqual(results, [('lookup', None.__class__), ('lookup', NotFound)])
+
+if __name__ == '__main__':
+    unittest.main()
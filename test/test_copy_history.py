@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin import copy_history
+from bin.copy_history import CopyHistory
+
+GIG = 1024**3
+
+class TestCopyHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, CopyHistory.FILENAME)
+        self.history = CopyHistory(self.path)
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.dir)
+
+    def testRecord(self):
+        self.history.record(run='141117_MONK_0387_AC4JCDACXX', instrument='MONK', start_time=1000, end_time=4600,
+                            bytes=100 * GIG, bytes_transferred=36 * GIG, restarts=1, queue_wait_seconds=60)
+        with self.assertRaises(ValueError):
+            self.history.record(run='run', colour='blue')
+        (row,) = self.history.get_copies()
+        self.assertEqual(row['seconds'], 3600)
+        # Throughput is what was actually transferred.
+        self.assertEqual(row['bytes_per_second'], 36 * GIG / 3600.0)
+        self.assertTrue(self.history.has_run('141117_MONK_0387_AC4JCDACXX'))
+        self.assertFalse(self.history.has_run('other'))
+        # Still there when reopened
+        self.assertEqual(len(CopyHistory(self.path).get_copies()), 1)
+
+    def testAppendOnly(self):
+        self.history.record(run='run1', end_time=1)
+        with self.assertRaises(sqlite3.DatabaseError):
+            self.history.conn.execute("DELETE FROM copies")
+        with self.assertRaises(sqlite3.DatabaseError):
+            self.history.conn.execute("UPDATE copies SET run = 'run2'")
+        self.assertEqual([row['run'] for row in self.history.get_copies()], ['run1'])
+
+    def testRecordFromThreads(self):
+        threads = [threading.Thread(target=self.history.record, kwargs={'run': 'run%d' % i, 'end_time': i}) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.history.get_copies(since=2, until=6)), 4)
+
+    def testPercentile(self):
+        self.assertEqual(copy_history.percentile([], 0.5), None)
+        self.assertEqual(copy_history.percentile([5], 0.9), 5)
+        self.assertEqual(copy_history.percentile([4, 1, 3, 2, None], 0.5), 2.5)
+        self.assertEqual(copy_history.percentile(range(11), 0.9), 9)
+        self.assertEqual(copy_history.get_instrument('141117_MONK_0387_AC4JCDACXX'), 'MONK')
+
+    def testReport(self):
+        january = time.mktime((2015, 1, 15, 12, 0, 0, 0, 0, -1))
+        february = time.mktime((2015, 2, 15, 12, 0, 0, 0, 0, -1))
+        for (instrument, end_time, hours) in [('MONK', january, 1), ('MONK', january, 3), ('MONK', february, 2), ('SPENSER', january, 4)]:
+            self.history.record(run='run', instrument=instrument, start_time=end_time - hours * 3600, end_time=end_time,
+                                bytes=hours * 100 * GIG)
+        summaries = copy_history.summarize(self.history.get_copies(), ['instrument', 'month'])
+        self.assertEqual([key for (key, summary) in summaries],
+                         [('MONK', '2015-01'), ('MONK', '2015-02'), ('SPENSER', '2015-01')])
+        monk_january = summaries[0][1]
+        self.assertEqual(monk_january['copies'], 2)
+        self.assertEqual(monk_january['hours_p50'], 2)
+        self.assertEqual(monk_january['hours_max'], 3)
+        self.assertAlmostEqual(monk_january['mb_per_second_p50'], 100 * 1024 / 3600.0)
+        report = copy_history.format_report(summaries, ['instrument', 'month']).splitlines()
+        self.assertEqual(report[0].split('\t')[0:3], ['instrument', 'month', 'copies'])
+        self.assertEqual(report[1].split('\t')[0:3], ['MONK', '2015-01', '2'])
+
+if __name__ == '__main__':
+    unittest.main()
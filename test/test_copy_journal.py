@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.copy_journal import CopyJournal, AdoptedProcess
+from bin.copy_progress import read_chunks
+from bin.rundir import RunDir
+
+class TestCopyJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.run_root = tempfile.mkdtemp()
+        self.rundir = RunDir(self.run_root, '141117_MONK_0387_AC4JCDACXX')
+        self.procs = []
+
+    def tearDown(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        shutil.rmtree(self.run_root)
+
+    def start_process(self):
+        proc = subprocess.Popen(['sleep', '60'])
+        self.procs.append(proc)
+        return proc
+
+    def testRecordAndReload(self):
+        proc = self.start_process()
+        journal = CopyJournal(self.run_root)
+        journal.record_start(self.rundir, proc, 'rsync', False)
+
+        entry = CopyJournal(self.run_root).get_entry(self.rundir)
+        self.assertEqual(entry['pids'], [proc.pid])
+        self.assertEqual(entry['backend'], 'rsync')
+        self.assertEqual(entry['commands'], ['sleep 60'])
+        # Only the journal file is left, no temp files.
+        self.assertEqual(os.listdir(journal.dir), [CopyJournal.FILENAME])
+
+    def testRecordEnd(self):
+        proc = self.start_process()
+        journal = CopyJournal(self.run_root)
+        journal.record_start(self.rundir, proc, 'rsync', False)
+        with open(journal.get_output_path(self.rundir), 'w') as f:
+            f.write('output')
+        journal.record_end(self.rundir)
+
+        self.assertEqual(CopyJournal(self.run_root).get_entry(self.rundir), None)
+        self.assertFalse(os.path.exists(journal.get_output_path(self.rundir)))
+
+    def testEntryRunning(self):
+        proc = self.start_process()
+        journal = CopyJournal(self.run_root)
+        journal.record_start(self.rundir, proc, 'rsync', False)
+        entry = journal.get_entry(self.rundir)
+        self.assertTrue(journal.is_entry_running(entry))
+
+        # Same pid running something else, e.g. after pid reuse.
+        entry['commands'] = ['rsync -rlptc /runs/x crick:/dest']
+        self.assertFalse(journal.is_entry_running(entry))
+
+        entry = journal.get_entry(self.rundir)
+        proc.kill()
+        proc.wait()
+        entry['commands'] = ['sleep 60']
+        self.assertFalse(journal.is_entry_running(entry))
+
+    def testUnreadableJournal(self):
+        journal = CopyJournal(self.run_root)
+        with open(journal.path, 'w') as f:
+            f.write('{"141117_MONK_0387_AC4JCDACXX": ')
+        self.assertEqual(CopyJournal(self.run_root).entries, {})
+
+    def testAdoptedProcess(self):
+        # The orphan is not our child once its parent (the shell) exits.
+        shell = subprocess.Popen(['sh', '-c', 'sleep 60 >/dev/null 2>&1 & echo $!'], stdout=subprocess.PIPE)
+        pid = int(shell.stdout.readline())
+        shell.wait()
+
+        proc = AdoptedProcess([pid])
+        self.assertEqual(proc.poll(), None)
+        proc.kill()
+        self.assertEqual(proc.wait(poll_seconds=0.1), AdoptedProcess.RETCODE_UNKNOWN)
+
+    def testFollowOutput(self):
+        output_path = os.path.join(self.run_root, 'output')
+        with open(output_path, 'w') as output:
+            proc = subprocess.Popen(['sh', '-c', 'echo one; sleep 1; echo two'], stdout=output)
+        self.procs.append(proc)
+
+        # Output written after the first EOF is still read, until the writer exits.
+        with open(output_path) as f:
+            chunks = list(read_chunks(f, writer_alive=lambda: proc.poll() is None, follow_interval=0.1))
+        self.assertEqual(''.join(chunks), 'one\ntwo\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.copy_progress import CopyProgress, RsyncProgressReader, parse_progress_line
+
+class TestCopyProgress(unittest.TestCase):
+
+    def testParseProgressLine(self):
+        progress = parse_progress_line('  1,238,099,968  45%   45.67MB/s    0:01:23 (xfr#1234, to-chk=100/2000)')
+        self.assertEqual(progress['bytes_transferred'], 1238099968)
+        self.assertEqual(progress['percent'], 45)
+        self.assertAlmostEqual(progress['rate'], 45.67 * 1024 * 1024)
+        self.assertEqual(progress['eta_seconds'], 83)
+        self.assertEqual(progress['files_transferred'], 1234)
+        self.assertEqual(progress['files_total'], 2000)
+
+    def testParseProgressLineWithoutTransfers(self):
+        progress = parse_progress_line('              0   0%    0.00kB/s    0:00:00')
+        self.assertEqual(progress['bytes_transferred'], 0)
+        self.assertFalse('files_transferred' in progress)
+
+    def testParseNonProgressLine(self):
+        self.assertEqual(parse_progress_line('sending incremental file list'), None)
+
+    def testReader(self):
+        (read_fd, write_fd) = os.pipe()
+        output = ('      1,024  10%  1.00kB/s    0:00:09 (xfr#1, to-chk=9/10)\r'
+                  '      4,096 100%  2.00kB/s    0:00:00 (xfr#10, to-chk=0/10)\n'
+                  '\n'
+                  'Number of regular files transferred: 10\n'
+                  'Total transferred file size: 4,000 bytes\n')
+        os.write(write_fd, output)
+        os.close(write_fd)
+
+        logged = []
+        reader = RsyncProgressReader(os.fdopen(read_fd), log_function=logged.append)
+        reader.start()
+        reader.join(5)
+
+        snapshot = reader.progress.get_snapshot()
+        self.assertTrue(snapshot['finished'])
+        self.assertEqual(snapshot['files_transferred'], 10)
+        self.assertEqual(snapshot['bytes_transferred'], 4000)
+        self.assertEqual(snapshot['percent'], 100)
+        self.assertEqual(len(logged), 2)
+
+    def testRateOver(self):
+        progress = CopyProgress()
+        start = progress.start_time
+        progress.update({'bytes_transferred': 1000}, now=start + 10)
+        progress.update({'bytes_transferred': 2000}, now=start + 20)
+        self.assertEqual(progress.get_rate_over(10, now=start + 20), 100.0)
+        self.assertEqual(progress.get_rate_over(30, now=start + 20), None)
+
+    def testSecondsSinceBytes(self):
+        progress = CopyProgress()
+        start = progress.start_time
+        # The clock starts at the first progress line.
+        self.assertEqual(progress.get_seconds_since_bytes(now=start + 5), None)
+        progress.update({'bytes_transferred': 1000}, now=start + 10)
+        progress.update({'bytes_transferred': 1000}, now=start + 50)
+        self.assertEqual(progress.get_seconds_since_bytes(now=start + 60), 50)
+
+    def testSummary(self):
+        progress = CopyProgress()
+        progress.update({'bytes_transferred': 1024**3, 'percent': 50, 'files_transferred': 5, 'files_total': 10})
+        self.assertEqual(progress.get_summary(), '50% 1.0 GB 5/10 files')
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.copy_queue import CopyQueue
+
+class RunDirHelper:
+    # Stands in for rundir.RunDir with fixed values for the sort keys.
+
+    def __init__(self, name, finished_time, size_estimate=0, machine='MONK', root='/runs'):
+        self.name = name
+        self.finished_time = finished_time
+        self.size_estimate = size_estimate
+        self.machine = machine
+        self.root = root
+
+    def get_root(self):
+        return self.root
+
+    def get_path(self):
+        return os.path.join(self.root, self.name)
+
+    def get_finished_time(self):
+        return self.finished_time
+
+    def get_size_estimate(self):
+        return self.size_estimate
+
+    def get_machine(self):
+        return self.machine
+
+class RunInfoHelper:
+
+    def __init__(self, priority):
+        self.priority = priority
+
+    def get_priority(self):
+        return self.priority
+
+class TestCopyQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.hiseq_old = RunDirHelper('hiseq_old', finished_time=100, size_estimate=600, machine='MONK')
+        self.hiseq_new = RunDirHelper('hiseq_new', finished_time=200, size_estimate=600, machine='MONK')
+        self.miseq = RunDirHelper('miseq', finished_time=300, size_estimate=5, machine='SPENSER')
+
+    def fill(self, queue, runinfos=None):
+        if runinfos is None:
+            runinfos = {}
+        for rundir in (self.miseq, self.hiseq_new, self.hiseq_old):
+            queue.add(rundir, runinfos.get(rundir.name))
+
+    def testInvalidPolicy(self):
+        with self.assertRaises(ValueError):
+            CopyQueue('random')
+
+    def testOldestFinished(self):
+        queue = CopyQueue(CopyQueue.POLICY_OLDEST_FINISHED)
+        self.fill(queue)
+        self.assertEqual(queue.pop_next().rundir, self.hiseq_old)
+        self.assertEqual(queue.pop_next().rundir, self.hiseq_new)
+        self.assertEqual(queue.pop_next().rundir, self.miseq)
+        self.assertEqual(queue.pop_next(), None)
+
+    def testSmallestFirst(self):
+        queue = CopyQueue(CopyQueue.POLICY_SMALLEST_FIRST)
+        self.fill(queue)
+        self.assertEqual(queue.pop_next().rundir, self.miseq)
+        self.assertEqual(queue.pop_next().rundir, self.hiseq_old)
+
+    def testPressuredRootFirst(self):
+        queue = CopyQueue(CopyQueue.POLICY_OLDEST_FINISHED)
+        self.fill(queue)
+        filling = RunDirHelper('filling', finished_time=400, root='/runs2')
+        queue.add(filling)
+        queue.set_pressured_roots(['/runs2'])
+        self.assertEqual([r.name for r in queue.get_rundirs()], ['filling', 'hiseq_old', 'hiseq_new', 'miseq'])
+        queue.set_pressured_roots([])
+        self.assertEqual(queue.get_rundirs()[-1], filling)
+
+    def testLimsPriority(self):
+        queue = CopyQueue(CopyQueue.POLICY_LIMS_PRIORITY)
+        self.fill(queue, {'hiseq_new': RunInfoHelper(5), 'miseq': RunInfoHelper(1)})
+        self.assertEqual([r.name for r in queue.get_rundirs()], ['hiseq_new', 'miseq', 'hiseq_old'])
+
+    def testInstrumentFair(self):
+        queue = CopyQueue(CopyQueue.POLICY_INSTRUMENT_FAIR)
+        self.fill(queue)
+        copying = [RunDirHelper('hiseq_copying', finished_time=0, machine='MONK')]
+        self.assertEqual(queue.pop_next(copying).rundir, self.miseq)
+
+    def testWaitTimeKeptAcrossPasses(self):
+        queue = CopyQueue()
+        queue.add(self.miseq)
+        enqueued_time = queue.entries[self.miseq.get_path()].enqueued_time
+        queue.add(self.miseq)
+        self.assertEqual(queue.entries[self.miseq.get_path()].enqueued_time, enqueued_time)
+        self.assertTrue(queue.get_wait_seconds(self.miseq) >= 0)
+
+    def testRetain(self):
+        queue = CopyQueue()
+        self.fill(queue)
+        queue.retain([self.miseq])
+        self.assertEqual(len(queue), 1)
+        self.assertTrue(self.miseq in queue)
+        self.assertFalse(self.hiseq_old in queue)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.disk_usage import DiskUsage
+
+class TestDiskUsage(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for lane in range(1, 5):
+            for cycle in range(1, 4):
+                cycle_dir = os.path.join(self.root, 'Data', 'Intensities', 'BaseCalls', 'L%03d' % lane, 'C%d.1' % cycle)
+                os.makedirs(cycle_dir)
+                for tile in range(1, 3):
+                    self.write(os.path.join(cycle_dir, 's_%d_%d.bcl' % (lane, tile)), 10000)
+        os.symlink('Data', os.path.join(self.root, 'link'))
+        self.engine = DiskUsage(threads=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, size):
+        with open(path, 'w') as f:
+            f.write('x' * size)
+
+    def du(self):
+        du_stdout = subprocess.Popen(['du', '-s', '-B1', self.root], stdout=subprocess.PIPE).communicate()[0]
+        return int(du_stdout.split()[0])
+
+    def testMatchesDu(self):
+        self.assertEqual(self.engine.get_usage(self.root), self.du())
+
+    def testCache(self):
+        self.engine.get_usage(self.root)
+        listed = self.engine.listed
+        self.engine.get_usage(self.root)
+        self.assertEqual(self.engine.listed, listed)
+
+        # Adding a file re-lists only its directory.
+        self.write(os.path.join(self.root, 'Data', 'Intensities', 'BaseCalls', 'L001', 'C1.1', 'new.bcl'), 50000)
+        self.assertEqual(self.engine.get_usage(self.root), self.du())
+        self.assertEqual(self.engine.listed, listed + 1)
+
+    def testRefresh(self):
+        self.engine.get_usage(self.root)
+        # Growing a file in place doesn't change its directory's mtime.
+        path = os.path.join(self.root, 'Data', 'Intensities', 'BaseCalls', 'L001', 'C1.1', 's_1_1.bcl')
+        st = os.stat(os.path.dirname(path))
+        self.write(path, 100000)
+        os.utime(os.path.dirname(path), (st.st_atime, st.st_mtime))
+        self.assertEqual(self.engine.get_usage(self.root, refresh=True), self.du())
+
+    def testForget(self):
+        self.engine.get_usage(self.root)
+        self.engine.forget(os.path.join(self.root, 'Data'))
+        self.assertEqual(self.engine.cache.keys(), [self.root])
+
+    def testRemovedSubdirForgotten(self):
+        self.engine.get_usage(self.root)
+        basecalls = os.path.join(self.root, 'Data', 'Intensities', 'BaseCalls')
+        shutil.rmtree(os.path.join(basecalls, 'L001'))
+        self.assertEqual(self.engine.get_usage(self.root), self.du())
+        self.assertEqual([path for path in self.engine.cache.keys() if path.startswith(os.path.join(basecalls, 'L001'))], [])
+
+if __name__ == '__main__':
+    unittest.main()
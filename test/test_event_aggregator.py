@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.event_aggregator import EventAggregator, URGENT, NORMAL, LOW, SEND, DIGEST, SUPPRESS
+
+class TestEventAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.aggregator = EventAggregator(dedupe_seconds=100, rate_limit=2, rate_limit_seconds=10)
+
+    def testDedupe(self):
+        self.assertEqual(self.aggregator.submit('exception', URGENT, 'tb', 'Exception', 'body', now=0), SEND)
+        self.assertEqual(self.aggregator.submit('exception', URGENT, 'tb', 'Exception', 'body', now=50), SUPPRESS)
+        self.assertEqual(self.aggregator.submit('exception', URGENT, 'tb', 'Exception', 'body', now=60), SUPPRESS)
+        self.assertEqual(self.aggregator.submit('exception', URGENT, 'other', 'Exception', 'body', now=60), SEND)
+        self.assertEqual(self.aggregator.submit('exception', URGENT, 'tb', 'Exception', 'body', now=100), SEND)
+        (held, repeats) = self.aggregator.pop_digest(now=100)
+        self.assertEqual(held, [])
+        self.assertEqual([(entry.subject, entry.count) for entry in repeats], [('Exception', 2)])
+
+    def testNoKeyIsNeverARepeat(self):
+        for i in range(3):
+            self.assertEqual(self.aggregator.submit('started', URGENT, None, 'Started', 'body', now=i), SEND)
+
+    def testRateLimit(self):
+        actions = [self.aggregator.submit('copy_complete', NORMAL, None, 'Done %d' % i, 'body', now=i) for i in range(4)]
+        self.assertEqual(actions, [SEND, SEND, DIGEST, DIGEST])
+        # Other types have their own limit, and urgent events have none.
+        self.assertEqual(self.aggregator.submit('aborted', NORMAL, 'run1', 'Aborted', 'body', now=4), SEND)
+        self.assertEqual(self.aggregator.submit('copy_failed', URGENT, 'run1', 'Failed', 'body', now=4), SEND)
+        self.assertEqual(self.aggregator.submit('copy_complete', NORMAL, None, 'Done', 'body', now=11), SEND)
+        self.assertEqual([entry.subject for entry in self.aggregator.pop_digest(now=11)[0]], ['Done 2', 'Done 3'])
+
+    def testLowGoesToDigest(self):
+        self.assertEqual(self.aggregator.submit('not_in_lims', LOW, 'run1', 'Not in LIMS', 'body', now=0), DIGEST)
+        self.assertEqual(self.aggregator.submit('not_in_lims', LOW, 'run1', 'Not in LIMS', 'body', now=1), SUPPRESS)
+        self.assertEqual(self.aggregator.get_digest_size(), 2)
+        (held, repeats) = self.aggregator.pop_digest(now=1)
+        self.assertEqual(len(held), 1)
+        self.assertEqual(held[0].body, 'body')
+        self.assertEqual(len(repeats), 1)
+        self.assertEqual(self.aggregator.get_digest_size(), 0)
+        # Still a repeat after the digest, until the dedupe window has passed.
+        self.assertEqual(self.aggregator.submit('not_in_lims', LOW, 'run1', 'Not in LIMS', 'body', now=50), SUPPRESS)
+        self.aggregator.pop_digest(now=150)
+        self.assertEqual(self.aggregator.submit('not_in_lims', LOW, 'run1', 'Not in LIMS', 'body', now=150), DIGEST)
+
+    def testSummaryWhileLocked(self):
+        # As when SIGUSR1 arrives while the main thread is in submit().
+        with self.aggregator.lock:
+            self.aggregator.submit('not_in_lims', LOW, 'run1', 'Not in LIMS', 'body', now=0)
+            self.assertEqual(len(self.aggregator.pop_digest(now=0)[0]), 1)
+
+    def testUnknownSeverity(self):
+        with self.assertRaises(ValueError):
+            self.aggregator.submit('exception', 'critical', None, 'subject', 'body')
+
+if __name__ == '__main__':
+    unittest.main()
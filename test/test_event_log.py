@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.event_log import EventLog
+
+class TestEventLog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, EventLog.FILENAME)
+        self.logged = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_event_log(self, **kwargs):
+        return EventLog(self.path, flush_seconds=0.05, log_function=self.logged.append, **kwargs)
+
+    def read_events(self, path=None):
+        with open(path or self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def testWriteAndTimed(self):
+        event_log = self.make_event_log()
+        event_log.start()
+        event_log.write('started', loop=0)
+        with event_log.timed('scan', loop=1):
+            time.sleep(0.01)
+        with self.assertRaises(IOError):
+            with event_log.timed('lims_lookup', loop=1, run='run1'):
+                raise IOError('LIMS unavailable')
+        event_log.close()
+        events = self.read_events()
+        self.assertEqual([event['event'] for event in events], ['started', 'phase', 'phase'])
+        self.assertEqual(events[1]['phase'], 'scan')
+        self.assertTrue(events[1]['seconds'] >= 0.01)
+        self.assertNotIn('error', events[1])
+        self.assertEqual(events[2]['run'], 'run1')
+        self.assertIn('LIMS unavailable', events[2]['error'])
+        self.assertEqual(events[2]['pid'], os.getpid())
+
+    def testBuffered(self):
+        event_log = EventLog(self.path, flush_seconds=60)
+        event_log.start()
+        event_log.write('one')
+        time.sleep(0.1)
+        self.assertFalse(os.path.exists(self.path))
+        event_log.close()
+        self.assertEqual(len(self.read_events()), 1)
+
+    def testRotateBySize(self):
+        event_log = self.make_event_log(max_bytes=200, backups=2)
+        for i in range(4):
+            event_log.write_lines([json.dumps({'time': time.time(), 'event': 'e', 'padding': 'x' * 150})], time.time())
+        event_log.close_file()
+        self.assertEqual(len(self.read_events()), 1)
+        self.assertEqual(len(self.read_events(self.path + '.1')), 1)
+        self.assertEqual(len(self.read_events(self.path + '.2')), 1)
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def testRotateByAge(self):
+        now = time.time()
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'time': now - 100, 'event': 'old'}) + '\n')
+        event_log = self.make_event_log(rotate_seconds=50)
+        event_log.write_lines([json.dumps({'time': now, 'event': 'first'})], now)
+        # The file's age comes from its first event, so this one goes in a new file.
+        event_log.write_lines([json.dumps({'time': now, 'event': 'second'})], now)
+        event_log.close_file()
+        self.assertEqual([event['event'] for event in self.read_events(self.path + '.1')], ['old', 'first'])
+        self.assertEqual([event['event'] for event in self.read_events()], ['second'])
+
+    def testDisabledAndFull(self):
+        event_log = EventLog(None)
+        event_log.start()
+        event_log.write('ignored')
+        event_log.close()
+        event_log = EventLog(self.path, max_queued=1)
+        event_log.write('one')
+        event_log.write('two')
+        self.assertEqual(event_log.dropped, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin import disk_usage
+from bin import eviction
+from bin.eviction import Evictor
+from bin.transfer import LocalBackend
+
+class TestEvictor(unittest.TestCase):
+
+    def setUp(self):
+        self.run_root = tempfile.mkdtemp()
+        self.completed_dir = os.path.join(self.run_root, 'Runs_Completed')
+        os.mkdir(self.completed_dir)
+        # Each run is 1 byte per file; free space goes up by 100 for every run gone.
+        self.runs = {'run_old': (1000, 3), 'run_big': (2000, 10), 'run_new': (3000, 1)}
+        for (name, (mtime, files)) in self.runs.items():
+            path = os.path.join(self.completed_dir, name)
+            os.makedirs(os.path.join(path, 'Data'))
+            for i in range(files):
+                with open(os.path.join(path, 'Data', 'file%d' % i), 'w') as f:
+                    f.write('x')
+            os.utime(path, (mtime, mtime))
+        self.unverified = set()
+        self.later = time.time() + 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.run_root)
+
+    def get_free_bytes(self, run_root):
+        return 100 * (len(self.runs) - len(self.get_remaining()))
+
+    def get_remaining(self):
+        return sorted(name for name in os.listdir(self.completed_dir) if name in self.runs)
+
+    def verify(self, run_path):
+        if os.path.basename(run_path) in self.unverified:
+            return (False, 'not verified')
+        return (True, 'verified')
+
+    def get_bytes(self, run_path):
+        return self.runs[os.path.basename(run_path)][1]
+
+    def get_evictor(self, **kwargs):
+        args = {'start_free_bytes': 50, 'stop_free_bytes': 150, 'min_age_seconds': 100, 'files_per_second': 0}
+        args.update(kwargs)
+        return Evictor({self.run_root: self.completed_dir}, self.get_free_bytes, self.verify, get_bytes=self.get_bytes, **args)
+
+    def testOldestFirst(self):
+        evictor = self.get_evictor()
+        disk_usage.get_engine().get_usage(self.completed_dir)
+        # Stops once free space is back above the stop watermark.
+        self.assertEqual(evictor.check_run_root(self.run_root, now=self.later), ['run_old', 'run_big'])
+        self.assertEqual(self.get_remaining(), ['run_new'])
+        self.assertEqual(evictor.evicted, 2)
+        # Nothing is left cached for the runs that are gone.
+        self.assertEqual([path for path in disk_usage.get_engine().cache.keys()
+                          if path.startswith(os.path.join(self.completed_dir, 'run_old'))], [])
+        # Above the start watermark now, so nothing more goes.
+        self.assertEqual(evictor.check_run_root(self.run_root, now=self.later), [])
+
+    def testLargestFirst(self):
+        evictor = self.get_evictor(order=eviction.ORDER_LARGEST_FIRST, stop_free_bytes=50)
+        self.assertEqual(evictor.check_run_root(self.run_root, now=self.later), ['run_big'])
+
+    def testUnknownOrder(self):
+        self.assertRaises(ValueError, self.get_evictor, order='newest_first')
+
+    def testUnverifiedRunsKept(self):
+        self.unverified.add('run_old')
+        failed = []
+        evictor = self.get_evictor(on_failed=lambda candidate, reason: failed.append(candidate.name))
+        self.assertEqual(evictor.check_run_root(self.run_root, now=self.later), ['run_big', 'run_new'])
+        self.assertEqual(self.get_remaining(), ['run_old'])
+        self.assertEqual(failed, ['run_old'])
+        # Not verified again until it is moved again.
+        self.assertEqual(evictor.get_candidates(self.run_root, now=self.later), [])
+
+    def testRecentRunsKept(self):
+        evictor = self.get_evictor()
+        self.assertEqual(evictor.check_run_root(self.run_root), [])
+        self.assertEqual(self.get_remaining(), sorted(self.runs.keys()))
+
+    def testResumeEviction(self):
+        os.rename(os.path.join(self.completed_dir, 'run_new'), os.path.join(self.completed_dir, '.evicting_run_new'))
+        evictor = self.get_evictor(start_free_bytes=0)
+        self.assertEqual(evictor.check_run_root(self.run_root, now=self.later), [])
+        self.assertEqual(self.get_remaining(), ['run_big', 'run_old'])
+        self.assertFalse(os.path.exists(os.path.join(self.completed_dir, '.evicting_run_new')))
+
+    def testDeleteRateLimited(self):
+        evictor = self.get_evictor(files_per_second=50)
+        start = time.time()
+        evictor.delete_tree(os.path.join(self.completed_dir, 'run_big'))
+        self.assertTrue(time.time() - start >= 0.18)
+        self.assertFalse(os.path.exists(os.path.join(self.completed_dir, 'run_big')))
+
+class TestVerifyCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_name = '000000_RUNDIR_1234_ABCDEFG'
+        self.run_path = os.path.join(self.tmp_dir, 'source', self.run_name)
+        self.dest_path = os.path.join(self.tmp_dir, 'dest', self.run_name)
+        for path in [self.run_path, self.dest_path]:
+            os.makedirs(os.path.join(path, 'Data'))
+            with open(os.path.join(path, 'Data', 'test.txt'), 'w') as f:
+                f.write('Hello')
+        os.makedirs(os.path.join(self.run_path, 'Thumbnail_Images'))
+        with open(os.path.join(self.run_path, 'Thumbnail_Images', 'thumb.jpg'), 'w') as f:
+            f.write('not copied')
+        self.backend = LocalBackend(None, None, os.path.join(self.tmp_dir, 'dest'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def complete(self):
+        open(os.path.join(self.dest_path, eviction.COPY_COMPLETED_SENTINEL_FILENAME), 'w').close()
+
+    def testSizesMatch(self):
+        (ok, reason) = eviction.verify_copy(self.backend, self.run_path)
+        self.assertFalse(ok)
+        self.complete()
+        (ok, reason) = eviction.verify_copy(self.backend, self.run_path)
+        self.assertTrue(ok)
+        with open(os.path.join(self.dest_path, 'Data', 'test.txt'), 'w') as f:
+            f.write('Hell')
+        (ok, reason) = eviction.verify_copy(self.backend, self.run_path)
+        self.assertFalse(ok)
+        self.assertIn('Data/test.txt', reason)
+
+    def testManifestVerified(self):
+        self.complete()
+        eviction.write_verified_file(self.run_path, 'Autocopy_manifest.md5', 1)
+        (ok, reason) = eviction.verify_copy(self.backend, self.run_path)
+        self.assertFalse(ok)
+        open(os.path.join(self.dest_path, 'Autocopy_manifest.md5'), 'w').close()
+        (ok, reason) = eviction.verify_copy(self.backend, self.run_path)
+        self.assertTrue(ok)
+
+if __name__=='__main__':
+    unittest.main()
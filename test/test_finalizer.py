@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.finalizer import Finalizer
+
+class TestFinalizer(unittest.TestCase):
+
+    def testStates(self):
+        finalizer = Finalizer(workers=2)
+        release = threading.Event()
+        finalizer.submit('run1', release.wait)
+        self.assertEqual(finalizer.get_state('run1'), Finalizer.FINALISING)
+        self.assertEqual(finalizer.get_pending_count(), 1)
+        self.assertEqual(finalizer.pop_finished(), [])
+
+        release.set()
+        finalizer.join()
+        self.assertEqual(finalizer.get_state('run1'), Finalizer.FINALISED)
+        self.assertEqual(finalizer.pop_finished(), [('run1', Finalizer.FINALISED, None)])
+        self.assertEqual(finalizer.pop_finished(), [])
+
+    def testFailure(self):
+        logged = []
+        finalizer = Finalizer(workers=1, log_function=logged.append)
+        def fail(message):
+            raise OSError(message)
+        finalizer.submit('run1', fail, 'Cant move run')
+        finalizer.join()
+        [(key, state, error)] = finalizer.pop_finished()
+        self.assertEqual(state, Finalizer.FAILED)
+        self.assertTrue('Cant move run' in error)
+        self.assertEqual(finalizer.get_error('run1'), error)
+        self.assertEqual(len(logged), 1)
+
+    def testRunsConcurrently(self):
+        # Each run waits for the other to start, so this only finishes in time with two workers.
+        finalizer = Finalizer(workers=2)
+        started = {'run1': threading.Event(), 'run2': threading.Event()}
+        overlapped = []
+        def work(key, other):
+            started[key].set()
+            overlapped.append(started[other].wait(5))
+        finalizer.submit('run1', work, 'run1', 'run2')
+        finalizer.submit('run2', work, 'run2', 'run1')
+        finalizer.join()
+        self.assertEqual(overlapped, [True, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import tempfile
+import threading
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.lims_batch import LimsBatchClient, PrefetchedConnection, read_batch_commands, run_concurrently
+
+class FakeConnection:
+
+    def __init__(self):
+        self.lookups = []
+
+    def getruninfo(self, run):
+        self.lookups.append(run)
+        return {'run_name': run, 'source': 'lims'}
+
+    def updatesolexarun(self, run_id, paramdict):
+        return ('updated', run_id)
+
+class PagedClient(LimsBatchClient):
+
+    def __init__(self, known_runs, batch_size):
+        LimsBatchClient.__init__(self, 'http://lims/runinfo_batch', batch_size=batch_size)
+        self.known_runs = known_runs
+        self.pages = []
+
+    def fetch_page(self, run_names):
+        self.pages.append(run_names)
+        return dict((run, {'run_name': run}) for run in run_names if run in self.known_runs)
+
+class TestLimsBatch(unittest.TestCase):
+
+    def testPaging(self):
+        run_names = ['run%d' % i for i in range(5)]
+        client = PagedClient(known_runs=['run0', 'run3', 'run4'], batch_size=2)
+        records = client.get_runinfo_records(run_names)
+        self.assertEqual(client.pages, [['run0', 'run1'], ['run2', 'run3'], ['run4']])
+        self.assertEqual(sorted(records.keys()), ['run0', 'run3', 'run4'])
+
+    def testPrefetchedConnection(self):
+        conn = FakeConnection()
+        prefetched = PrefetchedConnection(conn, {'run0': {'run_name': 'run0', 'source': 'batch'}})
+        self.assertEqual(prefetched.getruninfo('run0')['source'], 'batch')
+        self.assertEqual(conn.lookups, [])
+        self.assertEqual(prefetched.getruninfo(run='run1')['source'], 'lims')
+        self.assertEqual(conn.lookups, ['run1'])
+        self.assertEqual(prefetched.updatesolexarun(7, {}), ('updated', 7))
+
+    def testReadBatchCommands(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write("# run field value\nrun1 archiving_done True\n\n  run2 archiving_done False\n")
+            f.flush()
+            self.assertEqual(read_batch_commands(f.name),
+                             [(2, ['run1', 'archiving_done', 'True']), (4, ['run2', 'archiving_done', 'False'])])
+
+    def testRunConcurrently(self):
+        threads = set()
+        def update(run):
+            threads.add(threading.current_thread().name)
+            if run == 'run3':
+                raise IOError('not found')
+            return run.upper()
+        results = run_concurrently(update, ['run%d' % i for i in range(6)], workers=3)
+        self.assertEqual([run for (run, result, error) in results], ['run%d' % i for i in range(6)])
+        self.assertEqual(results[0], ('run0', 'RUN0', None))
+        self.assertEqual(results[3], ('run3', None, 'IOError: not found'))
+        self.assertTrue(len(threads) <= 3)
+        self.assertEqual(run_concurrently(update, []), [])
+
+if __name__ == '__main__':
+    unittest.main()
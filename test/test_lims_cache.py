@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.lims_cache import LimsCache, NegativeCache
+
+class FakeLims:
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def fetch(self, run_name):
+        self.release.wait()
+        self.calls += 1
+        if self.fail:
+            raise IOError('LIMS unavailable')
+        return '%s-%d' % (run_name, self.calls)
+
+class TestLimsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.lims = FakeLims()
+        self.logged = []
+        self.cache = LimsCache(self.lims.fetch, ttl_seconds=60, max_stale_seconds=600,
+                               log_function=self.logged.append)
+
+    def wait_for_refresh(self):
+        for i in range(100):
+            if self.cache.get_refreshing_count() == 0:
+                return
+            time.sleep(0.01)
+
+    def testFresh(self):
+        self.assertEqual(self.cache.get('run'), 'run-1')
+        self.assertEqual(self.cache.get('run'), 'run-1')
+        self.assertEqual(self.lims.calls, 1)
+        self.assertEqual(self.cache.get('run', refresh=True), 'run-2')
+
+    def testStaleWhileRevalidate(self):
+        self.cache.get('run')
+        # The stale value comes back at once, even though the LIMS is stuck.
+        self.lims.release.clear()
+        self.assertEqual(self.cache.get('run', now=time.time() + 120), 'run-1')
+        self.assertEqual(self.cache.get('run', now=time.time() + 120), 'run-1')
+        self.assertEqual(self.cache.get_refreshing_count(), 1)
+        self.lims.release.set()
+        self.wait_for_refresh()
+        self.assertEqual(self.lims.calls, 2)
+        self.assertEqual(self.cache.get('run'), 'run-2')
+
+    def testTooStale(self):
+        self.cache.get('run')
+        self.assertEqual(self.cache.get('run', now=time.time() + 1200), 'run-2')
+
+    def testRefreshFailure(self):
+        self.cache.get('run')
+        self.lims.fail = True
+        self.assertEqual(self.cache.get('run', now=time.time() + 120), 'run-1')
+        self.wait_for_refresh()
+        self.assertEqual(self.cache.peek('run'), 'run-1')
+        self.assertEqual(len(self.logged), 1)
+        with self.assertRaises(IOError):
+            self.cache.get('run', refresh=True)
+
+    def testGetExpired(self):
+        self.cache.get('run1')
+        self.cache.put('run2', 'old', now=time.time() - 120)
+        self.assertEqual(self.cache.get_expired(['run1', 'run2', 'run3']), ['run2', 'run3'])
+
+    def testRetain(self):
+        self.cache.get('run1')
+        self.cache.get('run2')
+        self.cache.retain(['run2'])
+        self.assertFalse('run1' in self.cache)
+        self.assertTrue('run2' in self.cache)
+
+class TestNegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = NegativeCache(retry_seconds=10, max_retry_seconds=25)
+
+    def testBackoff(self):
+        now = time.time()
+        self.assertFalse(self.cache.should_skip('run', [1], now))
+        self.assertEqual(self.cache.record_miss('run', [1], now), 10)
+        self.assertTrue(self.cache.should_skip('run', [1], now + 9))
+        self.assertFalse(self.cache.should_skip('run', [1], now + 10))
+        self.assertEqual(self.cache.record_miss('run', [1], now + 10), 20)
+        self.assertEqual(self.cache.record_miss('run', [1], now + 30), 25)
+        self.assertEqual(self.cache.get_misses('run'), 3)
+        self.assertEqual(self.cache.skips, 1)
+
+    def testSignatureChange(self):
+        now = time.time()
+        self.cache.record_miss('run', [1, None], now)
+        self.cache.record_miss('run', [1, None], now)
+        # e.g. RunInfo.xml was written
+        self.assertFalse(self.cache.should_skip('run', [1, 2], now + 1))
+        self.assertEqual(self.cache.get_misses('run'), 0)
+        self.assertEqual(self.cache.record_miss('run', [1, 2], now + 1), 10)
+
+    def testRetain(self):
+        self.cache.record_miss('run1', [1])
+        self.cache.record_miss('run2', [1])
+        self.cache.retain(['run2'])
+        self.assertEqual(len(self.cache), 1)
+        self.cache.forget('run2')
+        self.assertEqual(len(self.cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import time
+import urllib2
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.lims_standin import EndpointFaults, LimsStandin, StandinHTTPServer
+from bin.rundir import RunDir
+
+class TestLimsStandin(unittest.TestCase):
+
+    def setUp(self):
+        self.run_root = os.path.realpath(os.path.join(os.path.dirname(__file__), 'testdata', 'RunRoot0'))
+        self.run_name = '141117_MONK_0387_AC4JCDACXX'
+        self.standin = LimsStandin(seed=1)
+        self.server = StandinHTTPServer(self.standin, port=0, quiet=True)
+        self.server.start()
+        self.url = self.server.get_url() + '/api/v1/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, path, method='GET', body=None):
+        """
+        Returns : (status, decoded JSON body).
+        """
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+        request = urllib2.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        request.get_method = lambda: method
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            return (e.code, json.loads(e.read()))
+        return (response.getcode(), json.loads(response.read()))
+
+    def testRunInfo(self):
+        self.standin.add_rundir(RunDir(self.run_root, self.run_name))
+        (status, record) = self.request('run_info?run=%s' % self.run_name)
+        self.assertEqual(status, 200)
+        self.assertEqual(record['run_name'], self.run_name)
+        self.assertEqual(record['sequencing_instrument'], 'MONK')
+        self.assertTrue(record['paired_end'])
+        (status, record) = self.request('run_info?run=141117_NOPE_0001_AC4JCDACXX')
+        self.assertEqual(status, 404)
+
+    def testAnyRun(self):
+        self.standin.any_run = True
+        self.assertEqual(self.request('run_info?run=150101_SN1_0001_A')[0], 200)
+        self.assertEqual(self.request('run_info?run=not_a_run')[0], 404)
+
+    def testBatch(self):
+        self.standin.add_run('run1')
+        (status, answer) = self.request('run_info_batch', method='POST', body={'runs': ['run1', 'run2']})
+        self.assertEqual(status, 200)
+        self.assertEqual(answer['runs'].keys(), ['run1'])
+
+    def testUpdates(self):
+        record = self.standin.add_run('run1')
+        (status, solexa_run) = self.request('solexa_runs/%s' % record['solexa_run_id'], method='PATCH',
+                                            body={'sequencer_done': True})
+        self.assertEqual(status, 200)
+        self.assertTrue(solexa_run['sequencer_done'])
+        self.assertEqual(self.standin.get_updates('solexa_runs'), [('solexa_runs', 1, {'sequencer_done': True})])
+        self.assertEqual(self.request('solexa_runs/99', method='PATCH', body={})[0], 404)
+        self.assertEqual(self.request('pipeline_runs/7', method='PUT', body={'finished': True})[0], 200)
+
+    def testSequencingFailed(self):
+        self.standin.add_run('run1')
+        self.assertEqual(self.request('standin/sequencing_failed?run=run1', method='POST')[0], 200)
+        self.assertEqual(self.request('run_info?run=run1')[1]['sequencing_run_status'], 'sequencing_failed')
+
+    def testFaults(self):
+        self.standin.add_run('run1')
+        self.standin.faults['run_info'] = EndpointFaults(errors=1.0)
+        self.assertEqual(self.request('run_info?run=run1')[0], 500)
+        self.standin.faults['run_info'] = EndpointFaults(latency=0.2)
+        start = time.time()
+        self.assertEqual(self.request('run_info?run=run1')[0], 200)
+        self.assertTrue(time.time() - start >= 0.2)
+        stats = self.request('standin/stats')[1]
+        self.assertEqual(stats['requests']['run_info'], 2)
+        self.assertEqual(stats['injected_errors']['run_info'], 1)
+
+    def testNotFoundBurst(self):
+        (endpoint, faults) = EndpointFaults.parse('run_info:notfound=0.5,notfound_burst=3')
+        self.assertEqual(endpoint, 'run_info')
+        statuses = []
+        while statuses.count(404) < 3:
+            statuses.append(faults.get_status(self.standin.random))
+        self.assertEqual(statuses[-3:], [404, 404, 404])
+        with self.assertRaises(ValueError):
+            EndpointFaults.parse('run_info:speed=2')
+
+if __name__ == '__main__':
+    unittest.main()
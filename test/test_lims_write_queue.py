@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.lims_write_queue import LimsWriteQueue, SEQUENCING_FAILED, SEQUENCING_FINISHED
+
+class FakeLims:
+
+    def __init__(self):
+        self.writes = []
+        self.failing_runs = set()
+        self.written = threading.Event()
+
+    def apply(self, run_name, operation):
+        if run_name in self.failing_runs:
+            raise IOError('LIMS unavailable')
+        self.writes.append((run_name, operation))
+        self.written.set()
+
+class TestLimsWriteQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, LimsWriteQueue.FILENAME)
+        self.lims = FakeLims()
+        self.logged = []
+        self.queue = self.make_queue()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_queue(self):
+        return LimsWriteQueue(self.path, self.lims.apply, retry_seconds=10, max_retry_seconds=25,
+                              log_function=self.logged.append)
+
+    def testDrain(self):
+        self.queue.put('run1', SEQUENCING_FINISHED)
+        self.queue.put('run2', SEQUENCING_FINISHED)
+        self.assertEqual(self.queue.get_depth(), 2)
+        self.assertEqual(self.queue.drain_once(), 2)
+        self.assertEqual(self.lims.writes, [('run1', SEQUENCING_FINISHED), ('run2', SEQUENCING_FINISHED)])
+        self.assertEqual(self.queue.get_depth(), 0)
+        self.assertEqual(self.queue.get_oldest_age(), None)
+
+    def testSummaryWhileLocked(self):
+        # As when SIGUSR1 arrives while the main thread is in put().
+        with self.queue.lock:
+            self.queue.put('run1', SEQUENCING_FINISHED)
+            self.assertEqual(self.queue.get_depth(), 1)
+
+    def testCoalesce(self):
+        self.queue.put('run1', SEQUENCING_FINISHED)
+        self.queue.put('run1', SEQUENCING_FINISHED)
+        self.assertEqual(self.queue.get_pending('run1'), [SEQUENCING_FINISHED])
+        self.queue.put('run1', SEQUENCING_FAILED)
+        self.assertEqual(self.queue.get_pending('run1'), [SEQUENCING_FAILED])
+        with self.assertRaises(ValueError):
+            self.queue.put('run1', 'delete_everything')
+
+    def testDurable(self):
+        self.queue.put('run1', SEQUENCING_FINISHED, now=time.time() - 30)
+        queue = self.make_queue()
+        self.assertEqual(queue.get_pending(), [SEQUENCING_FINISHED])
+        self.assertTrue(queue.get_oldest_age() >= 30)
+        queue.drain_once()
+        self.assertEqual(self.make_queue().get_depth(), 0)
+
+    def testRetryBackoff(self):
+        self.lims.failing_runs.add('run1')
+        now = time.time()
+        self.queue.put('run1', SEQUENCING_FINISHED)
+        self.queue.put('run1', SEQUENCING_FAILED)
+        self.queue.put('run2', SEQUENCING_FINISHED)
+        # run1 fails, and doesn't hold up run2.
+        self.assertEqual(self.queue.drain_once(now), 1)
+        self.assertEqual(self.lims.writes, [('run2', SEQUENCING_FINISHED)])
+        self.assertEqual(len(self.logged), 1)
+        self.assertEqual(self.queue.drain_once(now + 5), 0)
+        self.queue.drain_once(now + 10)
+        self.assertEqual(self.queue.drain_once(now + 29), 0)
+        # Capped at max_retry_seconds
+        self.queue.drain_once(now + 30)
+        self.assertEqual(self.queue.get_due(now + 54), [])
+        self.assertEqual(len(self.queue.get_due(now + 55)), 1)
+        self.lims.failing_runs.clear()
+        self.queue.drain_once(now + 55)
+        self.assertEqual(self.lims.writes[1:], [('run1', SEQUENCING_FAILED)])
+
+    def testWorker(self):
+        self.queue.start(poll_seconds=1)
+        self.queue.put('run1', SEQUENCING_FINISHED)
+        self.assertTrue(self.lims.written.wait(5))
+        for i in range(100):
+            if self.queue.get_depth() == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.queue.get_depth(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
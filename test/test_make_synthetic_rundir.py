@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.make_synthetic_rundir import SyntheticRun, parse_reads
+from bin.rundir import RunDir
+from bin import rundir_utils
+
+class TestMakeSyntheticRundir(unittest.TestCase):
+
+    def setUp(self):
+        self.run_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.run_root)
+
+    def testParseReads(self):
+        self.assertEqual(parse_reads('101,8i,101'), [(101, False), (8, True), (101, False)])
+        with self.assertRaises(ValueError):
+            parse_reads('101,x')
+
+    def testHiSeq(self):
+        run = SyntheticRun(self.run_root, 'hiseq', reads=[(3, False), (2, True), (3, False)], clusters_per_tile=10)
+        (rundir, file_count, total_bytes) = run.make()
+
+        rundir = RunDir(self.run_root, rundir.get_dir())
+        self.assertEqual(rundir.get_platform(), RunDir.PLATFORM_ILLUMINA_HISEQ)
+        self.assertEqual(rundir.get_cycle_list(), [3, 2, 3])
+        self.assertEqual(len(rundir.get_tile_list()), 48)
+        self.assertEqual(rundir.get_flowcell(), 'C4JCD')
+        self.assertTrue(rundir.is_finished())
+        self.assertTrue(rundir_utils.validate(rundir))
+
+        bcl_path = os.path.join(rundir.get_path(), 'Data/Intensities/BaseCalls/L008/C8.1/s_8_2308.bcl')
+        self.assertEqual(os.path.getsize(bcl_path), 14)
+        self.assertTrue(file_count > 8 * 48 * 8 * 2)
+
+    def testMiSeqAndGA(self):
+        for platform in ('miseq', 'ga'):
+            run = SyntheticRun(self.run_root, platform, reads=[(2, False), (2, False)], clusters_per_tile=10, cif=True)
+            (rundir, file_count, total_bytes) = run.make(fill='random')
+            rundir = RunDir(self.run_root, rundir.get_dir())
+            self.assertEqual(rundir.get_platform(), {'miseq': RunDir.PLATFORM_ILLUMINA_MISEQ,
+                                                     'ga': RunDir.PLATFORM_ILLUMINA_GA}[platform])
+            self.assertTrue(rundir.is_finished())
+            self.assertTrue(rundir_utils.validate(rundir, cif=True))
+
+    def testUnfinished(self):
+        run = SyntheticRun(self.run_root, 'hiseq', reads=[(2, False)], clusters_per_tile=10, finished=False)
+        (rundir, file_count, total_bytes) = run.make()
+        self.assertFalse(RunDir(self.run_root, rundir.get_dir()).is_finished())
+
+if __name__ == '__main__':
+    unittest.main()
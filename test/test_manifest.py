@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin import manifest
+from bin import transfer
+from bin.rundir import RunDir
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_root = os.path.join(self.tmp_dir, 'runs')
+        self.dest_root = os.path.join(self.tmp_dir, 'dest')
+        self.rundir = RunDir(self.run_root, '141117_MONK_0387_AC4JCDACXX')
+        run_path = self.rundir.get_path()
+        os.makedirs(os.path.join(run_path, 'Data', 'Intensities'))
+        os.makedirs(os.path.join(run_path, 'Thumbnail_Images', 'L001'))
+        self.write(os.path.join(run_path, 'RunInfo.xml'), '<RunInfo/>')
+        self.write(os.path.join(run_path, 'Data', 'Intensities', 's_1_1101.bcl'), 'x' * 100000)
+        self.write(os.path.join(run_path, 'Thumbnail_Images', 'L001', 'a.jpg'), 'jpg')
+        os.symlink('RunInfo.xml', os.path.join(run_path, 'link.xml'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, contents):
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def build(self):
+        builder = manifest.ManifestBuilder(self.rundir.get_path(), 'md5', threads=2,
+                                           excludes=transfer.TransferBackend.EXCLUDES)
+        builder.start()
+        builder.join(10)
+        self.assertTrue(builder.is_ok())
+        return builder
+
+    def testListFiles(self):
+        relpaths = manifest.list_files(self.rundir.get_path(), excludes=['Thumbnail_Images/'])
+        self.assertEqual(sorted(relpaths), ['Data/Intensities/s_1_1101.bcl', 'RunInfo.xml'])
+
+    def testHashFile(self):
+        path = os.path.join(self.rundir.get_path(), 'Data', 'Intensities', 's_1_1101.bcl')
+        self.assertEqual(manifest.hash_file(path, 'md5', read_size=4096), hashlib.md5('x' * 100000).hexdigest())
+
+    def testUnknownAlgorithm(self):
+        with self.assertRaises(ValueError):
+            manifest.get_hash_function('crc32')
+        self.assertTrue(manifest.resolve_algorithm('auto') in ('blake2b', 'md5'))
+
+    def testFormatAndParse(self):
+        builder = self.build()
+        text = builder.get_manifest()
+        self.assertEqual(text.splitlines()[-1], '%s  RunInfo.xml' % hashlib.md5('<RunInfo/>').hexdigest())
+        self.assertEqual(manifest.parse_manifest(text), builder.digests)
+
+    def testCompareDigests(self):
+        (missing, mismatched) = manifest.compare_digests({'a': '1', 'b': '2', 'c': '3'}, {'a': '1', 'b': '9'})
+        self.assertEqual(missing, ['c'])
+        self.assertEqual(mismatched, ['b'])
+
+    def testVerifyAtDestination(self):
+        builder = self.build()
+        backend = transfer.LocalBackend('localhost', 'autocopy', self.dest_root)
+        dest_run_path = backend.get_dest_path(self.rundir)
+        shutil.copytree(self.rundir.get_path(), dest_run_path, symlinks=True)
+
+        verifier = manifest.ManifestVerifier(builder, backend, dest_run_path, parallelism=2)
+        verifier.run()
+        self.assertTrue(verifier.is_ok())
+        self.assertTrue(os.path.exists(os.path.join(dest_run_path, 'Autocopy_manifest.md5')))
+
+        self.write(os.path.join(dest_run_path, 'RunInfo.xml'), '<RunInfo>')
+        os.remove(os.path.join(dest_run_path, 'Data', 'Intensities', 's_1_1101.bcl'))
+        verifier = manifest.ManifestVerifier(builder, backend, dest_run_path, parallelism=2)
+        verifier.run()
+        self.assertFalse(verifier.is_ok())
+        self.assertEqual(verifier.missing, ['Data/Intensities/s_1_1101.bcl'])
+        self.assertEqual(verifier.mismatched, ['RunInfo.xml'])
+
+if __name__ == '__main__':
+    unittest.main()
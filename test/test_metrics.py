@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import urllib2
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.metrics import MetricsRegistry, MetricsHTTPServer
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def testCounterAndGauge(self):
+        copies = self.registry.counter('copies_total', 'Copies finished')
+        rundirs = self.registry.gauge('rundirs', 'Runs by state', ['state'])
+        copies.inc()
+        copies.inc(2)
+        rundirs.set(3, state='copying')
+        rundirs.set(1, state='say "hi"\n')
+        self.assertEqual(copies.get(), 3)
+        self.assertEqual(rundirs.get(state='copying'), 3)
+        with self.assertRaises(ValueError):
+            copies.inc(-1)
+        with self.assertRaises(ValueError):
+            rundirs.set(1)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('rundirs', 'Again')
+        self.assertEqual(self.registry.render(),
+                         '# HELP copies_total Copies finished\n'
+                         '# TYPE copies_total counter\n'
+                         'copies_total 3\n'
+                         '# HELP rundirs Runs by state\n'
+                         '# TYPE rundirs gauge\n'
+                         'rundirs{state="copying"} 3\n'
+                         'rundirs{state="say \\"hi\\"\\n"} 1\n')
+
+    def testHistogram(self):
+        latency = self.registry.histogram('latency_seconds', 'LIMS latency', [0.5, 1], ['call'])
+        for seconds in [0.2, 0.7, 3]:
+            latency.observe(seconds, call='run_info')
+        (count, total) = latency.get(call='run_info')
+        self.assertEqual(count, 3)
+        self.assertAlmostEqual(total, 3.9)
+        lines = self.registry.render().splitlines()
+        self.assertIn('latency_seconds_bucket{call="run_info",le="0.5"} 1', lines)
+        self.assertIn('latency_seconds_bucket{call="run_info",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{call="run_info",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_count{call="run_info"} 3', lines)
+
+    def testTextfile(self):
+        self.registry.gauge('free_bytes', 'Free space').set(1024)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, MetricsRegistry.FILENAME)
+            self.registry.write_textfile(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), self.registry.render())
+            self.assertEqual(os.listdir(tmp_dir), [MetricsRegistry.FILENAME])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def testHTTPServer(self):
+        self.registry.gauge('copy_processes', 'Copy processes').set(2)
+        server = MetricsHTTPServer(self.registry, port=0)
+        server.start()
+        try:
+            self.assertEqual(urllib2.urlopen(server.get_url()).read(), self.registry.render())
+            with self.assertRaises(urllib2.HTTPError):
+                urllib2.urlopen(server.get_url().replace('/metrics', '/other'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
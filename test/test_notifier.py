@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import smtplib
+import sys
+import tempfile
+import time
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin.notifier import Notifier
+
+class FakeMailServer:
+
+    def __init__(self):
+        self.connections = 0
+        self.sent = []
+        self.down = False
+        self.disconnect_next = False
+        self.refuse = set()
+
+    def connect(self):
+        if self.down:
+            raise smtplib.SMTPConnectError(421, 'Service not available')
+        self.connections += 1
+        return FakeSession(self)
+
+class FakeSession:
+
+    def __init__(self, server):
+        self.server = server
+
+    def sendmail(self, from_addr, to, message):
+        if self.server.disconnect_next:
+            self.server.disconnect_next = False
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if to in self.server.refuse:
+            raise smtplib.SMTPRecipientsRefused({to: (550, 'No such user')})
+        self.server.sent.append((to, message))
+
+    def noop(self):
+        return (250, 'OK')
+
+    def quit(self):
+        pass
+
+class TestNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, Notifier.FILENAME)
+        self.server = FakeMailServer()
+        self.logged = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_notifier(self, **kwargs):
+        return Notifier(self.server.connect, path=self.path, retry_seconds=0.05, max_retry_seconds=0.1,
+                        log_function=self.logged.append, **kwargs)
+
+    def testSendInOrderOverOneSession(self):
+        notifier = self.make_notifier()
+        notifier.start()
+        for i in range(3):
+            notifier.put('autocopy@example.com', 'ops@example.com', 'message %d' % i)
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual([message for (to, message) in self.server.sent], ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(self.server.connections, 1)
+
+    def testReconnect(self):
+        notifier = self.make_notifier()
+        notifier.start()
+        notifier.put('autocopy@example.com', 'ops@example.com', 'first')
+        self.assertTrue(notifier.flush(5))
+        self.server.disconnect_next = True
+        notifier.put('autocopy@example.com', 'ops@example.com', 'second')
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(len(self.server.sent), 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def testRetryWhileDown(self):
+        self.server.down = True
+        notifier = self.make_notifier()
+        notifier.start()
+        notifier.put('autocopy@example.com', 'ops@example.com', 'message')
+        time.sleep(0.2)
+        self.assertEqual(notifier.get_depth(), 1)
+        self.server.down = False
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(len(self.server.sent), 1)
+
+    def testDropRefusedAndFailed(self):
+        self.server.refuse.add('nobody@example.com')
+        notifier = self.make_notifier(max_attempts=2)
+        notifier.start()
+        notifier.put('autocopy@example.com', 'nobody@example.com', 'refused')
+        self.assertTrue(notifier.flush(5))
+        # The open session drops, and reconnecting fails.
+        self.server.down = True
+        self.server.disconnect_next = True
+        notifier.put('autocopy@example.com', 'ops@example.com', 'failed')
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(notifier.dropped, 2)
+        self.assertEqual(self.server.sent, [])
+
+    def testRefusedOnNewSession(self):
+        # Nothing sent on the session yet, so only its opening says when it was last used.
+        self.server.refuse.add('nobody@example.com')
+        notifier = self.make_notifier(keepalive_seconds=0.05)
+        notifier.start()
+        notifier.put('autocopy@example.com', 'nobody@example.com', 'refused')
+        self.assertTrue(notifier.flush(5))
+        time.sleep(0.2)
+        notifier.put('autocopy@example.com', 'ops@example.com', 'sent')
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual(self.server.sent, [('ops@example.com', 'sent')])
+        self.assertFalse([text for text in self.logged if text.startswith('Email sender error')])
+
+    def testPutWhileLocked(self):
+        # As when a signal handler sends email while the main thread is in put().
+        notifier = self.make_notifier()
+        with notifier.lock:
+            notifier.put('autocopy@example.com', 'ops@example.com', 'message')
+        self.assertEqual(notifier.get_depth(), 1)
+
+    def testDurableAndCapped(self):
+        notifier = self.make_notifier(max_queued=2)
+        for i in range(3):
+            notifier.put('autocopy@example.com', 'ops@example.com', 'message %d' % i)
+        self.assertEqual(notifier.dropped, 1)
+        # Not started, so nothing was sent; a new notifier picks the queue up.
+        notifier = self.make_notifier()
+        self.assertEqual(notifier.get_depth(), 2)
+        notifier.start()
+        self.assertTrue(notifier.flush(5))
+        self.assertEqual([message for (to, message) in self.server.sent], ['message 1', 'message 2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin import profiling
+from bin.profiling import LoopProfiler, ControlFileWatcher
+
+def busy_pass():
+    return sum(i * i for i in range(1000))
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.logged = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testThreadStacks(self):
+        release = threading.Event()
+        thread = threading.Thread(target=release.wait, name='waiter')
+        thread.start()
+        try:
+            text = profiling.format_thread_stacks()
+        finally:
+            release.set()
+            thread.join()
+        self.assertIn('Thread MainThread', text)
+        self.assertIn('Thread waiter', text)
+        self.assertIn('testThreadStacks', text)
+        self.assertTrue(text.index('Thread MainThread') < text.index('Thread waiter'))
+
+    def testProfileRequestedPasses(self):
+        profiler = LoopProfiler(self.dir, top=5, log_function=self.logged.append)
+        self.assertEqual(profiler.profile(busy_pass), busy_pass())
+        self.assertEqual(os.listdir(self.dir), [])
+        profiler.request(2)
+        profiler.profile(busy_pass)
+        self.assertEqual(os.listdir(self.dir), [])
+        profiler.profile(busy_pass)
+        self.assertFalse(profiler.is_active())
+        files = sorted(os.listdir(self.dir))
+        self.assertEqual([os.path.splitext(name)[1] for name in files], ['.pstats', '.txt'])
+        with open(os.path.join(self.dir, files[1])) as f:
+            summary = f.read()
+        self.assertIn('Profile of 2 main loop passes', summary)
+        self.assertIn('busy_pass', summary)
+        self.assertEqual(len(self.logged), 1)
+
+    def testProfileFailedPass(self):
+        profiler = LoopProfiler(os.path.join(self.dir, 'missing'), log_function=self.logged.append)
+        profiler.request(1)
+        with self.assertRaises(ZeroDivisionError):
+            profiler.profile(lambda: 1/0)
+        # Couldn't write the report; logged, not raised.
+        self.assertFalse(profiler.is_active())
+        self.assertIn('Failed to write profile', self.logged[0])
+
+    def testRequestWhileLocked(self):
+        # As when SIGUSR2 arrives while the main thread is in is_active() or profile().
+        profiler = LoopProfiler(self.dir)
+        with profiler.lock:
+            profiler.request(1)
+        self.assertTrue(profiler.is_active())
+
+    def testControlFile(self):
+        commands = []
+        path = os.path.join(self.dir, 'autocopy.debug')
+        watcher = ControlFileWatcher(path, commands.append)
+        self.assertEqual(watcher.check(), [])
+        with open(path, 'w') as f:
+            f.write('stacks\n\nprofile 3\n')
+        watcher.check()
+        self.assertEqual(commands, [['stacks'], ['profile', '3']])
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
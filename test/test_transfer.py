@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os
+import subprocess
+import sys
+
+if sys.version_info[0:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bin import transfer
+from bin.rundir import RunDir
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.rundir = RunDir('/runs', '141117_MONK_0387_AC4JCDACXX')
+
+    def testRsyncCommand(self):
+        backend = transfer.RsyncBackend('crick', 'autocopy', '/dest/runs/', rsync_progress_args=['--stats'])
+        cmd = backend.get_copy_command(self.rundir)
+        self.assertEqual(cmd[0:2], ['rsync', '-rlptc'])
+        self.assertTrue('--exclude=Thumbnail_Images/' in cmd)
+        self.assertTrue('--stats' in cmd)
+        self.assertEqual(cmd[-2:], ['/runs/141117_MONK_0387_AC4JCDACXX', 'crick:/dest/runs'])
+
+        cmd = backend.get_copy_command(self.rundir, resume=True)
+        self.assertFalse('-rlptc' in cmd)
+        self.assertTrue('--partial' in cmd)
+
+        cmd = backend.get_copy_command(self.rundir, checksum=False)
+        self.assertEqual(cmd[0:2], ['rsync', '-rlpt'])
+        cmd = backend.get_copy_command(self.rundir, resume=True, checksum=True)
+        self.assertEqual(cmd[0:3], ['rsync', '-rlptc', '--partial'])
+
+    def testLocalCommand(self):
+        backend = transfer.LocalBackend('crick', 'autocopy', '/dest/runs')
+        cmd = backend.get_copy_command(self.rundir)
+        self.assertFalse('-e' in cmd)
+        self.assertEqual(cmd[-1], '/dest/runs')
+        self.assertEqual(backend.get_dest_command(['touch', 'x']), ['touch', 'x'])
+
+    def testDestCommandQuoting(self):
+        backend = transfer.RsyncBackend('crick', 'autocopy', '~/copied_runs')
+        cmd = backend.get_dest_command(['touch', '~/copied_runs/a b'])
+        self.assertEqual(cmd, ['ssh', '-l', 'autocopy', 'crick', "touch ~/'copied_runs/a b'"])
+
+    def testTarCannotResume(self):
+        backend = transfer.TarSshBackend('crick', 'autocopy', '/dest/runs')
+        self.assertFalse(backend.RESUMABLE)
+        with self.assertRaises(ValueError):
+            backend.start(self.rundir, resume=True)
+
+    def testPipelineProcess(self):
+        producer = subprocess.Popen(['sh', '-c', 'echo hello; exit 3'], stdout=subprocess.PIPE)
+        consumer = subprocess.Popen(['cat'], stdin=producer.stdout, stdout=subprocess.PIPE)
+        producer.stdout.close()
+        proc = transfer.PipelineProcess(producer, consumer)
+        consumer.stdout.read()
+        self.assertEqual(proc.wait(), 3)
+
+    def testGetBackendClass(self):
+        self.assertEqual(transfer.get_backend_class('tar_ssh'), transfer.TarSshBackend)
+        with self.assertRaises(ValueError):
+            transfer.get_backend_class('ftp')
+
+if __name__=='__main__':
+    unittest.main()